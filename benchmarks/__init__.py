@@ -0,0 +1,2 @@
+# benchmarks for tcy (not part of the installed package). Run them from the
+# root of the repository, e.g. 'python -m benchmarks.bench_phases'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark (and guard) the start-up time of tcy
+
+Notes:
+
+- Measures the time that 'import tcy' and a complete 'tcy linux ...' run take
+  in a fresh interpreter (best of n repetitions).
+- Fails (exit code 1) if heavy modules (pandas, pytest) are imported on the
+  default code path or if the measured times exceed the given limits.
+
+Usage:
+
+    python benchmarks/bench_import.py [--repeat 10] [--max_import_ms 100] [--max_run_ms 150]
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TSV_PATH = os.path.join(REPO_DIR,'environments','packages.tsv')
+
+# modules that must not be imported on the default code path
+HEAVY_MODULES = ['pandas','numpy','pytest']
+
+IMPORT_SNIPPET = '''
+import sys, time, json
+t = time.perf_counter()
+import tcy
+elapsed = time.perf_counter() - t
+print(json.dumps({'seconds':elapsed,'modules':[m for m in %r if m in sys.modules]}))
+'''
+
+RUN_SNIPPET = '''
+import sys, time, json
+t = time.perf_counter()
+from tcy.tcy import main
+sys.argv = ['tcy','linux','--tsv_path',%r,'--yml_dir',%r]
+main()
+elapsed = time.perf_counter() - t
+print(json.dumps({'seconds':elapsed,'modules':[m for m in %r if m in sys.modules]}))
+'''
+
+def measure(snippet,repeat):
+    '''Run the snippet in a fresh interpreter and return the best time and
+    the heavy modules that were imported'''
+
+    env = {**os.environ,'PYTHONPATH':os.pathsep.join([REPO_DIR,os.environ.get('PYTHONPATH','')])}
+    results = []
+
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable,'-c',snippet],env=env,check=True,
+                             capture_output=True,text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    return min(r['seconds'] for r in results),sorted(set(m for r in results for m in r['modules']))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark and guard the start-up time of tcy')
+    parser.add_argument('--repeat',type=int,default=10,help='Number of fresh interpreters per measurement')
+    parser.add_argument('--max_import_ms',type=float,default=100,help='Upper limit for "import tcy"')
+    parser.add_argument('--max_run_ms',type=float,default=150,help='Upper limit for a complete tcy run')
+    args = parser.parse_args()
+
+    failures = []
+
+    with tempfile.TemporaryDirectory() as yml_dir:
+
+        for name,snippet,limit in [('import tcy',IMPORT_SNIPPET % HEAVY_MODULES,args.max_import_ms),
+                                   ('tcy linux',RUN_SNIPPET % (TSV_PATH,yml_dir,HEAVY_MODULES),args.max_run_ms)]:
+
+            seconds,modules = measure(snippet,args.repeat)
+            print(f"{name:<12} {seconds * 1000:8.1f} ms (limit {limit:.0f} ms)")
+
+            if modules:
+                failures.append(f"{name} imported heavy modules: {', '.join(modules)}")
+            if seconds * 1000 > limit:
+                failures.append(f"{name} took {seconds * 1000:.1f} ms (limit {limit:.0f} ms)")
+
+    if failures:
+        sys.exit('\n'.join(failures))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark every phase of tcy on synthetic catalogs and compare the results
+with a previous run
+
+Notes:
+
+- Phases: parse (reading the .tsv file), validation (all rules of
+  test_configs.json, on a catalog that contains errors if --error_rate is
+  set), filter_sort (selecting and sorting the packages), emission (writing
+  environment.yml and requirements.txt), cran_script (writing the CRAN
+  installation script) and cli (a complete 'tcy linux ...' call in a fresh
+  interpreter).
+- Results are saved as .json file. With --compare, the results are compared
+  phase by phase with a previous .json file and the script fails (exit code 1)
+  if a phase became slower than the given tolerance allows.
+
+Usage:
+
+    python -m benchmarks.bench_phases --rows 1000 100000 --output results.json
+    python -m benchmarks.bench_phases --rows 1000 100000 --compare results.json --tolerance 0.25
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_DIR)
+
+import tcy
+from tcy import validation
+from tcy.table import read_tsv
+from tcy.tcy import select_packages, get_conda_channels, write_cran_installation_script
+from tcy.render import render_yml, render_requirements, write_atomic
+from benchmarks.synthetic import write_catalog, parse_distribution
+
+CLI_SNIPPET = 'from tcy.tcy import main; main()'
+
+def timeit(function,repeat):
+    '''Returns all measured times (in seconds) of calling function repeat times'''
+
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t)
+    return times
+
+def emit(selection,out_dir):
+    '''Output stage of run() for an already selected table'''
+
+    manager = selection['package_manager']
+    conda_packages = [(n,v,c) for n,v,c,m in zip(selection['package_name'],selection['version'],
+                                                 selection['conda_channel'],manager) if m == 'conda']
+    pip_packages = [n for n,m in zip(selection['package_name'],manager) if m == 'pip']
+
+    write_atomic(os.path.join(out_dir,'requirements.txt'),render_requirements(pip_packages))
+    write_atomic(os.path.join(out_dir,'environment.yml'),
+                 render_yml(get_conda_channels(selection),conda_packages,pip_packages,bool(pip_packages),
+                            'bench',False,True))
+
+def emit_cran_script(selection,out_dir):
+    '''Writes the CRAN installation script for all CRAN-packages of a selection'''
+
+    cran_packages = [n for n,m in zip(selection['package_name'],selection['package_manager']) if m == 'cran']
+    write_cran_installation_script(os.path.join(out_dir,'install_cran_packages.sh'),'bench',
+                                   cran_packages,'https://cloud.r-project.org')
+
+def run_cli(tsv_path,out_dir):
+    env = {**os.environ,'PYTHONPATH':os.pathsep.join([REPO_DIR,os.environ.get('PYTHONPATH','')])}
+    subprocess.run([sys.executable,'-c',CLI_SNIPPET,'linux','--tsv_path',tsv_path,'--yml_dir',out_dir,
+                    '--pip_requirements_file','--force'],env=env,check=True)
+
+def benchmark(n_rows,repeat,catalog_kwargs,error_rate,tmp_dir):
+    '''Returns the timings of all phases for a catalog with n_rows packages'''
+
+    tsv_path = os.path.join(tmp_dir,'packages.tsv')
+    write_catalog(tsv_path,n_rows,**catalog_kwargs)
+
+    test_configs = validation.load_test_configs()
+    table = read_tsv(tsv_path)
+    selection = select_packages(table,'linux')
+
+    phases = {'parse':lambda: read_tsv(tsv_path),
+              'filter_sort':lambda: select_packages(table,'linux'),
+              'emission':lambda: emit(selection,tmp_dir),
+              'cran_script':lambda: emit_cran_script(selection,tmp_dir),
+              'cli':lambda: run_cli(tsv_path,tmp_dir)}
+
+    # validation is measured on a catalog that contains errors (if requested)
+    if error_rate:
+        error_path = os.path.join(tmp_dir,'packages_with_errors.tsv')
+        write_catalog(error_path,n_rows,error_rate=error_rate,**catalog_kwargs)
+        error_table = read_tsv(error_path)
+        phases['validation'] = lambda: validation.validate(error_path,test_configs,error_table)
+    else:
+        phases['validation'] = lambda: validation.validate(tsv_path,test_configs,table)
+
+    results = []
+    for phase in ['parse','validation','filter_sort','emission','cran_script','cli']:
+        times = timeit(phases[phase],repeat)
+        results.append({'phase':phase,'rows':n_rows,'min_seconds':min(times),
+                        'median_seconds':statistics.median(times),'repeat':repeat})
+    return results
+
+def compare(results,previous,tolerance):
+    '''Compare results phase by phase with a previous run. Returns the
+    phases that became slower than the tolerance allows'''
+
+    previous = {(r['phase'],r['rows']):r for r in previous['results']}
+    regressions = []
+
+    print(f"\n{'phase':<12} {'rows':>10} {'before (s)':>11} {'now (s)':>9} {'ratio':>7}")
+
+    for result in results:
+        key = (result['phase'],result['rows'])
+        if key not in previous:
+            continue
+        before,now = previous[key]['min_seconds'],result['min_seconds']
+        ratio = now / before if before else float('inf')
+        flag = ' <-- regression' if ratio > 1 + tolerance else ''
+        print(f"{key[0]:<12} {key[1]:>10} {before:>11.4f} {now:>9.4f} {ratio:>7.2f}{flag}")
+        if flag:
+            regressions.append(result)
+
+    return regressions
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark every phase of tcy on synthetic catalogs')
+    parser.add_argument('--rows',type=int,nargs='+',default=[1_000,10_000,100_000])
+    parser.add_argument('--repeat',type=int,default=5)
+    parser.add_argument('--language_mix',type=parse_distribution,default=None,
+                        help="e.g. 'python=0.6,r=0.3,julia=0.1'")
+    parser.add_argument('--n_channels',type=int,default=5)
+    parser.add_argument('--version_density',type=float,default=0.3)
+    parser.add_argument('--bug_flags',type=parse_distribution,default=None,
+                        help="e.g. '=0.85,linux=0.05,windows=0.05,cross-platform=0.05'")
+    parser.add_argument('--error_rate',type=float,default=0.0,
+                        help='Fraction of rows with validation errors (only used for the validation phase)')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',type=str,default=None,help='Save the results to this .json file')
+    parser.add_argument('--compare',type=str,default=None,help='Compare the results with this .json file')
+    parser.add_argument('--tolerance',type=float,default=0.25,
+                        help='Allowed relative slow-down per phase when comparing. The default is 0.25')
+    args = parser.parse_args()
+
+    catalog_kwargs = {'language_mix':args.language_mix,'n_channels':args.n_channels,
+                      'version_density':args.version_density,'bug_flags':args.bug_flags,'seed':args.seed}
+
+    results = []
+
+    print(f"{'phase':<12} {'rows':>10} {'min (s)':>9} {'median (s)':>11}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in args.rows:
+            for result in benchmark(n_rows,args.repeat,catalog_kwargs,args.error_rate,tmp_dir):
+                results.append(result)
+                print(f"{result['phase']:<12} {n_rows:>10} {result['min_seconds']:>9.4f} {result['median_seconds']:>11.4f}")
+
+    output = {'meta':{'tcy_version':tcy.__version__,
+                      'python':platform.python_version(),
+                      'platform':platform.platform(),
+                      'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'catalog':{**catalog_kwargs,'error_rate':args.error_rate}},
+              'results':results}
+
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(output,f,indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results,json.load(f),args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} phase(s) became slower than the tolerance allows")
+
+if __name__ == '__main__':
+    main()
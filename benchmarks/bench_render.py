@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the output stage of tcy: the previous iterrows loop (which opened
+environment.yml three times and appended row by row) against the buffered,
+single-write renderers of tcy.render
+
+Notes:
+
+- Only the output stage is timed. The packages are selected and sorted
+  beforehand (like run() does).
+- Requires pandas (the previous implementation iterated over a data frame).
+
+Usage:
+
+    python benchmarks/bench_render.py [--rows 10000 1000000]
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from benchmarks.synthetic import write_catalog
+from tcy.tcy import select_packages, get_conda_channels
+from tcy.table import read_tsv
+from tcy.render import render_yml, render_requirements, write_atomic
+
+def legacy_loop(df,conda_channels,yml_path,requirements_path,write_conda_channels,pip_requirements_file):
+    '''The output stage of run() before tcy.render existed'''
+
+    with open(yml_path,'w') as f:
+        f.write('channels:\n')
+        if write_conda_channels == False:
+            for channel in conda_channels:
+                f.write(f"- {channel}\n")
+        f.write('- defaults\n')
+        f.write('dependencies:\n')
+
+    with open(yml_path,'a') as f:
+        df_conda = df.loc[df['package_manager'] == 'conda']
+        for idx,row in df_conda.iterrows():
+            row = row.to_dict()
+            command = f"{row['package_name']}"
+            if write_conda_channels:
+                command = f"{row['conda_channel']}::{command}"
+            if not pd.isna(row['version']):
+                command = f"{command}{row['version']}"
+            f.write(f"- {command}\n")
+
+    if 'pip' in df['package_manager'].values:
+        with open(yml_path,'a') as f:
+            df_pip = df.loc[df['package_manager'] == 'pip']
+            f.write('- pip\n')
+            f.write('- pip:\n')
+            if pip_requirements_file == False:
+                for idx,row in df_pip.iterrows():
+                    f.write(f"  - {row.to_dict()['package_name']}\n")
+            if pip_requirements_file == True:
+                f.write('  - -r requirements.txt')
+                with open(requirements_path,'w') as rf:
+                    for idx,row in df_pip.iterrows():
+                        rf.write(f"{row.to_dict()['package_name']}\n")
+
+def buffered(table,conda_channels,yml_path,requirements_path,write_conda_channels,pip_requirements_file):
+    '''The output stage of run() with tcy.render'''
+
+    manager = table['package_manager']
+    conda_packages = [(n,v,c) for n,v,c,m in zip(table['package_name'],table['version'],table['conda_channel'],manager)
+                      if m == 'conda']
+    pip_packages = [n for n,m in zip(table['package_name'],manager) if m == 'pip']
+    has_pip = len(pip_packages) > 0
+
+    if has_pip and pip_requirements_file:
+        write_atomic(requirements_path,render_requirements(pip_packages))
+    write_atomic(yml_path,render_yml(conda_channels,conda_packages,pip_packages,has_pip,None,
+                                     write_conda_channels,pip_requirements_file))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the output stage of tcy')
+    parser.add_argument('--rows',type=int,nargs='+',default=[10_000,1_000_000])
+    parser.add_argument('--output',type=str,default=None,help='Optional path to a .json file for the results')
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        print(f"{'rows':>10} {'legacy loop (s)':>16} {'buffered (s)':>13} {'speed-up':>9} {'identical':>10}")
+
+        for n_rows in args.rows:
+            tsv_path = os.path.join(tmp_dir,'packages.tsv')
+            write_catalog(tsv_path,n_rows)
+
+            table = select_packages(read_tsv(tsv_path),'linux')
+            df = table.to_dataframe()
+            conda_channels = get_conda_channels(table)
+
+            paths = {}
+            timings = {}
+            for name,function,data in [('legacy',legacy_loop,df),('buffered',buffered,table)]:
+                paths[name] = os.path.join(tmp_dir,f"{name}.yml")
+                t = time.perf_counter()
+                function(data,conda_channels,paths[name],os.path.join(tmp_dir,f"{name}.txt"),True,False)
+                timings[name] = time.perf_counter() - t
+
+            with open(paths['legacy']) as f1,open(paths['buffered']) as f2:
+                identical = f1.read() == f2.read()
+
+            results.append({'rows':n_rows,'legacy_seconds':timings['legacy'],
+                            'buffered_seconds':timings['buffered'],'identical':identical})
+            print(f"{n_rows:>10} {timings['legacy']:>16.3f} {timings['buffered']:>13.3f} "
+                  f"{timings['legacy'] / timings['buffered']:>8.1f}x {str(identical):>10}")
+
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+
+    if not all(r['identical'] for r in results):
+        sys.exit('The buffered renderer does not produce the same file as the legacy loop')
+
+if __name__ == '__main__':
+    main()
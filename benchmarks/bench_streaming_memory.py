@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the peak memory (RSS) of the tcy engines against the number of rows
+
+Notes:
+
+- Every measurement runs in a fresh interpreter, peak RSS is taken from
+  resource.getrusage (Linux/macOS only).
+- The peak RSS of the 'streaming' engine should stay flat once the number of
+  selected packages exceeds its sort buffer, while the in-memory engines
+  grow linearly with the size of the .tsv file. This includes the check for
+  conflicting version specs, whose entries are sorted on disk as well (use
+  --version_density 1 to give every conda package a version spec).
+- With --max_growth_mb, the benchmark fails (exit status 1) if the peak RSS
+  of the 'streaming' engine grows by more than this between the smallest and
+  the largest catalog.
+
+Usage:
+
+    python benchmarks/bench_streaming_memory.py [--rows 10000 100000 1000000] [--engines csv streaming]
+    python benchmarks/bench_streaming_memory.py --rows 200000 800000 --engines streaming --version_density 1 --buffer_rows 10000 --max_growth_mb 5
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_DIR)
+
+from benchmarks.synthetic import write_catalog
+from tcy.streaming import DEFAULT_BUFFER_ROWS
+
+SNIPPET = '''
+import sys, time, json, resource
+from tcy import run
+from tcy.streaming import write_environment_files
+tsv_path, yml_dir, engine, buffer_rows = %r, %r, %r, %r
+t = time.perf_counter()
+if engine == 'streaming':
+    write_environment_files(tsv_path,'linux',yml_dir=yml_dir,buffer_rows=buffer_rows)
+else:
+    run('linux',tsv_path=tsv_path,yml_dir=yml_dir,engine=engine,force=True)
+elapsed = time.perf_counter() - t
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+if sys.platform == 'darwin':
+    maxrss = maxrss / 1024
+print(json.dumps({'seconds':elapsed,'peak_rss_mb':maxrss / 1024}))
+'''
+
+def measure(tsv_path,yml_dir,engine,buffer_rows=DEFAULT_BUFFER_ROWS):
+    env = {**os.environ,'PYTHONPATH':os.pathsep.join([REPO_DIR,os.environ.get('PYTHONPATH','')])}
+    out = subprocess.run([sys.executable,'-c',SNIPPET % (tsv_path,yml_dir,engine,buffer_rows)],env=env,
+                         check=True,capture_output=True,text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark peak memory of tcy against the number of rows')
+    parser.add_argument('--rows',type=int,nargs='+',default=[10_000,100_000,1_000_000])
+    parser.add_argument('--engines',type=str,nargs='+',default=['csv','streaming'])
+    parser.add_argument('--version_density',type=float,default=0.3,
+                        help='Fraction of conda packages with a version spec (see benchmarks.synthetic)')
+    parser.add_argument('--buffer_rows',type=int,default=DEFAULT_BUFFER_ROWS,
+                        help='Sort buffer of the streaming engine')
+    parser.add_argument('--max_growth_mb',type=float,default=None,
+                        help='Fail if the peak RSS of the streaming engine grows by more than this')
+    parser.add_argument('--output',type=str,default=None,help='Optional path to a .json file for the results')
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        print(f"{'rows':>10} {'engine':>10} {'seconds':>9} {'peak RSS (MB)':>14}")
+
+        for n_rows in args.rows:
+            tsv_path = os.path.join(tmp_dir,f"packages_{n_rows}.tsv")
+            write_catalog(tsv_path,n_rows,version_density=args.version_density)
+
+            for engine in args.engines:
+                result = {'rows':n_rows,'engine':engine,**measure(tsv_path,tmp_dir,engine,args.buffer_rows)}
+                results.append(result)
+                print(f"{n_rows:>10} {engine:>10} {result['seconds']:>9.2f} {result['peak_rss_mb']:>14.1f}")
+
+            os.remove(tsv_path)
+
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+
+    streaming = [result['peak_rss_mb'] for result in results if result['engine'] == 'streaming']
+    if args.max_growth_mb is not None and len(streaming) > 1:
+        growth = streaming[-1] - streaming[0]
+        print(f"peak RSS of the streaming engine grew by {growth:.1f} MB (limit {args.max_growth_mb:.1f} MB)")
+        if growth > args.max_growth_mb:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
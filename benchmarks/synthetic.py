@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic packages.tsv files for benchmarks
+
+Notes:
+
+- Files are written row by row, so catalogs of any size can be generated.
+- The generated files are valid (according to the test_configs.json file
+  that is shipped with tcy) unless error_rate is larger than 0. In this case
+  the given fraction of rows contains one validation error each (a leading
+  whitespace, an invalid option or an empty required cell).
+
+Usage:
+
+    python -m benchmarks.synthetic packages.tsv --rows 100000 --n_channels 20 --error_rate 0.01
+
+@author: Johannes.Wiesner
+"""
+
+import random
+
+COLUMNS = ['package_name','version','package_manager','conda_channel','include','language','bug_flag']
+
+# channels that are used first, further channels are called channel-<i>
+KNOWN_CHANNELS = ['conda-forge','bioconda','defaults','r','pytorch','nvidia']
+
+# package managers that can be used for each language
+MANAGERS = {'python':['conda','pip'],'r':['conda','cran'],'julia':['conda']}
+
+VERSION_SPECS = ['>=1.0','=2.1','<3','>=0.5,<0.6','==4.2.0','=1.2.*']
+
+DEFAULT_LANGUAGE_MIX = {'python':0.6,'r':0.3,'julia':0.1}
+DEFAULT_BUG_FLAGS = {'':0.85,'linux':0.05,'windows':0.05,'cross-platform':0.05}
+
+def _choices(rng,distribution,k):
+    '''Draw k values from a dictionary that maps values to weights'''
+
+    return rng.choices(list(distribution),weights=list(distribution.values()),k=k)
+
+def generate_rows(n_rows,
+                  language_mix=None,
+                  n_channels=5,
+                  version_density=0.3,
+                  bug_flags=None,
+                  error_rate=0.0,
+                  include_rate=0.9,
+                  seed=0):
+    '''Yields the rows (lists of strings) of a synthetic catalog
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of packages.
+    language_mix : dict, optional
+        Maps languages to their relative frequency. The default is
+        DEFAULT_LANGUAGE_MIX.
+    n_channels : int, optional
+        Number of distinct conda channels. The default is 5.
+    version_density : float, optional
+        Fraction of packages with a version specification. The default is 0.3.
+    bug_flags : dict, optional
+        Maps bug flags ('' for none) to their relative frequency. The default
+        is DEFAULT_BUG_FLAGS.
+    error_rate : float, optional
+        Fraction of rows with a validation error. The default is 0.
+    include_rate : float, optional
+        Fraction of packages with include set to true. The default is 0.9.
+    seed : int, optional
+        Seed of the random number generator. The default is 0.
+
+    '''
+
+    rng = random.Random(seed)
+    language_mix = language_mix or DEFAULT_LANGUAGE_MIX
+    bug_flags = bug_flags or DEFAULT_BUG_FLAGS
+    channels = (KNOWN_CHANNELS + [f"channel-{i}" for i in range(max(0,n_channels - len(KNOWN_CHANNELS)))])[:n_channels]
+
+    # draw in blocks to keep the generator fast for large catalogs
+    block = 10_000
+
+    for start in range(0,n_rows,block):
+        n = min(block,n_rows - start)
+        languages = _choices(rng,language_mix,n)
+        flags = _choices(rng,bug_flags,n)
+
+        for i,(language,bug_flag) in enumerate(zip(languages,flags),start=start):
+            manager = rng.choice(MANAGERS[language])
+            name = f"{language}-package-{i}" if manager != 'cran' else f"Rpackage{i}"
+            row = [name,
+                   rng.choice(VERSION_SPECS) if manager == 'conda' and rng.random() < version_density else '',
+                   manager,
+                   rng.choice(channels) if manager == 'conda' else '',
+                   'true' if rng.random() < include_rate else 'false',
+                   language,
+                   bug_flag]
+
+            if error_rate and rng.random() < error_rate:
+                kind = rng.randrange(3)
+                if kind == 0:
+                    row[0] = ' ' + row[0]
+                elif kind == 1:
+                    row[2] = 'brew'
+                else:
+                    row[5] = ''
+
+            yield row
+
+def write_catalog(path,n_rows,**kwargs):
+    '''Write a synthetic catalog with n_rows packages to path. All keyword
+    arguments are passed to generate_rows'''
+
+    with open(path,'w',newline='') as f:
+        f.write('\t'.join(COLUMNS) + '\n')
+        for row in generate_rows(n_rows,**kwargs):
+            f.write('\t'.join(row) + '\n')
+
+def parse_distribution(text):
+    '''Parse 'python=0.6,r=0.3,julia=0.1' into a dictionary'''
+
+    distribution = {}
+    for item in text.split(','):
+        key,value = item.split('=')
+        distribution[key.strip()] = float(value)
+    return distribution
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic packages.tsv file')
+    parser.add_argument('path',type=str,help='Path of the .tsv file')
+    parser.add_argument('--rows',type=int,default=10_000)
+    parser.add_argument('--language_mix',type=parse_distribution,default=None,
+                        help="e.g. 'python=0.6,r=0.3,julia=0.1'")
+    parser.add_argument('--n_channels',type=int,default=5)
+    parser.add_argument('--version_density',type=float,default=0.3)
+    parser.add_argument('--bug_flags',type=parse_distribution,default=None,
+                        help="e.g. '=0.85,linux=0.05,windows=0.05,cross-platform=0.05'")
+    parser.add_argument('--error_rate',type=float,default=0.0)
+    parser.add_argument('--include_rate',type=float,default=0.9)
+    parser.add_argument('--seed',type=int,default=0)
+    args = parser.parse_args()
+
+    write_catalog(args.path,args.rows,language_mix=args.language_mix,n_channels=args.n_channels,
+                  version_density=args.version_density,bug_flags=args.bug_flags,
+                  error_rate=args.error_rate,include_rate=args.include_rate,seed=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,6 @@
+# keep in sync with the version in pyproject.toml
+__version__ = '0.0.0'
+
 # the following will allow users to write 'from tcy import run' instead of 'from tcy.tcy import run'
-from .tcy import run
+from .tcy import run, build
+from .batch import run_batch
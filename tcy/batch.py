@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Create many environment files from a single packages.tsv file
+
+Notes:
+
+- The .tsv file is parsed and validated only once. Afterwards, the files for
+  every target are written from the same validated table and its selection
+  indexes (see tcy.catalog), optionally in parallel using a pool of processes.
+- A target is a dictionary whose keys are the arguments of run() (without
+  tsv_path and engine), e.g.:
+
+    [{"operating_system":"linux","yml_name":"ubuntu","yml_dir":"./environments","yml_file_name":"ubuntu.yml"},
+     {"operating_system":"windows","yml_name":"windows","yml_dir":"./environments","yml_file_name":"windows.yml"}]
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+
+from .catalog import Catalog
+from .tcy import write_environment_files, get_output_paths, get_cran_options
+from .validation import validate, TsvValidationError, OPERATING_SYSTEMS, LANGUAGES
+
+# all arguments that a target can have (the arguments of write_environment_files
+# without table, profiler and write)
+TARGET_KEYS = ('operating_system',
+               'yml_name',
+               'yml_file_name',
+               'pip_requirements_file',
+               'write_conda_channels',
+               'yml_dir',
+               'cran_installation_script',
+               'cran_mirror',
+               'languages',
+               'cran_parallel',
+               'cran_ncpus',
+               'cran_dependency_levels',
+               'cran_local_repo',
+               'layer_column',
+               'layer_rules',
+               'layers')
+
+def load_targets(path):
+    '''Read in a list of targets from a .json file'''
+
+    with open(path) as f:
+        targets = json.load(f)
+
+    if not isinstance(targets,list):
+        raise ValueError(f"{path} must contain a list of targets")
+
+    return targets
+
+def check_target_options(i,target):
+    '''Raise a ValueError if the options of a target would make
+    write_environment_files fail, so that no file is written at all'''
+
+    if target['operating_system'] not in OPERATING_SYSTEMS:
+        raise ValueError(f"Target {i} has an invalid operating_system {target['operating_system']!r}. "
+                         f"Valid values are: {', '.join(OPERATING_SYSTEMS)}")
+
+    languages = target.get('languages','all')
+    invalid = [language for language in ([languages] if isinstance(languages,str) else languages)
+               if language not in LANGUAGES]
+    if invalid:
+        raise ValueError(f"Target {i} has invalid languages: {', '.join(map(str,invalid))}. "
+                         f"Valid values are: {', '.join(LANGUAGES)}")
+
+    if target.get('cran_installation_script') and not target.get('yml_name'):
+        raise ValueError(f"Target {i} must specify a yml_name to create an installation script for CRAN-packages")
+
+    try:
+        get_cran_options(target.get('cran_parallel',False),target.get('cran_ncpus'),
+                         target.get('cran_dependency_levels',False),target.get('cran_local_repo'))
+    except (TypeError,ValueError) as e:
+        raise ValueError(f"Target {i}: {e}") from None
+
+    if target.get('layer_column') is not None or target.get('layer_rules') is not None:
+        from .layers import load_layer_rules
+        if target.get('layer_column') is not None and target.get('layer_rules') is not None:
+            raise ValueError(f"Target {i} can only specify one of layer_column and layer_rules")
+        if target.get('pip_requirements_file'):
+            raise ValueError(f"Target {i}: pip_requirements_file cannot be combined with layers")
+        try:
+            if target.get('layer_rules') is not None:
+                load_layer_rules(target['layer_rules'])
+        except (OSError,ValueError) as e:
+            raise ValueError(f"Target {i}: {e}") from None
+
+def check_targets(targets):
+    '''Make sure that all targets are valid and that no two targets write
+    to the same file'''
+
+    written_by = {}
+
+    for i,target in enumerate(targets):
+
+        unknown_keys = set(target) - set(TARGET_KEYS)
+        if unknown_keys:
+            raise ValueError(f"Target {i} has unknown keys: {', '.join(sorted(unknown_keys))}. "
+                             f"Valid keys are: {', '.join(TARGET_KEYS)}")
+
+        if 'operating_system' not in target:
+            raise ValueError(f"Target {i} must specify an operating_system")
+
+        check_target_options(i,target)
+
+        yml_path,requirements_path,cran_installation_script_path = get_output_paths(target.get('yml_dir'),
+                                                                                    target.get('yml_file_name','environment.yml'))
+        paths = [yml_path]
+        if target.get('layer_column') is not None or target.get('layer_rules') is not None:
+            from .layers import get_layer_manifest_path
+            paths.append(get_layer_manifest_path(yml_path))
+        if target.get('pip_requirements_file'):
+            paths.append(requirements_path)
+        if target.get('cran_installation_script'):
+            paths.append(cran_installation_script_path)
+
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in written_by:
+                raise ValueError(f"Targets {written_by[path]} and {i} would both write to {path}")
+            written_by[path] = i
+
+# the catalog of a worker process (set once per worker by _init_worker so
+# that the catalog is not sent to the worker again for each target)
+_worker_table = None
+
+def _init_worker(table):
+    global _worker_table
+    _worker_table = table
+
+def _write_target(target):
+    write_environment_files(_worker_table,**target)
+    return get_output_paths(target.get('yml_dir'),target.get('yml_file_name','environment.yml'))[0]
+
+def run_batch(targets,tsv_path='./packages.tsv',processes=None):
+    '''Parses and validates the .tsv file once and creates the environment
+    files for all targets
+
+    Parameters
+    ----------
+    targets : list of dict
+        Each target is a dictionary with the arguments of run() (without
+        tsv_path and engine). 'operating_system' is required.
+    tsv_path : str, optional
+        Path to a valid packages.tsv file. The default is './packages.tsv'.
+    processes : int, optional
+        Number of processes that write the files in parallel. If None or 1,
+        all targets are written in the current process. The default is None.
+
+    Returns
+    -------
+    yml_paths : list of str
+        The paths to the .yml files in the order of targets.
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json.
+
+    '''
+
+    check_targets(targets)
+
+    report = validate(tsv_path)
+
+    if not report.ok:
+        raise TsvValidationError(report)
+
+    catalog = Catalog(report.table)
+
+    if not processes or processes == 1 or len(targets) < 2:
+        _init_worker(catalog)
+        return [_write_target(target) for target in targets]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=processes,initializer=_init_worker,initargs=(catalog,)) as executor:
+        return list(executor.map(_write_target,targets))
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy batch',
+                                     description='Parse packages.tsv once and create the environment files for many targets')
+    parser.add_argument('targets',type=str,
+                        help=f"Path to a .json file with a list of targets. Each target is an object \
+                        with one or more of these keys: {', '.join(TARGET_KEYS)}. \
+                        'operating_system' is required.")
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--processes',type=int,required=False,default=None,
+                        help='Number of processes that write the files in parallel. \
+                        If not given, all files are written by a single process.')
+
+    args = parser.parse_args(argv)
+
+    try:
+        targets = load_targets(args.targets)
+        for yml_path in run_batch(targets,tsv_path=args.tsv_path,processes=args.processes):
+            print(yml_path)
+    except (TsvValidationError,ValueError) as e:
+        sys.exit(str(e))
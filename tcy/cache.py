@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Compile a validated .tsv file into a binary, column-oriented cache that later
+runs load instead of parsing and validating the .tsv file again
+
+Notes:
+
+- The cache is a hidden file next to the .tsv file (e.g. .packages.tsv.tcy-cache).
+  It is only written for files that passed validation and stores the sha256
+  hash of the .tsv file and of the validation rules and the tcy version. If
+  any of them differs, the cache is ignored (and rewritten by the next run).
+- Layout: an 8 byte magic string, the length of a JSON header (4 bytes,
+  little endian), the JSON header and the column blocks, each aligned to
+  8 bytes. The header describes every column and the offset of its block.
+- Columns with few distinct values (e.g. language, package_manager,
+  conda_channel, include and bug_flag) are stored categorically: the
+  categories are part of the header and the block holds one code per row
+  (1, 2 or 4 bytes). All other columns are stored as UTF-8 strings that are
+  separated by NUL bytes (empty cells are empty strings, which tcy.table
+  never produces for filled cells).
+- The file is memory-mapped. Categorical columns are not copied: their codes
+  are read directly from the mapped file (see CategoricalColumn). String
+  columns are decoded once.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import mmap
+from array import array
+from collections.abc import Sequence
+
+from . import __version__
+from .manifest import hash_file
+from .render import atomic_open
+from .table import Table
+from .validation import TEST_CONFIGS_PATH
+
+MAGIC = b'TCYCOLS\x00'
+
+# increase whenever the layout of the file changes
+FORMAT_VERSION = 1
+
+# typecodes of the arrays that hold the codes of categorical columns
+_CODE_TYPES = [(1 << 8,'B'),(1 << 16,'H'),(1 << 32,'I')]
+
+class CategoricalColumn(Sequence):
+    '''A read-only column that stores one integer code per row and the
+    distinct values (categories) once
+
+    Parameters
+    ----------
+    categories : list
+        The distinct values of the column (str or None).
+    codes : memoryview or array.array
+        The position of every row's value in categories.
+
+    '''
+
+    __slots__ = ('categories','codes')
+
+    def __init__(self,categories,codes):
+        self.categories = categories
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self.categories[code] for code in self.codes[i]]
+        return self.categories[self.codes[i]]
+
+    def __iter__(self):
+        return map(self.categories.__getitem__,self.codes)
+
+    def take(self,positions):
+        '''Returns a new column with the rows at the given positions (only the codes are copied)'''
+
+        typecode = self.codes.typecode if isinstance(self.codes,array) else self.codes.format
+        return CategoricalColumn(self.categories,array(typecode,map(self.codes.__getitem__,positions)))
+
+    def __contains__(self,value):
+        try:
+            code = self.categories.index(value)
+        except ValueError:
+            return False
+        return code in self.codes
+
+def get_cache_path(tsv_path):
+    '''The cache of packages.tsv is stored as .packages.tsv.tcy-cache'''
+
+    tsv_dir,tsv_file_name = os.path.split(tsv_path)
+    return os.path.join(tsv_dir,f".{tsv_file_name}.tcy-cache")
+
+def get_key(tsv_path,test_configs_path=TEST_CONFIGS_PATH):
+    '''Returns everything that decides whether a cache is still valid'''
+
+    return {'format_version':FORMAT_VERSION,
+            'tcy_version':__version__,
+            'byteorder':sys.byteorder,
+            'tsv_sha256':hash_file(tsv_path),
+            'test_configs_sha256':hash_file(test_configs_path)}
+
+def _encode_column(values):
+    '''Returns (description,block) of a single column'''
+
+    values = list(values)
+    categories = list(dict.fromkeys(values))
+
+    if len(categories) * 2 <= len(values) and len(categories) <= _CODE_TYPES[-1][0]:
+        typecode = next(typecode for limit,typecode in _CODE_TYPES if len(categories) <= limit)
+        lookup = {category:code for code,category in enumerate(categories)}
+        codes = array(typecode,map(lookup.__getitem__,values))
+        return {'encoding':'categorical','categories':categories,'typecode':typecode},codes.tobytes()
+
+    if any(v is not None and '\0' in v for v in values):
+        return {'encoding':'json'},json.dumps(values).encode()
+
+    block = '\0'.join(v or '' for v in values).encode()
+    return {'encoding':'string','has_empty':None in values},block
+
+def write_cache(cache_path,table,key):
+    '''Write a validated table to a cache file
+
+    Parameters
+    ----------
+    cache_path : str
+        Path to the cache file (see get_cache_path).
+    table : tcy.table.Table
+        The table of the whole .tsv file (in the order of the file).
+    key : dict
+        The result of get_key() for the .tsv file.
+
+    '''
+
+    columns = []
+    blocks = []
+
+    for column in table.columns:
+        description,block = _encode_column(table[column])
+        columns.append({'name':column,**description,'length':len(block)})
+        blocks.append(block)
+
+    # the offsets depend on the length of the header, which contains the
+    # offsets. They are therefore relative to the end of the (padded) header
+    offset = 0
+    for description,block in zip(columns,blocks):
+        description['offset'] = offset
+        offset += _pad(len(block))
+
+    header = json.dumps({**key,'n_rows':len(table),'columns':columns}).encode()
+
+    with atomic_open(cache_path,binary=True) as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4,'little'))
+        f.write(header + b'\0' * (_pad(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4 - len(header)))
+        for block in blocks:
+            f.write(block + b'\0' * (_pad(len(block)) - len(block)))
+
+def _pad(n):
+    '''Round up to a multiple of 8 bytes'''
+
+    return (n + 7) & ~7
+
+def load_cache(cache_path,key):
+    '''Returns the cached table, or None if there is no cache or if it was
+    written for another key (i.e. another .tsv file, other validation rules
+    or another tcy version)'''
+
+    try:
+        with open(cache_path,'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            header_length = int.from_bytes(f.read(4),'little')
+            header = json.loads(f.read(header_length))
+
+            if any(header.get(k) != v for k,v in key.items()):
+                return None
+
+            if header['n_rows'] == 0:
+                return Table([c['name'] for c in header['columns']],{c['name']:[] for c in header['columns']})
+
+            # the mapping stays valid after the file is closed (and even after it is replaced)
+            buffer = memoryview(mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ))
+    except (OSError,ValueError,KeyError):
+        return None
+
+    start = _pad(len(MAGIC) + 4 + header_length)
+    n_rows = header['n_rows']
+    data = {}
+
+    for column in header['columns']:
+        block = buffer[start + column['offset']:start + column['offset'] + column['length']]
+
+        if column['encoding'] == 'categorical':
+            values = CategoricalColumn(column['categories'],block.cast(column['typecode']))
+        elif column['encoding'] == 'string':
+            values = str(block,'utf-8').split('\0')
+            if column['has_empty']:
+                values = [v or None for v in values]
+        else:
+            values = json.loads(bytes(block))
+
+        if len(values) != n_rows:
+            return None
+
+        data[column['name']] = values
+
+    return Table([column['name'] for column in header['columns']],data)
+
+def load_table(tsv_path):
+    '''Returns the cached table of a .tsv file, or None if the cache is
+    missing or outdated'''
+
+    if not os.path.isfile(tsv_path):
+        return None
+
+    return load_cache(get_cache_path(tsv_path),get_key(tsv_path))
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Indexes of a validated table that answer selections (operating system,
+languages, include flag) without filtering and sorting the table every time
+
+Notes:
+
+- The rows are sorted once by language, package manager and conda channel
+  (the order of the .yml file, empty cells last, ties in the order of the
+  file). Every index refers to this sorted order.
+- There is one bitmap per distinct value of bug_flag, language,
+  package_manager, conda_channel and include. A bitmap is a Python int with
+  one bit per row (bit i is set if the i-th sorted row has the value), so
+  combining indexes is a single & or | on the ints and the selected rows are
+  read in sorted order with itertools.compress. No intermediate tables are
+  created.
+- Channel frequencies of a selection are counted by intersecting the
+  selection with the bitmap of every channel, so the selected rows do not
+  have to be visited.
+- Building the indexes costs about as much as a single selection. A catalog
+  pays off when several selections are made from the same table (tcy batch,
+  tcy watch or the Python API).
+
+Usage:
+
+    from tcy.catalog import Catalog
+
+    catalog = Catalog(table)
+    mask = catalog.get_mask('linux',['python'])
+    catalog.take(mask)
+    catalog.get_channel_counts(mask)
+
+@author: Johannes.Wiesner
+"""
+
+from itertools import compress
+
+# columns that have an index
+INDEXED_COLUMNS = ('bug_flag','language','package_manager','conda_channel','include')
+
+# columns that define the order of the .yml file
+SORT_COLUMNS = ('language','package_manager','conda_channel')
+
+def _get_ranks(values):
+    '''Returns {value: rank} where empty cells (None) come last (like
+    pd.DataFrame.sort_values does)'''
+
+    distinct = sorted(set(values),key=lambda v: (v is None,v or ''))
+    return {value:rank for rank,value in enumerate(distinct)}
+
+def _count(mask):
+    '''Number of rows in a bitmap'''
+
+    return mask.bit_count() if hasattr(mask,'bit_count') else bin(mask).count('1')
+
+# translates the binary digits of a bitmap to bytes that are 0 or 1
+_DIGITS = bytes.maketrans(b'01',b'\x00\x01')
+
+def _to_flags(mask,n_rows):
+    '''Returns one byte per row (0 or 1) of a bitmap, e.g. for itertools.compress'''
+
+    # the binary digits start with the highest bit, i.e. the last row
+    return format(mask,f"0{n_rows}b").encode('ascii')[::-1].translate(_DIGITS)
+
+def _from_positions(positions):
+    '''Returns the bitmap of a sorted list of positions'''
+
+    bits = bytearray((positions[-1] >> 3) + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits,'little')
+
+def _build_bitmaps(values):
+    '''Returns {value: bitmap} of a column'''
+
+    distinct = list(dict.fromkeys(values))
+
+    # only the positions of every value are collected, a bitmap is as long as
+    # its last position
+    if len(distinct) > 256:
+        positions = {value:[] for value in distinct}
+        for position,value in enumerate(values):
+            positions[value].append(position)
+        return {value:_from_positions(value_positions) for value,value_positions in positions.items()}
+
+    # with one code per row, the binary digits of every bitmap are a
+    # translation of the codes (reversed, because the first row is the lowest bit)
+    codes = bytes(map({value:code for code,value in enumerate(distinct)}.__getitem__,reversed(values)))
+    bitmaps = {}
+    for code,value in enumerate(distinct):
+        translation = bytearray(b'0' * 256)
+        translation[code] = ord('1')
+        bitmaps[value] = int(codes.translate(translation),2)
+    return bitmaps
+
+class Catalog:
+    '''A validated table together with a sorted order and bitmap indexes
+
+    Parameters
+    ----------
+    table : tcy.table.Table
+        A validated table (e.g. report.table of tcy.validation.validate).
+
+    '''
+
+    __slots__ = ('table','order','indexes','all')
+
+    def __init__(self,table):
+        self.table = table
+        n_rows = len(table)
+
+        # sort once by a single integer key per row (stable, so ties keep the order of the file)
+        columns = [list(table[column]) for column in SORT_COLUMNS]
+        ranks = [_get_ranks(values) for values in columns]
+        keys = [0] * n_rows
+        for values,rank in zip(columns,ranks):
+            width = len(rank)
+            keys = [key * width + rank[value] for key,value in zip(keys,values)]
+        self.order = sorted(range(n_rows),key=keys.__getitem__)
+
+        # one bitmap per distinct value of every indexed column (in sorted order)
+        self.indexes = {}
+        for column in INDEXED_COLUMNS:
+            values = list(table[column])
+            self.indexes[column] = _build_bitmaps(list(map(values.__getitem__,self.order)))
+
+        self.all = (1 << n_rows) - 1
+
+    def __len__(self):
+        return len(self.order)
+
+    def get_index(self,column,predicate):
+        '''Returns the bitmap of all rows whose value in column fulfills predicate'''
+
+        mask = 0
+        for value,value_mask in self.indexes[column].items():
+            if predicate(value):
+                mask |= value_mask
+        return mask
+
+    def get_mask(self,operating_system,languages='all'):
+        '''Returns the bitmap of all packages that should be included for the
+        given operating system and languages (see tcy.tcy.is_selected)'''
+
+        # remove packages that generally don't work (for now) on all platforms,
+        # packages that won't work for the specified operating system, packages
+        # of other languages and packages that should not be included
+        mask = self.all ^ self.get_index('bug_flag',lambda v: v == 'cross-platform' or v == operating_system)
+
+        if languages != 'all':
+            mask &= self.get_index('language',lambda v: v in languages)
+
+        return mask & self.get_index('include',lambda v: v is not None and v.lower() == 'true')
+
+    def get_positions(self,mask):
+        '''Returns the positions (in the table) of all rows of a bitmap in sorted order'''
+
+        return list(compress(self.order,_to_flags(mask,len(self.order))))
+
+    def take(self,mask):
+        '''Returns the sorted subset of the table that contains the rows of a bitmap'''
+
+        return self.table.take(self.get_positions(mask))
+
+    def count(self,mask):
+        '''Returns the number of rows of a bitmap'''
+
+        return _count(mask)
+
+    def get_channel_counts(self,mask):
+        '''Returns {channel: number of rows} for the rows of a bitmap (empty
+        channels are not counted)'''
+
+        counts = {}
+        for channel,channel_mask in self.indexes['conda_channel'].items():
+            if channel is not None:
+                n = _count(mask & channel_mask)
+                if n:
+                    counts[channel] = n
+        return counts
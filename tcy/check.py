@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Check solved environments (*_solved.txt explicit spec files) against the
+version column of packages.tsv
+
+Notes:
+
+- An explicit spec file lists the URL of every package. Name, version and
+  build are taken from the file name of the URL (name-version-build.conda
+  or .tar.bz2).
+- The conda packages are selected like run() selects them. The version
+  column of every selected package is compiled once (see tcy.matchspec) and
+  looked up in the solved packages, so every solved file is checked in a
+  single pass over the selection.
+- A package is reported when its solved version (or build) does not satisfy
+  its version column, or when it is missing from the solved file.
+
+Usage:
+
+    tcy check linux environments/ubuntu-22.04/ubuntu-22.04_solved.txt --tsv_path environments/packages.tsv
+
+@author: Johannes.Wiesner
+"""
+
+import sys
+import string
+
+from .matchspec import parse_constraint
+from .tcy import get_catalog, normalize_languages
+from .validation import validate, TsvValidationError
+
+# file name extensions of conda packages
+EXTENSIONS = ('.conda','.tar.bz2')
+
+class SolvedMismatch:
+    '''A selected package whose solved version does not satisfy its version column
+
+    Parameters
+    ----------
+    package_name : str
+        Name of the package.
+    spec : str or None
+        The version column of the package.
+    cell : str
+        The cell of the version column in spreadsheet-program style (e.g. B7).
+    version, build : str or None
+        The solved version and build. None if the package is missing from
+        the solved file.
+
+    '''
+
+    __slots__ = ('package_name','spec','cell','version','build')
+
+    def __init__(self,package_name,spec,cell,version=None,build=None):
+        self.package_name = package_name
+        self.spec = spec
+        self.cell = cell
+        self.version = version
+        self.build = build
+
+    def to_dict(self):
+        return {a:getattr(self,a) for a in self.__slots__}
+
+    def __str__(self):
+        if self.version is None:
+            return f"{self.package_name} ({self.cell}) is missing from the solved file"
+        return (f"{self.package_name} {self.version} {self.build} does not satisfy "
+                f"{self.package_name}{self.spec} ({self.cell})")
+
+    def __repr__(self):
+        return f"SolvedMismatch({self.package_name!r}, {self.spec!r}, {self.version!r}, {self.build!r})"
+
+def parse_package_file_name(url):
+    '''Returns (name,version,build) of the package file of a URL (or None if
+    it is not a conda package)'''
+
+    file_name = url.split('#',1)[0].rstrip('/').rsplit('/',1)[-1]
+
+    for extension in EXTENSIONS:
+        if file_name.endswith(extension):
+            parts = file_name[:-len(extension)].rsplit('-',2)
+            return tuple(parts) if len(parts) == 3 else None
+
+    return None
+
+def read_explicit(path):
+    '''Returns {name: (version,build)} of all packages of an explicit spec file'''
+
+    packages = {}
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(('#','@')):
+                continue
+            parsed = parse_package_file_name(line)
+            if parsed is not None:
+                name,version,build = parsed
+                packages[name] = (version,build)
+
+    return packages
+
+def check_solved(table,operating_system,solved,languages='all'):
+    '''Check the solved packages of an environment against the version column
+
+    Parameters
+    ----------
+    table : tcy.table.Table or tcy.catalog.Catalog
+        The validated packages.tsv file (or its catalog).
+    operating_system : str
+        See run().
+    solved : dict
+        {name: (version,build)} of the solved environment (see read_explicit).
+    languages : str or list of str, optional
+        See run(). The default is 'all'.
+
+    Returns
+    -------
+    mismatches : list of SolvedMismatch
+        In the order of the .yml file.
+
+    '''
+
+    catalog = get_catalog(table)
+    table = catalog.table
+    positions = catalog.get_positions(catalog.get_mask(operating_system,normalize_languages(languages)))
+
+    letter = dict(zip(table.columns,string.ascii_uppercase))['version']
+    names,versions,managers = table['package_name'],table['version'],table['package_manager']
+
+    mismatches = []
+
+    for position in positions:
+
+        if managers[position] != 'conda':
+            continue
+
+        name,spec = names[position],versions[position]
+        cell = f"{letter}{position + 2}"
+
+        if name not in solved:
+            mismatches.append(SolvedMismatch(name,spec,cell))
+        elif spec is not None and not parse_constraint(spec).match(*solved[name]):
+            mismatches.append(SolvedMismatch(name,spec,cell,*solved[name]))
+
+    return mismatches
+
+def run_check(operating_system,solved_paths,tsv_path='./packages.tsv',languages='all'):
+    '''Validate the .tsv file once and check every solved file against it.
+    Returns {solved_path: list of SolvedMismatch}
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json.
+
+    '''
+
+    report = validate(tsv_path)
+    if not report.ok:
+        raise TsvValidationError(report)
+
+    catalog = get_catalog(report.table)
+
+    return {path:check_solved(catalog,operating_system,read_explicit(path),languages) for path in solved_paths}
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy check',
+                                     description='Check solved environments (*_solved.txt) against the version column of packages.tsv')
+    parser.add_argument('os',type=str,choices=['linux','windows'],
+                        help='Operating system for which the packages are selected.')
+    parser.add_argument('solved',type=str,nargs='+',
+                        help='One or more explicit spec files (e.g. ubuntu-22.04_solved.txt).')
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--languages',type=str,required=False,default='all',nargs='+',
+                        help="Filter for certain programming languages. Valid inputs \
+                        are python, julia, r or all.")
+
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_check(args.os,args.solved,args.tsv_path,args.languages)
+    except (OSError,ValueError) as e:
+        sys.exit(str(e))
+
+    lines = []
+    for path,mismatches in results.items():
+        lines.append(f"{path}: {len(mismatches)} mismatch(es)" if mismatches else f"{path}: ok")
+        lines += [f"  {mismatch}" for mismatch in mismatches]
+
+    print('\n'.join(lines))
+
+    if any(results.values()):
+        sys.exit(1)
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the solved environments of many targets (the *_solved.txt,
+*_solved.yml and *_solved_pip-requirements.txt files that CI exports)
+
+Notes:
+
+- All directories are searched recursively for solved exports. The target of
+  a file is its path (relative to the searched directory) without the
+  '_solved...' suffix. If the file lives in a directory of the same name
+  (environments/ubuntu-22.04/ubuntu-22.04_solved.txt), the target is the
+  directory (ubuntu-22.04). Historical snapshots in other directories
+  therefore become targets of their own (e.g. 2025-01/ubuntu-22.04).
+- Conda packages are taken from the explicit file (*_solved.txt) if there is
+  one and from the .yml file otherwise. pip packages are taken from the
+  requirements file if there is one and from the 'pip:' section otherwise.
+  .yml files that are not needed are not parsed.
+- The parsed packages are stored in an on-disk index (a SQLite database,
+  like tcy.repodata). Its size and modification time (and, if they changed,
+  its sha256 hash) are stored for every file, so only new and changed files
+  are parsed again. They are parsed in parallel by a pool of processes.
+- The result is a package x target table. A package drifts if it resolved
+  to different versions, has build differences if it resolved to the same
+  version with different builds, and is missing if some targets do not
+  have it.
+
+Usage:
+
+    tcy compare environments
+    tcy compare environments snapshots --targets 'ubuntu-*' --tsv comparison.tsv
+    tcy compare environments --package numpy
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import sqlite3
+from fnmatch import fnmatchcase
+
+from .check import read_explicit
+from .delta import read_solved_yml, read_pip_requirements
+from .manifest import hash_file
+from .render import write_atomic
+
+# file name suffixes of solved exports and their kind
+SUFFIXES = {'_solved.txt':'explicit','_solved.yml':'yml','_solved_pip-requirements.txt':'pip'}
+
+# increase whenever the layout of the tables changes
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE sources (id INTEGER PRIMARY KEY,
+                      path TEXT UNIQUE,
+                      kind TEXT,
+                      size INTEGER,
+                      mtime_ns INTEGER,
+                      sha256 TEXT);
+CREATE TABLE packages (source_id INTEGER,
+                       manager TEXT,
+                       name TEXT,
+                       version TEXT,
+                       build TEXT);
+CREATE INDEX packages_source ON packages (source_id);
+CREATE INDEX packages_name ON packages (manager, name);
+'''
+
+# the index is stored next to the solved exports by default
+INDEX_FILE_NAME = '.tcy-compare.sqlite'
+
+# number of targets that are named in a line of the report
+MAX_NAMED_TARGETS = 6
+
+def get_kind(path):
+    '''Returns (prefix,kind) of a solved export, or None for all other files'''
+
+    file_name = os.path.basename(path)
+
+    for suffix,kind in SUFFIXES.items():
+        if file_name.endswith(suffix) and len(file_name) > len(suffix):
+            return file_name[:-len(suffix)],kind
+
+    return None
+
+def get_target(path,root):
+    '''Returns the target of a solved export that was found below root'''
+
+    prefix,_ = get_kind(path)
+    directory = os.path.relpath(os.path.dirname(os.path.abspath(path)),os.path.abspath(root))
+
+    if directory == '.':
+        return prefix
+    if os.path.basename(directory) == prefix:
+        return directory.replace(os.sep,'/')
+    return f"{directory}/{prefix}".replace(os.sep,'/')
+
+def find_exports(paths):
+    '''Returns {absolute path: (target,kind)} of all solved exports in the
+    given files and directories (directories are searched recursively)'''
+
+    exports = {}
+
+    for path in paths:
+        if os.path.isfile(path):
+            root,files = os.path.dirname(path),[path]
+        elif os.path.isdir(path):
+            root = path
+            files = [os.path.join(directory,file_name) for directory,directories,file_names in os.walk(path)
+                     for file_name in sorted(file_names)]
+        else:
+            raise ValueError(f"{path} is neither a file nor a directory")
+
+        for file_path in files:
+            parsed = get_kind(file_path)
+            if parsed is not None:
+                exports.setdefault(os.path.abspath(file_path),(get_target(file_path,root),parsed[1]))
+
+    return exports
+
+def select_exports(exports):
+    '''Drop the .yml files of targets that have both an explicit file and a
+    requirements file (the .yml file would not be used)'''
+
+    kinds = {}
+    for target,kind in exports.values():
+        kinds.setdefault(target,set()).add(kind)
+
+    return {path:(target,kind) for path,(target,kind) in exports.items()
+            if kind != 'yml' or not {'explicit','pip'} <= kinds[target]}
+
+def parse_export(path,kind):
+    '''Returns a list of (manager,name,version,build) of a solved export.
+    pip packages are stored with their normalized name and without build'''
+
+    if kind == 'explicit':
+        return [('conda',name,version,build) for name,(version,build) in read_explicit(path).items()]
+
+    if kind == 'pip':
+        return [('pip',name,version,None) for name,(_,version) in read_pip_requirements(path).items()]
+
+    conda_packages,pip_packages = read_solved_yml(path)
+    return ([('conda',name,version,build) for name,(version,build) in conda_packages.items()]
+            + [('pip',name,version,None) for name,(_,version) in pip_packages.items()])
+
+def _parse_export(item):
+    '''Worker function of the process pool'''
+
+    return parse_export(*item)
+
+class CompareIndex:
+    '''An on-disk index of the packages of solved exports
+
+    Parameters
+    ----------
+    index_path : str
+        Path to the SQLite database.
+
+    '''
+
+    def __init__(self,index_path):
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)),exist_ok=True)
+
+        self.connection = sqlite3.connect(index_path)
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript('DROP TABLE IF EXISTS packages; DROP TABLE IF EXISTS sources;'
+                                          + SCHEMA + f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+    def update(self,exports,processes=None):
+        '''Parse all exports that are new or have changed (in parallel if
+        processes is larger than 1) and forget files that no longer exist.
+        Returns the number of files that were parsed'''
+
+        stored = {path:(source_id,size,mtime_ns,sha256) for source_id,path,size,mtime_ns,sha256
+                  in self.connection.execute('SELECT id, path, size, mtime_ns, sha256 FROM sources')}
+
+        changed = []
+        touched = []
+
+        for path,(_,kind) in exports.items():
+            stat = os.stat(path)
+            row = stored.get(path)
+
+            if row is not None and row[1:3] == (stat.st_size,stat.st_mtime_ns):
+                continue
+
+            # the file was touched, check if its content has changed
+            sha256 = hash_file(path)
+            if row is not None and row[3] == sha256:
+                touched.append((stat.st_size,stat.st_mtime_ns,row[0]))
+            else:
+                changed.append((path,kind,stat.st_size,stat.st_mtime_ns,sha256))
+
+        items = [(path,kind) for path,kind,_,_,_ in changed]
+
+        if not processes or processes == 1 or len(items) < 2:
+            parsed = [_parse_export(item) for item in items]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                parsed = list(executor.map(_parse_export,items,chunksize=max(1,len(items) // (processes * 4))))
+
+        removed = [row[0] for path,row in stored.items() if path not in exports and not os.path.exists(path)]
+
+        with self.connection:
+            self.connection.executemany('UPDATE sources SET size = ?, mtime_ns = ? WHERE id = ?',touched)
+
+            for path,kind,size,mtime_ns,sha256 in changed:
+                if path in stored:
+                    removed.append(stored[path][0])
+
+            self.connection.executemany('DELETE FROM packages WHERE source_id = ?',[(i,) for i in removed])
+            self.connection.executemany('DELETE FROM sources WHERE id = ?',[(i,) for i in removed])
+
+            for (path,kind,size,mtime_ns,sha256),packages in zip(changed,parsed):
+                source_id = self.connection.execute('INSERT INTO sources (path, kind, size, mtime_ns, sha256) '
+                                                    'VALUES (?, ?, ?, ?, ?)',
+                                                    (path,kind,size,mtime_ns,sha256)).lastrowid
+                self.connection.executemany('INSERT INTO packages VALUES (?, ?, ?, ?, ?)',
+                                            ((source_id,*package) for package in packages))
+
+        return len(changed)
+
+    def get_table(self,exports,package=None):
+        '''Returns {(manager,name): {target: (version,build)}} of the given exports
+
+        Parameters
+        ----------
+        exports : dict
+            {absolute path: (target,kind)} (see find_exports).
+        package : str, optional
+            Only return the rows of this package (the name index is used).
+            The default is None (all packages).
+
+        '''
+
+        query = ('SELECT s.path, p.manager, p.name, p.version, p.build '
+                 'FROM packages p JOIN sources s ON p.source_id = s.id')
+        parameters = ()
+        if package is not None:
+            query += ' WHERE p.name = ?'
+            parameters = (package,)
+
+        # conda packages of an explicit file replace those of the .yml file,
+        # pip packages of a requirements file replace the 'pip:' section
+        kinds = {}
+        for target,kind in exports.values():
+            kinds.setdefault(target,set()).add(kind)
+
+        table = {}
+
+        for path,manager,name,version,build in self.connection.execute(query,parameters):
+            if path not in exports:
+                continue
+
+            target,kind = exports[path]
+
+            if kind == 'yml' and ('explicit' if manager == 'conda' else 'pip') in kinds[target]:
+                continue
+
+            table.setdefault((manager,name),{})[target] = (version,build)
+
+        return table
+
+class Comparison:
+    '''A package x target table and the packages that differ between targets
+
+    Parameters
+    ----------
+    table : dict
+        {(manager,name): {target: (version,build)}} (see CompareIndex.get_table).
+    targets : list of str
+        All targets (a target without any package still counts).
+
+    '''
+
+    __slots__ = ('table','targets','drift','builds','missing','status')
+
+    def __init__(self,table,targets):
+        self.table = dict(sorted(table.items()))
+        self.targets = sorted(targets)
+
+        # keys of all packages that drift, have build differences or are missing
+        self.drift = []
+        self.builds = []
+        self.missing = []
+
+        # {key: 'drift', 'build' and/or 'missing'} of all packages that differ
+        self.status = {}
+
+        n_targets = len(self.targets)
+
+        for key,values in self.table.items():
+            status = []
+            if len({version for version,_ in values.values()}) > 1:
+                self.drift.append(key)
+                status.append('drift')
+            elif len({build for _,build in values.values()}) > 1:
+                self.builds.append(key)
+                status.append('build')
+            if len(values) < n_targets:
+                self.missing.append(key)
+                status.append('missing')
+            if status:
+                self.status[key] = ','.join(status)
+
+    def iter_rows(self,all_packages=False):
+        '''Yields the rows of the package x target table (only packages that
+        differ, unless all_packages is True)'''
+
+        yield ['package_manager','package_name','status',*self.targets]
+
+        for key,values in self.table.items():
+            if not all_packages and key not in self.status:
+                continue
+            cells = [_format_value(values.get(target)) for target in self.targets]
+            yield [*key,self.status.get(key,'same'),*cells]
+
+    def to_tsv(self,all_packages=False):
+        '''Returns the package x target table as .tsv file'''
+
+        return ''.join('\t'.join(row) + '\n' for row in self.iter_rows(all_packages))
+
+    def report(self):
+        '''Returns a human readable summary of all differences'''
+
+        lines = [f"Compared {len(self.targets)} targets and {len(self.table)} packages"]
+
+        lines.append(f"Version drift ({len(self.drift)} packages):")
+        lines += [f"  {manager} {name}: {_group({t:v for t,(v,_) in self.table[(manager,name)].items()})}"
+                  for manager,name in self.drift]
+
+        lines.append(f"Build differences ({len(self.builds)} packages):")
+        for manager,name in self.builds:
+            values = self.table[(manager,name)]
+            version = next(iter(values.values()))[0]
+            lines.append(f"  {manager} {name} {version}: {_group({t:b for t,(_,b) in values.items()})}")
+
+        lines.append(f"Missing ({len(self.missing)} packages):")
+        lines += [f"  {manager} {name}: missing in "
+                  f"{_name_targets([t for t in self.targets if t not in self.table[(manager,name)]])}"
+                  for manager,name in self.missing]
+
+        return '\n'.join(lines)
+
+def _format_value(value):
+    if value is None:
+        return ''
+    version,build = value
+    return f"{version or ''}={build}" if build else version or ''
+
+def _name_targets(targets):
+    if len(targets) <= MAX_NAMED_TARGETS:
+        return ', '.join(targets)
+    return f"{', '.join(targets[:MAX_NAMED_TARGETS])} and {len(targets) - MAX_NAMED_TARGETS} more"
+
+def _group(values):
+    ''''1.0 (a, b), 2.0 (c)' for {target: value}, the most common value first'''
+
+    groups = {}
+    for target,value in sorted(values.items()):
+        groups.setdefault(value,[]).append(target)
+
+    return ', '.join(f"{value} ({_name_targets(targets)})"
+                     for value,targets in sorted(groups.items(),key=lambda item: -len(item[1])))
+
+def run_compare(paths,index_path=None,processes=None,targets=None,package=None):
+    '''Update the index with all solved exports and compare their targets
+
+    Parameters
+    ----------
+    paths : list of str
+        Files and directories with solved exports.
+    index_path : str, optional
+        Path to the index. The default is None (.tcy-compare.sqlite in the
+        first directory of paths).
+    processes : int, optional
+        Number of processes that parse new and changed files in parallel.
+        If None or 1, all files are parsed in the current process. The
+        default is None.
+    targets : list of str, optional
+        Only compare targets that match one of these patterns (e.g.
+        'ubuntu-*'). The default is None (all targets).
+    package : str, optional
+        Only compare this package. The default is None (all packages).
+
+    Returns
+    -------
+    comparison : Comparison
+
+    '''
+
+    exports = select_exports(find_exports(paths))
+
+    if targets:
+        exports = {path:(target,kind) for path,(target,kind) in exports.items()
+                   if any(fnmatchcase(target,pattern) for pattern in targets)}
+
+    if index_path is None:
+        directory = next((path for path in paths if os.path.isdir(path)),os.path.dirname(paths[0]) or '.')
+        index_path = os.path.join(directory,INDEX_FILE_NAME)
+
+    with CompareIndex(index_path) as index:
+        index.update(exports,processes)
+        table = index.get_table(exports,package)
+
+    return Comparison(table,{target for target,_ in exports.values()})
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy compare',
+                                     description='Compare the solved environments of many targets')
+    parser.add_argument('paths',type=str,nargs='*',default=['environments'],
+                        help='Files and directories with solved exports (*_solved.txt, *_solved.yml, \
+                        *_solved_pip-requirements.txt). Directories are searched recursively. \
+                        The default is environments')
+    parser.add_argument('--index_path',type=str,required=False,default=None,
+                        help=f"Path to the index of parsed files. The default is {INDEX_FILE_NAME} \
+                        in the first directory.")
+    parser.add_argument('--processes',type=int,required=False,default=os.cpu_count(),
+                        help='Number of processes that parse new and changed files in parallel. \
+                        The default is the number of CPUs.')
+    parser.add_argument('--targets',type=str,required=False,default=None,nargs='+',
+                        help="Only compare targets that match one of these patterns (e.g. 'ubuntu-*').")
+    parser.add_argument('--package',type=str,required=False,default=None,
+                        help='Only compare this package.')
+    parser.add_argument('--tsv',type=str,required=False,default=None,metavar='TSV_PATH',
+                        help='Write the package x target table to this .tsv file.')
+    parser.add_argument('--all',action='store_true',
+                        help='Also write packages without differences to the .tsv file.')
+
+    args = parser.parse_args(argv)
+
+    try:
+        comparison = run_compare(args.paths,args.index_path,args.processes,args.targets,args.package)
+    except (OSError,ValueError,sqlite3.Error) as e:
+        sys.exit(str(e))
+
+    if args.tsv:
+        write_atomic(args.tsv,comparison.to_tsv(args.all))
+
+    print(comparison.report())
+
+    # the values of a single package are shown even if they do not differ
+    if args.package:
+        for (manager,name),values in comparison.table.items():
+            print(f"{manager} {name}: {_group({target:_format_value(value) for target,value in values.items()})}")
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the packages of packages.tsv with an existing solved environment and
+write only what has to change
+
+Notes:
+
+- The solved environment is read from a *_solved.yml file (the output of
+  'conda env export') and optionally a *_solved_pip-requirements.txt file
+  (the output of 'pip freeze' / 'pip list --format=freeze'). Both are read
+  into dictionaries that are keyed by package name, so every package of the
+  selection is looked up once.
+- A conda package is added if it is not installed and respecified if the
+  installed version does not match its version column (e.g. '>=1.21'). If
+  the version column has a build string (e.g. '=1.21=py311*'), the installed
+  build has to match it as well.
+  A pip package is added if it is not installed (like in the .yml file that
+  run() writes, the version column of pip packages is not used).
+- A package is removed if it is installed but is listed in packages.tsv for
+  the selected languages without being selected (e.g. include was set to
+  false or it was flagged for this operating system). Installed packages that
+  are not listed in packages.tsv at all are never removed, because they are
+  usually dependencies of other packages.
+- Three files are written: an update .yml file without 'name:' that only
+  contains the added and respecified conda packages ('conda env update'),
+  a requirements file with the added pip packages ('pip install -r') and a
+  .tsv file with the package manager and name of every package that should
+  be removed.
+
+Usage:
+
+    tcy delta linux --solved_yml ubuntu_solved.yml --solved_pip_requirements ubuntu_solved_pip-requirements.txt
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import re
+import sys
+
+from .matchspec import parse_constraint
+from .render import render_yml, render_requirements, write_atomic
+from .tcy import select_packages, get_conda_channels, normalize_languages
+from .validation import validate, TsvValidationError
+
+# name (and optional extras and '==version') of a line of a requirements file
+_REQUIREMENT = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._\-]*)\s*(?:\[[^\]]*\])?\s*(?:==\s*([^\s;,]+))?')
+
+class EnvironmentDelta:
+    '''The packages that have to change to bring a solved environment in line
+    with packages.tsv
+
+    Attributes
+    ----------
+    channels : list of str
+        Channels of the selection (as in the 'channels:' section of the .yml file).
+    conda_packages : list of tuples
+        All conda packages of the update .yml file (conda_added and
+        conda_respecified in the order of the selection).
+    conda_added, conda_respecified : list of tuples
+        (package_name,version,conda_channel) of conda packages that are not
+        installed or whose installed version does not match the version column.
+    pip_added : list of str
+        Names of pip packages that are not installed.
+    removed : list of tuples
+        (package_manager,package_name) of installed packages that are no
+        longer selected.
+
+    '''
+
+    __slots__ = ('channels','conda_packages','conda_added','conda_respecified','pip_added','removed')
+
+    def __init__(self,channels,conda_packages,conda_added,conda_respecified,pip_added,removed):
+        self.channels = channels
+        self.conda_packages = conda_packages
+        self.conda_added = conda_added
+        self.conda_respecified = conda_respecified
+        self.pip_added = pip_added
+        self.removed = removed
+
+    def __bool__(self):
+        return bool(self.conda_added or self.conda_respecified or self.pip_added or self.removed)
+
+    def __repr__(self):
+        return (f"EnvironmentDelta(conda_added={len(self.conda_added)}, "
+                f"conda_respecified={len(self.conda_respecified)}, "
+                f"pip_added={len(self.pip_added)}, removed={len(self.removed)})")
+
+def normalize_pip_name(name):
+    '''pip treats 'Scikit_Learn' and 'scikit-learn' as the same package (PEP 503)'''
+
+    return re.sub(r'[-_.]+','-',name).lower()
+
+def _parse_requirement(line):
+    '''Returns (name,version) of a requirement line (version is None if it is
+    not pinned with '=='). Returns None for comments, options and empty lines'''
+
+    line = line.split('#',1)[0].strip()
+    if not line or line.startswith('-'):
+        return None
+
+    match = _REQUIREMENT.match(line)
+    if not match:
+        return None
+
+    return match.group(1),match.group(2)
+
+def read_pip_requirements(path):
+    '''Returns {normalized name: (name,version)} of a requirements file'''
+
+    packages = {}
+
+    with open(path) as f:
+        for line in f:
+            requirement = _parse_requirement(line)
+            if requirement is not None:
+                packages[normalize_pip_name(requirement[0])] = requirement
+
+    return packages
+
+def read_solved_yml(path):
+    '''Read the dependencies of an exported environment .yml file
+
+    Only the parts of the format that 'conda env export' writes are
+    supported ('- name=version=build' entries and a nested 'pip:' list), so
+    no YAML library is needed.
+
+    Returns
+    -------
+    conda_packages : dict
+        {name: (version,build)} of all conda packages (version and build are
+        None if they are not given).
+    pip_packages : dict
+        {normalized name: (name,version)} of all pip packages.
+
+    '''
+
+    conda_packages = {}
+    pip_packages = {}
+
+    in_dependencies = False
+    pip_indent = None
+
+    with open(path) as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                continue
+
+            indent = len(line) - len(line.lstrip())
+
+            # top-level keys (name:, channels:, dependencies:, prefix:)
+            if indent == 0 and not stripped.startswith('-'):
+                in_dependencies = stripped == 'dependencies:'
+                pip_indent = None
+                continue
+
+            if not in_dependencies or not stripped.startswith('-'):
+                continue
+
+            item = stripped[1:].strip()
+
+            if pip_indent is not None and indent > pip_indent:
+                requirement = _parse_requirement(item)
+                if requirement is not None:
+                    pip_packages[normalize_pip_name(requirement[0])] = requirement
+                continue
+
+            pip_indent = None
+
+            if item == 'pip:':
+                pip_indent = indent
+                continue
+
+            name,_,rest = item.rpartition('::')[2].partition('=')
+            version,_,build = rest.partition('=')
+            conda_packages[name.strip()] = (version or None,build or None)
+
+    return conda_packages,pip_packages
+
+def is_satisfied(name,version,installed_version,installed_build=None):
+    '''True if the installed version (and build) of a package matches its
+    version column (e.g. '=1.21=py311*' also checks the build string). The
+    build is only ignored if the solved file does not list it. Version
+    columns that are not valid match specs are never satisfied'''
+
+    if version is None:
+        return True
+
+    if installed_version is None:
+        return False
+
+    try:
+        return parse_constraint(version).match(installed_version,installed_build)
+    except ValueError:
+        return False
+
+def compute_delta(table,operating_system,conda_installed,pip_installed,languages='all'):
+    '''Compare the packages of a validated table with an installed environment
+
+    Parameters
+    ----------
+    table : tcy.table.Table
+        A validated table (e.g. report.table of tcy.validation.validate).
+    operating_system : str
+        See run().
+    conda_installed : dict
+        {name: (version,build)} of the installed conda packages (see read_solved_yml).
+    pip_installed : dict
+        {normalized name: (name,version)} of the installed pip packages.
+    languages : str or list of str, optional
+        See run(). The default is 'all'.
+
+    Returns
+    -------
+    EnvironmentDelta
+
+    '''
+
+    languages = normalize_languages(languages)
+    selection = select_packages(table,operating_system,languages)
+
+    conda_packages = []
+    conda_added = []
+    conda_respecified = []
+    pip_added = []
+    selected = set()
+
+    for name,version,channel,package_manager in zip(selection['package_name'],selection['version'],
+                                                    selection['conda_channel'],selection['package_manager']):
+        if package_manager == 'conda':
+            selected.add(('conda',name))
+            installed = conda_installed.get(name)
+            if installed is None:
+                conda_added.append((name,version,channel))
+            elif not is_satisfied(name,version,*installed):
+                conda_respecified.append((name,version,channel))
+            else:
+                continue
+            conda_packages.append((name,version,channel))
+        elif package_manager == 'pip':
+            selected.add(('pip',normalize_pip_name(name)))
+            if normalize_pip_name(name) not in pip_installed:
+                pip_added.append(name)
+
+    # packages of the selected languages that are listed but not selected
+    removed = []
+    for name,package_manager,language in zip(table['package_name'],table['package_manager'],table['language']):
+        if languages != 'all' and language not in languages:
+            continue
+        if package_manager == 'conda':
+            key,installed = ('conda',name),conda_installed
+        elif package_manager == 'pip':
+            key,installed = ('pip',normalize_pip_name(name)),pip_installed
+        else:
+            continue
+        if key[1] in installed and key not in selected:
+            selected.add(key)
+            removed.append((package_manager,name))
+
+    return EnvironmentDelta(get_conda_channels(selection),conda_packages,conda_added,conda_respecified,pip_added,removed)
+
+def render_removals(removed):
+    '''Returns the content of the .tsv file with the packages that should be removed'''
+
+    return 'package_manager\tpackage_name\n' + ''.join(f"{m}\t{n}\n" for m,n in removed)
+
+def get_delta_paths(yml_dir,yml_file_name):
+    '''Returns the paths to the update .yml file, the pip requirements file
+    and the removal list (update.yml, update_pip-requirements.txt and
+    update_removals.tsv for yml_file_name='update.yml')'''
+
+    stem = os.path.splitext(yml_file_name)[0]
+    file_names = [yml_file_name,f"{stem}_pip-requirements.txt",f"{stem}_removals.tsv"]
+
+    return [os.path.join(yml_dir,file_name) if yml_dir else file_name for file_name in file_names]
+
+def run_delta(operating_system,
+              solved_yml_path,
+              solved_pip_requirements_path=None,
+              tsv_path='./packages.tsv',
+              yml_file_name='update.yml',
+              yml_dir=None,
+              languages='all',
+              write_conda_channels=False):
+    '''Write the update files that bring a solved environment in line with packages.tsv
+
+    Parameters
+    ----------
+    operating_system : str
+        See run().
+    solved_yml_path : str
+        Path to the exported environment (e.g. ubuntu-22.04_solved.yml).
+    solved_pip_requirements_path : str, optional
+        Path to the frozen pip packages of the environment (e.g.
+        ubuntu-22.04_solved_pip-requirements.txt). Its versions replace the
+        ones of the 'pip:' section of the .yml file. The default is None.
+    tsv_path : str, optional
+        See run(). The default is './packages.tsv'.
+    yml_file_name : str, optional
+        Name of the update .yml file. The pip requirements file and the
+        removal list are named after it. The default is 'update.yml'.
+    yml_dir : str, optional
+        Directory of the written files. The default is None (the current
+        working directory).
+    languages, write_conda_channels : optional
+        See run().
+
+    Returns
+    -------
+    EnvironmentDelta
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json.
+
+    '''
+
+    report = validate(tsv_path)
+
+    if not report.ok:
+        raise TsvValidationError(report)
+
+    conda_installed,pip_installed = read_solved_yml(solved_yml_path)
+    if solved_pip_requirements_path:
+        pip_installed.update(read_pip_requirements(solved_pip_requirements_path))
+
+    delta = compute_delta(report.table,operating_system,conda_installed,pip_installed,languages)
+
+    yml_path,requirements_path,removals_path = get_delta_paths(yml_dir,yml_file_name)
+
+    write_atomic(yml_path,render_yml(delta.channels,delta.conda_packages,[],False,None,write_conda_channels))
+    write_atomic(requirements_path,render_requirements(delta.pip_added))
+    write_atomic(removals_path,render_removals(delta.removed))
+
+    return delta
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy delta',
+                                     description='Compare packages.tsv with a solved environment and write \
+                                     only the packages that have to be added, updated or removed')
+    parser.add_argument('os',type=str,choices=['linux','windows'],
+                        help="Operating system (see 'tcy --help').")
+    parser.add_argument('--solved_yml',type=str,required=True,
+                        help='Path to the exported environment (e.g. ubuntu-22.04_solved.yml).')
+    parser.add_argument('--solved_pip_requirements',type=str,required=False,default=None,
+                        help='Path to the frozen pip packages of the environment \
+                        (e.g. ubuntu-22.04_solved_pip-requirements.txt).')
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--yml_file_name',type=str,required=False,default='update.yml',
+                        help='Name of the update .yml file. The pip requirements file and \
+                        the removal list are named after it. The default is update.yml')
+    parser.add_argument('--yml_dir',type=str,required=False,
+                        help='Directory of the written files. If not given, they are \
+                        placed in the current working directory.')
+    parser.add_argument('--languages',type=str,required=False,default='all',nargs='+',
+                        help="Filter for certain programming languages. Valid inputs \
+                        are python, julia, r or all.")
+    parser.add_argument('--write_conda_channels',action='store_true',
+                        help="Specify conda channels directly for each conda package (see 'tcy --help').")
+
+    args = parser.parse_args(argv)
+
+    try:
+        delta = run_delta(args.os,
+                          args.solved_yml,
+                          solved_pip_requirements_path=args.solved_pip_requirements,
+                          tsv_path=args.tsv_path,
+                          yml_file_name=args.yml_file_name,
+                          yml_dir=args.yml_dir,
+                          languages=args.languages,
+                          write_conda_channels=args.write_conda_channels)
+        print(f"{len(delta.conda_added)} conda packages added, {len(delta.conda_respecified)} respecified, "
+              f"{len(delta.pip_added)} pip packages added, {len(delta.removed)} packages removed")
+    except (TsvValidationError,OSError,ValueError) as e:
+        sys.exit(str(e))
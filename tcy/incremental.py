@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Remember which rows of a .tsv file passed validation, so that only added or
+changed rows have to be validated again
+
+Notes:
+
+- After a successful validation, a hash of every row is stored in a hidden
+  sidecar file next to the .tsv file (e.g. .packages.tsv.tcy-rows).
+- All rules of test_configs.json that check cells only look at a single row.
+  A row that passed validation before therefore still passes as long as the
+  header, the rules and the tcy version are the same (its position in the
+  file does not matter). These are stored as fingerprint in the sidecar. If
+  the fingerprint does not match, all rows are validated again.
+- The sidecar file starts with the fingerprint as a single line of JSON,
+  followed by the raw row digests (DIGEST_SIZE bytes each).
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+import hashlib
+
+from . import __version__
+from .render import atomic_open
+
+# version of the sidecar format
+SIDECAR_VERSION = 1
+
+# number of bytes of every row digest
+DIGEST_SIZE = 16
+
+def get_sidecar_path(tsv_path):
+    '''The row hashes of packages.tsv are stored as .packages.tsv.tcy-rows'''
+
+    tsv_dir,tsv_file_name = os.path.split(tsv_path)
+    return os.path.join(tsv_dir,f".{tsv_file_name}.tcy-rows")
+
+def get_fingerprint(columns,test_configs):
+    '''Returns everything (apart from the row itself) that decides whether a
+    row passes validation'''
+
+    configs = json.dumps(test_configs,sort_keys=True).encode()
+
+    return {'sidecar_version':SIDECAR_VERSION,
+            'tcy_version':__version__,
+            'columns':list(columns),
+            'test_configs_sha256':hashlib.sha256(configs).hexdigest()}
+
+def hash_rows(table):
+    '''Returns the digest of every row of a table. Rows are joined like in
+    the .tsv file, empty cells are written as 'None' (which tcy.table always
+    reads as an empty cell, so it cannot be confused with a string)'''
+
+    columns = [['None' if v is None else v for v in table[column]] for column in table.columns]
+    blake2b = hashlib.blake2b
+
+    return [blake2b(row.encode(),digest_size=DIGEST_SIZE).digest() for row in map('\t'.join,zip(*columns))]
+
+def load_row_hashes(sidecar_path,fingerprint):
+    '''Returns the set of row digests that passed the last validation. Returns
+    None if there is no sidecar or if it was written for another fingerprint'''
+
+    try:
+        with open(sidecar_path,'rb') as f:
+            if json.loads(f.readline()) != fingerprint:
+                return None
+            data = f.read()
+    except (OSError,ValueError):
+        return None
+
+    if len(data) % DIGEST_SIZE:
+        return None
+
+    return {data[i:i + DIGEST_SIZE] for i in range(0,len(data),DIGEST_SIZE)}
+
+def write_row_hashes(sidecar_path,fingerprint,hashes):
+    '''Store the digests of all rows of a file that passed validation'''
+
+    with atomic_open(sidecar_path,binary=True) as f:
+        f.write(json.dumps(fingerprint).encode() + b'\n')
+        f.write(b''.join(dict.fromkeys(hashes)))
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Split the selected packages into ordered layers and write one .yml file per
+layer, so that unchanged lower layers can be reused from a cache
+
+Notes:
+
+- The layer of a package is either taken from a column of the .tsv file
+  (layer_column, empty cells go to the 'default' layer) or from rules. A
+  rule names a layer and the values that a package must have in some
+  columns (fnmatch patterns, null matches empty cells). The first matching
+  rule wins, packages that match no rule go to the 'default' layer.
+- Layers are ordered like the layers argument, then in the order of the
+  rules (or of the first appearance in the layer column), 'default' last.
+  Within a layer, packages keep the order of the monolithic .yml file.
+- Every non-empty layer is written to its own file (environment.yml becomes
+  environment.01-base.yml, environment.02-python.yml, ...). The number is
+  the position of the layer in the order, so file names do not change when
+  another layer becomes empty.
+- A manifest (environment.layers.json) lists the layers in order with the
+  sha256 hash of their file and a cumulative hash of the layer and all
+  layers below it. The cumulative hash only changes if the layer or a lower
+  layer changed, so it can be used as cache key of the layer.
+
+Usage:
+
+    tcy linux --layer_column layer --layers base,python,r
+    tcy linux --layer_rules layers.json
+
+    [{"layer": "base", "package_name": ["python", "r-base"]},
+     {"layer": "python", "language": "python"},
+     {"layer": "r", "language": "r"}]
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import re
+import json
+import hashlib
+from fnmatch import fnmatchcase
+
+from .render import write_atomic
+from .tcy import get_catalog, get_conda_channels, get_spec, normalize_languages
+
+# layer of packages without a layer
+DEFAULT_LAYER = 'default'
+
+# layer names become part of file names
+LAYER_NAME = re.compile(r'[A-Za-z0-9_.-]+')
+
+class Layer:
+    '''A layer of an environment
+
+    Parameters
+    ----------
+    name : str
+        Name of the layer.
+    index : int
+        Position of the layer in the order of all layers (starting at 1).
+    spec : tcy.spec.EnvironmentSpec
+        The packages of the layer.
+
+    '''
+
+    __slots__ = ('name','index','spec')
+
+    def __init__(self,name,index,spec):
+        self.name = name
+        self.index = index
+        self.spec = spec
+
+    def get_file_name(self,yml_file_name='environment.yml'):
+        '''environment.yml becomes environment.01-base.yml'''
+
+        stem,extension = os.path.splitext(yml_file_name)
+        return f"{stem}.{self.index:02d}-{self.name}{extension or '.yml'}"
+
+    def __repr__(self):
+        return f"Layer({self.name!r}, {self.index}, {self.spec!r})"
+
+def check_layer_name(name):
+    if not isinstance(name,str) or not LAYER_NAME.fullmatch(name):
+        raise ValueError(f"Invalid layer name {name!r}. Layer names may only contain letters, "
+                         "digits, '_', '.' and '-'")
+    return name
+
+def load_layer_rules(rules):
+    '''Returns the rules as list of (layer,{column: patterns}). rules can be
+    a list of dictionaries or the path to a .json file that contains it'''
+
+    if isinstance(rules,str):
+        with open(rules) as f:
+            rules = json.load(f)
+
+    if not isinstance(rules,list):
+        raise ValueError('The layer rules must be a list of dictionaries')
+
+    parsed = []
+
+    for i,rule in enumerate(rules):
+        if not isinstance(rule,dict) or 'layer' not in rule:
+            raise ValueError(f"Layer rule {i} must be a dictionary with a 'layer' key")
+        conditions = {column:patterns if isinstance(patterns,list) else [patterns]
+                      for column,patterns in rule.items() if column != 'layer'}
+        parsed.append((check_layer_name(rule['layer']),conditions))
+
+    return parsed
+
+def _matches(value,patterns):
+    '''True if a cell matches any of the patterns (None matches empty cells)'''
+
+    return any(value is None if pattern is None else value is not None and fnmatchcase(value,pattern)
+               for pattern in patterns)
+
+def assign_layers(table,positions,layer_column=None,layer_rules=None,layers=None):
+    '''Assign the rows of a table to layers
+
+    Parameters
+    ----------
+    table : tcy.table.Table
+        The validated table.
+    positions : list of int
+        The positions of the selected rows (in the order of the .yml file).
+    layer_column, layer_rules, layers : optional
+        See write_layers.
+
+    Returns
+    -------
+    order : list of str
+        All layers in order.
+    assigned : dict
+        {layer: list of positions} of all non-empty layers.
+
+    '''
+
+    if (layer_column is None) == (layer_rules is None):
+        raise ValueError('Layers need either a layer_column or layer_rules')
+
+    if isinstance(layers,str):
+        layers = layers.split(',')
+    order = [check_layer_name(layer) for layer in layers or []]
+
+    if layer_column is not None:
+        if layer_column not in table:
+            raise ValueError(f"The .tsv file does not have the layer column {layer_column!r}")
+        values = table[layer_column]
+        get_layer = lambda position: values[position] or DEFAULT_LAYER
+        # layers that are not listed follow in the order of the file
+        candidates = (value for value in values if value is not None)
+    else:
+        rules = load_layer_rules(layer_rules)
+        unknown = {column for _,conditions in rules for column in conditions} - set(table.columns)
+        if unknown:
+            raise ValueError(f"The layer rules refer to unknown columns: {', '.join(sorted(unknown))}")
+        rules = [(layer,[(table[column],patterns) for column,patterns in conditions.items()])
+                 for layer,conditions in rules]
+
+        def get_layer(position):
+            for layer,conditions in rules:
+                if all(_matches(values[position],patterns) for values,patterns in conditions):
+                    return layer
+            return DEFAULT_LAYER
+
+        candidates = (layer for layer,_ in rules)
+
+    for layer in candidates:
+        if layer not in order:
+            order.append(check_layer_name(layer))
+    if DEFAULT_LAYER not in order:
+        order.append(DEFAULT_LAYER)
+
+    assigned = {}
+    for position in positions:
+        assigned.setdefault(get_layer(position),[]).append(position)
+
+    return order,assigned
+
+def build_layers(operating_system,yml_name=None,languages='all',tsv_path='./packages.tsv',catalog=None,
+                 layer_column=None,layer_rules=None,layers=None):
+    '''Selects the packages for an operating system and returns them split
+    into layers, without writing any file. Takes the same arguments as
+    tcy.build() plus the arguments of the layers (see write_layers).
+    Returns a list of Layer (only non-empty layers, in order)'''
+
+    if catalog is None:
+        from .validation import validate, TsvValidationError
+        report = validate(tsv_path)
+        if not report.ok:
+            raise TsvValidationError(report)
+        catalog = report.table
+
+    catalog = get_catalog(catalog)
+    table = catalog.table
+    positions = catalog.get_positions(catalog.get_mask(operating_system,normalize_languages(languages)))
+
+    order,assigned = assign_layers(table,positions,layer_column,layer_rules,layers)
+
+    result = []
+    for index,name in enumerate(order,start=1):
+        if name in assigned:
+            layer_table = table.take(assigned[name])
+            result.append(Layer(name,index,get_spec(layer_table,get_conda_channels(layer_table),yml_name)))
+
+    return result
+
+def get_layer_manifest_path(yml_path):
+    '''The layers of environment.yml are listed in environment.layers.json'''
+
+    stem = os.path.splitext(yml_path)[0]
+    return f"{stem}.layers.json"
+
+def write_layers(table,
+                 operating_system,
+                 yml_name=None,
+                 yml_file_name='environment.yml',
+                 write_conda_channels=False,
+                 yml_dir=None,
+                 languages='all',
+                 layer_column=None,
+                 layer_rules=None,
+                 layers=None,
+                 write=write_atomic,
+                 remove=os.remove):
+    '''Writes one .yml file per layer and the layer manifest
+
+    Parameters
+    ----------
+    table : tcy.table.Table or tcy.catalog.Catalog
+        An already validated table (or its catalog).
+    operating_system, yml_name, yml_file_name, write_conda_channels, yml_dir, languages :
+        See run().
+    layer_column : str, optional
+        Column of the .tsv file that contains the layer of every package.
+        The default is None.
+    layer_rules : str or list of dict, optional
+        Rules that assign packages to layers (or the path to a .json file
+        that contains them). Only used if layer_column is None. The
+        default is None.
+    layers : str or list of str, optional
+        The order of the layers (comma-separated if str). Layers that are not
+        listed follow. The default is None.
+    write : callable, optional
+        Writes a file (see tcy.tcy.write_environment_files).
+    remove : callable, optional
+        Called with the path of every file of a layer that became empty since
+        the last run. The default is os.remove (tcy watch removes the files
+        itself).
+
+    Returns
+    -------
+    written_paths : list of str
+        The .yml files of all layers and the layer manifest.
+
+    '''
+
+    yml_path = os.path.join(yml_dir,yml_file_name) if yml_dir else yml_file_name
+    manifest_path = get_layer_manifest_path(yml_path)
+
+    entries = []
+    written_paths = []
+    cumulative = hashlib.sha256()
+
+    for layer in build_layers(operating_system,yml_name,languages,catalog=table,layer_column=layer_column,
+                              layer_rules=layer_rules,layers=layers):
+
+        file_name = layer.get_file_name(yml_file_name)
+        content = layer.spec.to_yml(write_conda_channels)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        cumulative.update(digest.encode('ascii'))
+
+        path = os.path.join(yml_dir,file_name) if yml_dir else file_name
+        write(path,content)
+        written_paths.append(path)
+
+        entries.append({'index':layer.index,
+                        'name':layer.name,
+                        'file':file_name,
+                        'sha256':digest,
+                        'cumulative_sha256':cumulative.hexdigest(),
+                        'conda_packages':len(layer.spec.conda_packages),
+                        'pip_packages':len(layer.spec.pip_packages)})
+
+    # remove the files of layers that became empty since the last run
+    old_files = _read_layer_files(manifest_path)
+    for file_name in old_files - {entry['file'] for entry in entries}:
+        if os.path.basename(file_name) != file_name:
+            continue
+        path = os.path.join(yml_dir,file_name) if yml_dir else file_name
+        if os.path.isfile(path):
+            remove(path)
+
+    write(manifest_path,json.dumps({'yml_name':yml_name,'operating_system':operating_system,
+                                    'layers':entries},indent=2) + '\n')
+    written_paths.append(manifest_path)
+
+    return written_paths
+
+def _read_layer_files(manifest_path):
+    '''Returns the file names of all layers of an existing layer manifest'''
+
+    try:
+        with open(manifest_path) as f:
+            return {entry['file'] for entry in json.load(f)['layers']}
+    except (OSError,ValueError,KeyError,TypeError):
+        return set()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Skip the creation of environment files when nothing has changed
+
+Notes:
+
+- After every successful run a small manifest is written next to the .yml
+  file. It stores a hash of the .tsv file, a hash of the validation rules,
+  the tcy version, the (normalized) arguments of run() and a hash of every
+  file that was written.
+- On the next run, run() compares these values with the current ones. If all
+  of them match and the output files are unchanged, run() returns early
+  without validating the .tsv file or rewriting any file (which would bump
+  their modification times).
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+import hashlib
+
+from . import __version__
+from .render import write_atomic
+from .validation import TEST_CONFIGS_PATH
+
+def hash_file(path):
+    '''Returns the sha256 hex digest of a file'''
+
+    digest = hashlib.sha256()
+
+    # read in blocks, so large files do not have to fit into memory
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def get_manifest_path(yml_path):
+    '''The manifest of environment.yml is stored as .environment.yml.tcy-manifest.json'''
+
+    yml_dir,yml_file_name = os.path.split(yml_path)
+    return os.path.join(yml_dir,f".{yml_file_name}.tcy-manifest.json")
+
+def get_inputs(tsv_path,options,test_configs_path=TEST_CONFIGS_PATH):
+    '''Returns everything that determines the content of the output files
+
+    Parameters
+    ----------
+    tsv_path : str or list of str
+        Path to the .tsv file (or the paths to all merged .tsv files in the
+        order of their precedence).
+    options : dict
+        The arguments of run() that change the content of the output files.
+        Must be JSON serializable.
+    test_configs_path : str, optional
+        Path to the validation rules. The default is the test_configs.json
+        file that is shipped with tcy.
+
+    '''
+
+    return {'tcy_version':__version__,
+            'tsv_sha256':(hash_file(tsv_path) if isinstance(tsv_path,str)
+                          else [[path,hash_file(path)] for path in tsv_path]),
+            'test_configs_sha256':hash_file(test_configs_path),
+            'options':options}
+
+def is_up_to_date(manifest_path,inputs):
+    '''Returns True if the manifest was written for the same inputs and all
+    output files that are listed in it are unchanged'''
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError,ValueError):
+        return False
+
+    if manifest.get('inputs') != inputs:
+        return False
+
+    manifest_dir = os.path.dirname(manifest_path)
+
+    try:
+        return all(hash_file(os.path.join(manifest_dir,path)) == digest
+                   for path,digest in manifest['outputs'].items())
+    except (OSError,KeyError,AttributeError):
+        return False
+
+def write_manifest(manifest_path,inputs,output_paths):
+    '''Store the inputs and the hashes of all written files. Paths are stored
+    relative to the manifest, so the manifest stays valid when the directory
+    is moved (e.g. in a fresh clone of a repository)'''
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    manifest = {'inputs':inputs,
+                'outputs':{os.path.relpath(os.path.abspath(path),manifest_dir).replace(os.sep,'/'):hash_file(path)
+                           for path in output_paths}}
+
+    write_atomic(manifest_path,json.dumps(manifest,indent=2) + '\n')
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""
+Parse and compare conda versions and match specifications (e.g. 'numpy>=1.21',
+'python 3.11.* *_cpython' or 'conda-forge::scipy=1.11')
+
+Notes:
+
+- Versions are ordered like conda orders them: an optional epoch ('1!'), the
+  version itself and an optional local version ('+local'). The version is
+  split at '.' and '_' into components. Numbers inside a component are
+  compared as numbers, 'dev' is older than any other string, strings are
+  older than numbers and 'post' is newer than everything. Missing components
+  count as 0, so '1.0' == '1.0.0'.
+- Version specs support ==, !=, <, <=, >, >=, ~=, '=1.2' (which means
+  '1.2.*'), globs like '1.2.*', ',' (and) and '|' (or). Parentheses are not
+  supported.
+- Parsed versions and specs are cached, because the same strings appear many
+  times in a repodata.json file.
+- A cell of the version column (e.g. '>=1.21' or '=1.21=py311*') is compiled
+  into a Constraint (version spec and build). compile_constraints() compiles
+  all distinct cells of a column at once and collects the invalid ones.
+- are_compatible() decides whether several constraints can be satisfied by
+  the same version. Each spec is a union of intervals whose end points are
+  the versions it mentions, so it is enough to test every mentioned version,
+  a version just below it ('1.2.dev0') and one just above it ('1.2.0.1').
+
+@author: Johannes.Wiesner
+"""
+
+import re
+from functools import lru_cache
+from fnmatch import fnmatchcase
+from itertools import zip_longest
+
+# pieces of a version component: numbers, words or '*'
+_PIECE = re.compile(r'\d+|[a-z]+|\*')
+
+# 'name' followed by an optional version (and build) specification
+_NAME = re.compile(r'^([A-Za-z0-9_.\-]+)\s*(.*)$')
+
+_OPERATORS = ('==','!=','<=','>=','~=','<','>','=')
+
+class VersionOrder:
+    '''A parsed conda version that can be compared with other versions
+
+    Parameters
+    ----------
+    version : str
+        A conda version (e.g. '1.2.3', '2.0rc1', '1!2.0+local').
+
+    '''
+
+    __slots__ = ('version','epoch','components','local')
+
+    def __init__(self,version):
+        self.version = version
+        text = version.strip().lower()
+
+        if not text:
+            raise ValueError('Empty version string')
+
+        epoch,_,text = text.rpartition('!')
+        self.epoch = int(epoch) if epoch else 0
+
+        text,_,local = text.partition('+')
+        self.components = _split_components(text,version)
+        self.local = _split_components(local,version) if local else ()
+
+    def _compare(self,other):
+        '''Returns -1, 0 or 1'''
+
+        if self.epoch != other.epoch:
+            return -1 if self.epoch < other.epoch else 1
+
+        return _compare_components(self.components,other.components) or \
+               _compare_components(self.local,other.local)
+
+    def __eq__(self,other):
+        return self._compare(other) == 0
+
+    def __lt__(self,other):
+        return self._compare(other) < 0
+
+    def __le__(self,other):
+        return self._compare(other) <= 0
+
+    def __gt__(self,other):
+        return self._compare(other) > 0
+
+    def __ge__(self,other):
+        return self._compare(other) >= 0
+
+    def startswith(self,other):
+        '''True if the first components of this version are equal to all
+        components of other (i.e. '1.2.3' starts with '1.2', '1.20' does not)'''
+
+        if self.epoch != other.epoch:
+            return False
+
+        n = len(other.components)
+        return _compare_components(self.components[:n],other.components) == 0
+
+    def __repr__(self):
+        return f"VersionOrder({self.version!r})"
+
+# numbers are compared as (1,number), so 'dev' < words < numbers < 'post'
+_DEV = (-1,'')
+_POST = (2,'')
+_ZERO = (1,0)
+
+def _split_components(text,version):
+    '''Split a version at '.' and '_' (and '-' if there is no '_') into tuples of pieces'''
+
+    if '-' in text and '_' not in text:
+        text = text.replace('-','_')
+
+    components = []
+
+    for component in text.replace('_','.').split('.'):
+
+        pieces = _PIECE.findall(component)
+        if not pieces or ''.join(pieces) != component:
+            raise ValueError(f"Invalid version {version!r}")
+
+        # components that start with a word are treated as if they started with 0
+        if not pieces[0].isdigit():
+            pieces.insert(0,'0')
+
+        components.append(tuple(_ZERO if p == '*' else (1,int(p)) if p.isdigit() else
+                                _DEV if p == 'dev' else _POST if p == 'post' else (0,p) for p in pieces))
+
+    return tuple(components)
+
+def _compare_components(a,b):
+    '''Compare two tuples of components (missing pieces count as 0)'''
+
+    for x,y in zip_longest(a,b,fillvalue=(_ZERO,)):
+        if x == y:
+            continue
+        for p,q in zip_longest(x,y,fillvalue=_ZERO):
+            if p != q:
+                return -1 if p < q else 1
+    return 0
+
+@lru_cache(maxsize=None)
+def parse_version(version):
+    '''Returns the (cached) VersionOrder of a version string'''
+
+    return VersionOrder(version)
+
+class VersionSpec:
+    '''A compiled version specification (e.g. '>=1.2,<2|3.*')
+
+    Parameters
+    ----------
+    spec : str
+        The version specification. '' and '*' match every version.
+
+    '''
+
+    __slots__ = ('spec','alternatives')
+
+    def __init__(self,spec):
+        self.spec = spec.strip()
+
+        # list of alternatives ('|'), each alternative is a list of (operator,VersionOrder) that must all match
+        self.alternatives = []
+
+        if self.spec in ('','*'):
+            return
+
+        if '(' in self.spec or ')' in self.spec:
+            raise ValueError(f"Parentheses are not supported in version specs: {spec!r}")
+
+        for alternative in self.spec.split('|'):
+            constraints = []
+            for term in alternative.split(','):
+                constraints += _parse_term(term.strip(),spec)
+            self.alternatives.append(constraints)
+
+    def match(self,version):
+        '''True if a version (str or VersionOrder) matches the specification'''
+
+        if not self.alternatives:
+            return True
+
+        if isinstance(version,str):
+            version = parse_version(version)
+
+        return any(all(_OPERATOR_FUNCTIONS[operator](version,other) for operator,other in constraints)
+                   for constraints in self.alternatives)
+
+    def __eq__(self,other):
+        return isinstance(other,VersionSpec) and self.spec == other.spec
+
+    def __hash__(self):
+        return hash(self.spec)
+
+    def __str__(self):
+        return self.spec
+
+    def __repr__(self):
+        return f"VersionSpec({self.spec!r})"
+
+def _parse_term(term,spec):
+    '''Returns a list of (operator,VersionOrder) for a single term like '>=1.2' or '1.2.*' '''
+
+    if not term:
+        raise ValueError(f"Invalid version spec {spec!r}")
+
+    operator = next((o for o in _OPERATORS if term.startswith(o)),'')
+    version = term[len(operator):].strip()
+
+    if not version:
+        raise ValueError(f"Invalid version spec {spec!r}")
+
+    if version == '*':
+        return []
+
+    if operator == '~=':
+        # compatible release: ~=1.2.3 means >=1.2.3,==1.2.*
+        lower = parse_version(version.rstrip('.*'))
+        prefix = parse_version('.'.join(version.rstrip('.*').split('.')[:-1]) or version)
+        return [('>=',lower),('startswith',prefix)]
+
+    glob = version.endswith('*')
+    version = version.rstrip('*').rstrip('.')
+
+    # '=1.2' and '1.2.*' match every version that starts with 1.2
+    if operator == '=' or (glob and operator in ('','==')):
+        return [('startswith',parse_version(version))]
+
+    if glob and operator == '!=':
+        return [('notstartswith',parse_version(version))]
+
+    # '>=1.2.*' is treated like '>=1.2' (like conda does)
+    return [(operator or '==',parse_version(version))]
+
+_OPERATOR_FUNCTIONS = {'==':lambda v,o: v == o,
+                       '!=':lambda v,o: v != o,
+                       '<':lambda v,o: v < o,
+                       '<=':lambda v,o: v <= o,
+                       '>':lambda v,o: v > o,
+                       '>=':lambda v,o: v >= o,
+                       'startswith':lambda v,o: v.startswith(o),
+                       'notstartswith':lambda v,o: not v.startswith(o)}
+
+@lru_cache(maxsize=None)
+def parse_version_spec(spec):
+    '''Returns the (cached) VersionSpec of a version specification'''
+
+    return VersionSpec(spec)
+
+class Constraint:
+    '''A compiled cell of the version column (version spec and optional build)
+
+    Parameters
+    ----------
+    spec : str
+        The version column of a package as it is appended to its name in the
+        .yml file (e.g. '>=1.21', '=1.21=py311*', '1.21.*').
+
+    '''
+
+    __slots__ = ('spec','version','build')
+
+    def __init__(self,spec):
+        self.spec = spec.strip()
+        version,build = _split_version_build(self.spec)
+        self.version = parse_version_spec(version)
+        self.build = build
+
+    def match(self,version,build=None):
+        '''True if a version (and build string) satisfies the constraint'''
+
+        return self.version.match(version) and (self.build is None or build is None or fnmatchcase(build,self.build))
+
+    def __eq__(self,other):
+        return isinstance(other,Constraint) and self.spec == other.spec
+
+    def __hash__(self):
+        return hash(self.spec)
+
+    def __str__(self):
+        return self.spec
+
+    def __repr__(self):
+        return f"Constraint({self.spec!r})"
+
+def _split_version_build(rest):
+    '''Split the part of a match spec after the name into version and build'''
+
+    rest = rest.strip()
+
+    if ' ' in rest:
+        # repodata format: 'name version build'
+        version,build = rest.split(None,1)
+    elif rest.startswith('=') and not rest.startswith('==') and '=' in rest[1:]:
+        # yml format with build: 'name=version=build'
+        version,build = rest[1:].split('=',1)
+    else:
+        version,build = rest,None
+
+    return version,build.strip() if build and build.strip() != '*' else None
+
+@lru_cache(maxsize=None)
+def parse_constraint(spec):
+    '''Returns the (cached) Constraint of a cell of the version column'''
+
+    return Constraint(spec)
+
+def compile_constraints(specs):
+    '''Compile every distinct spec of a column once
+
+    Parameters
+    ----------
+    specs : iterable of str or None
+        Cells of the version column. Empty cells (None) are skipped.
+
+    Returns
+    -------
+    constraints : dict
+        {spec: Constraint} of all valid specs.
+    errors : dict
+        {spec: error message} of all invalid specs.
+
+    '''
+
+    constraints = {}
+    errors = {}
+
+    for spec in dict.fromkeys(specs):
+        if spec is None:
+            continue
+        try:
+            constraints[spec] = parse_constraint(spec)
+        except ValueError as e:
+            errors[spec] = str(e)
+
+    return constraints,errors
+
+def _get_candidates(constraints):
+    '''Versions that are tested by are_compatible (see the notes above)'''
+
+    candidates = {}
+
+    for constraint in constraints:
+        for alternative in constraint.version.alternatives:
+            for _,version in alternative:
+                for text in (version.version,f"{version.version}.dev0",f"{version.version}.0.1"):
+                    if text not in candidates:
+                        try:
+                            candidates[text] = parse_version(text)
+                        except ValueError:
+                            pass
+
+    return candidates.values()
+
+def _are_builds_compatible(builds):
+    '''Builds without wildcards must be equal (and match all other builds).
+    Builds with wildcards must agree on the part before the first wildcard'''
+
+    literal = {build for build in builds if not any(c in build for c in '*?[')}
+    if len(literal) > 1 or not all(fnmatchcase(l,build) for l in literal for build in builds):
+        return False
+
+    prefixes = [re.split(r'[*?\[]',build,1)[0] for build in builds]
+    return all(p.startswith(q) or q.startswith(p) for p in prefixes for q in prefixes)
+
+def are_compatible(constraints):
+    '''True if a single version (and build) can satisfy all constraints
+
+    Parameters
+    ----------
+    constraints : iterable of Constraint or str
+        Compiled (or not yet compiled) cells of the version column.
+
+    '''
+
+    constraints = [parse_constraint(c) if isinstance(c,str) else c for c in constraints]
+
+    if not _are_builds_compatible([c.build for c in constraints if c.build is not None]):
+        return False
+
+    constraints = [c for c in constraints if c.version.alternatives]
+    if len(constraints) < 2:
+        return True
+
+    return any(all(c.version.match(candidate) for c in constraints) for candidate in _get_candidates(constraints))
+
+class MatchSpec:
+    '''A compiled conda match specification
+
+    Parameters
+    ----------
+    spec : str
+        Either in the format of the yml files that tcy writes and of the
+        version column ('numpy>=1.21', 'conda-forge::numpy=1.21=py311h*')
+        or in the format of the 'depends' entries of repodata.json files
+        ('numpy >=1.21', 'python_abi 3.11.* *_cp311').
+
+    '''
+
+    __slots__ = ('spec','name','version','build','channel')
+
+    def __init__(self,spec):
+        self.spec = spec.strip()
+        text = self.spec
+
+        self.channel = None
+        if '::' in text:
+            self.channel,text = text.split('::',1)
+
+        match = _NAME.match(text)
+        if not match:
+            raise ValueError(f"Invalid match spec {spec!r}")
+
+        name,rest = match.groups()
+        version,build = _split_version_build(rest)
+
+        self.name = name
+        self.version = parse_version_spec(version)
+        self.build = build
+
+    def match(self,name,version,build=None):
+        '''True if a package (name, version and build string) matches the specification'''
+
+        return (name == self.name
+                and self.version.match(version)
+                and (self.build is None or build is None or fnmatchcase(build,self.build)))
+
+    def __eq__(self,other):
+        return isinstance(other,MatchSpec) and self.spec == other.spec
+
+    def __hash__(self):
+        return hash(self.spec)
+
+    def __str__(self):
+        return self.spec
+
+    def __repr__(self):
+        return f"MatchSpec({self.spec!r})"
+
+@lru_cache(maxsize=None)
+def parse_match_spec(spec):
+    '''Returns the (cached) MatchSpec of a match specification'''
+
+    return MatchSpec(spec)
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Merge several .tsv files (e.g. a shared base catalog and the catalogs of
+single teams) into a single .tsv file
+
+Notes:
+
+- Inputs can be .tsv files, directories (all .tsv files in them) or glob
+  patterns. Later inputs take precedence over earlier ones, so the base
+  catalog should be passed first. precedence lists inputs (by path, file
+  name or file name without extension) from highest to lowest precedence.
+- Every input is streamed once: its rows are validated on the fly (see
+  tcy.validation.StreamingValidator) and sorted by package_name with the
+  external sort of the 'streaming' engine. The sorted inputs are merged in
+  a single k-way pass, so only the rows of a single package are kept in
+  memory at once (indexed by input in a hash map).
+- A package is taken from the input with the highest precedence that lists
+  it (all of its rows). Rows of other inputs are compared against it and
+  reported as conflicts (with the file and cell of both rows) if they use a
+  different package manager or conda channel, a version spec that cannot be
+  satisfied together with it or a different include flag.
+- run() merges the inputs into a hidden file next to the .yml file (e.g.
+  .environment.yml.merged.tsv) if tsv_path is a list, a directory or a glob
+  pattern.
+
+Usage:
+
+    tcy merge environments/base.tsv environments/teams --output packages.tsv
+    tcy merge 'catalogs/*.tsv' --precedence neuro,base --strict
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import csv
+import glob
+import heapq
+import string
+from contextlib import closing
+from itertools import groupby
+
+from .matchspec import are_compatible
+from .render import atomic_open
+from .streaming import ExternalSorter, DEFAULT_BUFFER_ROWS
+from .table import iter_tsv
+from .validation import StreamingValidator, TsvValidationError, FILE_RULES, ValidationReport
+
+# columns whose values are compared across inputs (in the order in which conflicts are reported)
+CONFLICT_COLUMNS = ('package_manager','conda_channel','version','include')
+
+class MergeConflict:
+    '''A package that is listed differently in two inputs
+
+    Parameters
+    ----------
+    package_name : str
+        Name of the package.
+    column : str
+        The column that differs (one of CONFLICT_COLUMNS).
+    value, other_value : str or None
+        The value of the row that was taken and the value of the other row.
+    location, other_location : str
+        File and cell of both values (e.g. teams/neuro.tsv:D5).
+
+    '''
+
+    __slots__ = ('package_name','column','value','other_value','location','other_location')
+
+    def __init__(self,package_name,column,value,other_value,location,other_location):
+        self.package_name = package_name
+        self.column = column
+        self.value = value
+        self.other_value = other_value
+        self.location = location
+        self.other_location = other_location
+
+    def to_dict(self):
+        return {a:getattr(self,a) for a in self.__slots__}
+
+    def __str__(self):
+        return (f"{self.package_name}: {self.column} {self.value} ({self.location}) "
+                f"conflicts with {self.other_value} ({self.other_location}), "
+                f"using {self.location.rsplit(':',1)[0]}")
+
+    def __repr__(self):
+        return f"MergeConflict({self.package_name!r}, {self.column!r}, {self.value!r}, {self.other_value!r})"
+
+class MergeConflictError(ValueError):
+    '''Raised by merge_catalogs() in strict mode when the inputs conflict'''
+
+    def __init__(self,conflicts):
+        self.conflicts = conflicts
+        lines = [f"found {len(conflicts)} conflict(s) between the merged .tsv files"]
+        lines += [str(conflict) for conflict in conflicts]
+        super().__init__('\n'.join(lines))
+
+class MergeConflictWarning(UserWarning):
+    '''Issued by run() for every conflict between merged .tsv files'''
+
+class MergeResult:
+    '''Summary of a merge
+
+    Parameters
+    ----------
+    paths : list of str
+        The inputs from highest to lowest precedence.
+    n_rows : int
+        Number of rows of the merged file.
+    conflicts : list of MergeConflict
+        Sorted by package_name.
+
+    '''
+
+    __slots__ = ('paths','n_rows','conflicts')
+
+    def __init__(self,paths,n_rows,conflicts):
+        self.paths = paths
+        self.n_rows = n_rows
+        self.conflicts = conflicts
+
+    def __str__(self):
+        lines = [f"merged {len(self.paths)} file(s) into {self.n_rows} rows "
+                 f"({len(self.conflicts)} conflict(s))"]
+        lines += [str(conflict) for conflict in self.conflicts]
+        return '\n'.join(lines)
+
+def is_catalog_set(tsv_path):
+    '''True if tsv_path refers to several .tsv files (a list, a directory or
+    a glob pattern) instead of a single file'''
+
+    if not isinstance(tsv_path,str):
+        return True
+    return os.path.isdir(tsv_path) or glob.has_magic(tsv_path)
+
+def resolve_catalogs(paths):
+    '''Returns the paths of all .tsv files of a path, directory or glob
+    pattern (or a list of them) in the given order without duplicates'''
+
+    if isinstance(paths,str):
+        paths = [paths]
+
+    resolved = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(os.path.join(path,name) for name in os.listdir(path)
+                           if name.endswith('.tsv') and not name.startswith('.'))
+        elif glob.has_magic(path):
+            found = sorted(glob.glob(path))
+        else:
+            found = [path]
+        if not found:
+            raise ValueError(f"{path} does not contain any .tsv file")
+        resolved += found
+
+    seen = set()
+    return [path for path in resolved if not (os.path.abspath(path) in seen or seen.add(os.path.abspath(path)))]
+
+def order_by_precedence(paths,precedence=None):
+    '''Returns the inputs from highest to lowest precedence. Inputs listed in
+    precedence come first (in that order), all others follow with later
+    inputs before earlier ones'''
+
+    if isinstance(precedence,str):
+        precedence = precedence.split(',')
+
+    def matches(path,entry):
+        name = os.path.basename(path)
+        return entry in (path,os.path.normpath(path),name,os.path.splitext(name)[0])
+
+    remaining = list(reversed(paths))
+    ordered = []
+
+    for entry in precedence or []:
+        if not any(matches(path,entry) for path in paths):
+            raise ValueError(f"{entry!r} in precedence does not match any of the merged files "
+                             f"({', '.join(paths)})")
+        for path in [path for path in remaining if matches(path,entry)]:
+            remaining.remove(path)
+            ordered.append(path)
+
+    return ordered + remaining
+
+def get_merge_order(paths,precedence=None):
+    '''Returns the paths of all .tsv files of paths (see resolve_catalogs)
+    from highest to lowest precedence (see order_by_precedence)'''
+
+    return order_by_precedence(resolve_catalogs(paths),precedence)
+
+def _sort_catalog(path,rank,columns,test_configs,buffer_rows,tmp_dir):
+    '''Validate a .tsv file while it is streamed and sort its rows by
+    package_name. Returns the header of the file and the sorter, whose
+    records are (package_name,rank,position,row) with the cells in the order
+    of columns (or the header of the file if columns is None)'''
+
+    if not os.path.isfile(path):
+        report = ValidationReport(path)
+        for rule in FILE_RULES:
+            report.violations += rule({'tsv_path':path})
+        raise TsvValidationError(report)
+
+    rows = iter_tsv(path)
+    header = next(rows)
+    validator = StreamingValidator(path,header,test_configs,buffer_rows,tmp_dir)
+
+    if not validator.active:
+        raise TsvValidationError(validator.finish())
+
+    if columns is not None and set(header) != set(columns):
+        raise ValueError(f"{path} does not have the same columns as the other files "
+                         f"({', '.join(header)} instead of {', '.join(columns)})")
+
+    # cells only have to be reordered if the columns of the file are in a different order
+    order = [header.index(column) for column in columns] if columns and columns != header else None
+    i_name = header.index('package_name')
+    sorter = ExternalSorter(buffer_rows,tmp_dir)
+
+    try:
+        for position,row in enumerate(rows):
+            validator.add(position,row)
+            sorter.add((row[i_name],position),(row[i_name],rank,position,
+                                                tuple(row) if order is None else tuple(row[i] for i in order)))
+
+        report = validator.finish()
+        if not report.ok:
+            raise TsvValidationError(report)
+    except BaseException:
+        sorter.close()
+        raise
+
+    return header,sorter
+
+def find_conflicts(package_name,selected,others,columns,locate):
+    '''Returns the conflicts between the rows of the selected input and the
+    rows of the other inputs of a single package
+
+    Parameters
+    ----------
+    package_name : str
+        Name of the package.
+    selected : list of tuples
+        (rank,position,row) of all rows of the selected input.
+    others : list of tuples
+        (rank,position,row) of all rows of the other inputs.
+    columns : list of str
+        The columns of the rows.
+    locate : callable
+        locate(rank,position,column) returns the file and cell of a value.
+
+    '''
+
+    index = {column:i for i,column in enumerate(columns)}
+    i_manager,i_channel,i_version,i_include,i_bug_flag = (index[c] for c in ['package_manager','conda_channel',
+                                                                            'version','include','bug_flag'])
+
+    conflicts = []
+
+    for rank,position,row in others:
+
+        # compare against the row of the same package manager (and the same
+        # bug flag if there are several of them)
+        candidates = [s for s in selected if s[2][i_manager] == row[i_manager]]
+        if not candidates:
+            s_rank,s_position,s_row = selected[0]
+            conflicts.append(MergeConflict(package_name,'package_manager',s_row[i_manager],row[i_manager],
+                                           locate(s_rank,s_position,'package_manager'),
+                                           locate(rank,position,'package_manager')))
+            continue
+
+        s_rank,s_position,s_row = next((s for s in candidates if s[2][i_bug_flag] == row[i_bug_flag]),candidates[0])
+
+        differs = {'conda_channel':row[i_manager] == 'conda' and s_row[i_channel] != row[i_channel],
+                   'version':(s_row[i_version] is not None and row[i_version] is not None
+                              and s_row[i_version] != row[i_version]
+                              and not are_compatible([s_row[i_version],row[i_version]])),
+                   'include':(s_row[i_include] or '').lower() != (row[i_include] or '').lower()}
+
+        for column in CONFLICT_COLUMNS[1:]:
+            if differs[column]:
+                conflicts.append(MergeConflict(package_name,column,s_row[index[column]],row[index[column]],
+                                               locate(s_rank,s_position,column),locate(rank,position,column)))
+
+    return conflicts
+
+def iter_merged(paths,precedence=None,test_configs=None,buffer_rows=DEFAULT_BUFFER_ROWS,tmp_dir=None,
+                conflicts=None):
+    '''Merge .tsv files in a single k-way pass over their sorted rows
+
+    Parameters
+    ----------
+    paths : str or list of str
+        .tsv files, directories or glob patterns (see resolve_catalogs).
+    precedence : str or list of str, optional
+        Inputs from highest to lowest precedence (comma-separated if str).
+        See order_by_precedence. The default is None (later inputs first).
+    test_configs : dict, optional
+        Validation rules. The default is None (test_configs.json).
+    buffer_rows : int, optional
+        Maximal number of rows of an input that are sorted in memory.
+    tmp_dir : str, optional
+        Directory for the temporary files of the external sort.
+    conflicts : list, optional
+        If given, all found conflicts are appended to it.
+
+    Yields
+    ------
+    The header of the first input first and then all merged rows (sorted
+    by package_name).
+
+    Raises
+    ------
+    TsvValidationError
+        If any input violates any of the rules in test_configs.json.
+
+    '''
+
+    return _iter_merged(get_merge_order(paths,precedence),test_configs,buffer_rows,tmp_dir,conflicts)
+
+def _iter_merged(paths,test_configs,buffer_rows,tmp_dir,conflicts):
+    '''See iter_merged. paths are ordered from highest to lowest precedence'''
+
+    headers,sorters = [],[]
+
+    try:
+        for rank,path in enumerate(paths):
+            header,sorter = _sort_catalog(path,rank,headers[0] if headers else None,
+                                          test_configs,buffer_rows,tmp_dir)
+            headers.append(header)
+            sorters.append(sorter)
+
+        columns = headers[0]
+        letters = [dict(zip(header,string.ascii_uppercase)) for header in headers]
+
+        def locate(rank,position,column):
+            return f"{paths[rank]}:{letters[rank][column]}{position + 2}"
+
+        yield columns
+
+        # records are unique by (package_name,rank,position), so rows are never compared
+        for package_name,records in groupby(heapq.merge(*sorters),key=lambda record: record[0]):
+
+            by_rank = {}
+            for _,rank,position,row in records:
+                by_rank.setdefault(rank,[]).append((rank,position,row))
+
+            selected = by_rank.pop(min(by_rank))
+
+            if by_rank and conflicts is not None:
+                others = [record for rank in sorted(by_rank) for record in by_rank[rank]]
+                conflicts += find_conflicts(package_name,selected,others,columns,locate)
+
+            for _,_,row in selected:
+                yield row
+
+    finally:
+        for sorter in sorters:
+            sorter.close()
+
+def merge_catalogs(paths,output_path,precedence=None,strict=False,test_configs=None,
+                   buffer_rows=DEFAULT_BUFFER_ROWS,tmp_dir=None,ordered=False):
+    '''Merge .tsv files and write the merged .tsv file atomically. An existing
+    file with the same content is left untouched (its modification time
+    does not change)
+
+    Parameters
+    ----------
+    paths : str or list of str
+        .tsv files, directories or glob patterns (see resolve_catalogs).
+    output_path : str
+        Path to the merged .tsv file.
+    precedence : str or list of str, optional
+        See iter_merged. The default is None (later inputs first).
+    strict : bool, optional
+        If True, no file is written if the inputs conflict. The default is False.
+    test_configs, buffer_rows, tmp_dir : optional
+        See iter_merged.
+    ordered : bool, optional
+        If True, paths are .tsv files that are already ordered from highest
+        to lowest precedence (see get_merge_order) and precedence is not
+        used. The default is False.
+
+    Returns
+    -------
+    result : MergeResult
+
+    Raises
+    ------
+    TsvValidationError
+        If any input violates any of the rules in test_configs.json.
+    MergeConflictError
+        If strict is True and the inputs conflict.
+
+    '''
+
+    if not ordered:
+        paths = get_merge_order(paths,precedence)
+    conflicts = []
+    n_rows = 0
+
+    with atomic_open(output_path,keep_unchanged=True) as f, closing(_iter_merged(paths,test_configs,buffer_rows,tmp_dir,conflicts)) as rows:
+        writer = csv.writer(f,delimiter='\t',lineterminator='\n')
+        writer.writerow(next(rows))
+        for row in rows:
+            writer.writerow(['' if cell is None else cell for cell in row])
+            n_rows += 1
+
+        # the merged file only replaces output_path if there are no conflicts
+        if strict and conflicts:
+            raise MergeConflictError(conflicts)
+
+    return MergeResult(paths,n_rows,conflicts)
+
+def get_merged_path(yml_path):
+    '''The inputs of environment.yml are merged into .environment.yml.merged.tsv'''
+
+    yml_dir,yml_file_name = os.path.split(yml_path)
+    return os.path.join(yml_dir,f".{yml_file_name}.merged.tsv")
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy merge',
+                                     description='Merge several .tsv files into a single .tsv file')
+    parser.add_argument('paths',type=str,nargs='+',
+                        help='.tsv files, directories or glob patterns. Later inputs take \
+                        precedence over earlier ones.')
+    parser.add_argument('--output',type=str,required=False,default='./packages.tsv',
+                        help='Path to the merged .tsv file. The default is ./packages.tsv')
+    parser.add_argument('--precedence',type=str,required=False,default=None,
+                        help='Comma-separated inputs (paths, file names or file names without \
+                        extension) from highest to lowest precedence. Inputs that are not \
+                        listed follow, later inputs before earlier ones.')
+    parser.add_argument('--strict',action='store_true',
+                        help='Do not write the merged file (and exit with 1) if the inputs conflict.')
+    parser.add_argument('--buffer_rows',type=int,required=False,default=DEFAULT_BUFFER_ROWS,
+                        help=f"Maximal number of rows of an input that are sorted in memory. \
+                        The default is {DEFAULT_BUFFER_ROWS}.")
+
+    args = parser.parse_args(argv)
+
+    try:
+        result = merge_catalogs(args.paths,args.output,args.precedence,args.strict,
+                                buffer_rows=args.buffer_rows)
+    except (OSError,ValueError) as e:
+        sys.exit(str(e))
+
+    print(result)
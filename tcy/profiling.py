@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Time the stages of run() (parsing, validation, selection and sorting, writing)
+
+Notes:
+
+- run() (and the functions it calls) wrap every stage in profiler.span(name).
+  Each span records its wall time, the number of rows it produced, the number
+  of bytes it wrote and the peak memory (RSS) of the process when it ended.
+- By default run() uses NULL_PROFILER, whose spans do nothing. Instrumentation
+  therefore costs a few function calls per run when it is switched off.
+- A callback receives every finished span as a dictionary, so library users
+  can forward the metrics to their own telemetry.
+
+Usage:
+
+    from tcy import run
+    from tcy.profiling import Profiler
+
+    profiler = Profiler(callback=print)
+    run('linux',tsv_path='./packages.tsv',profiler=profiler)
+    profiler.to_dict()
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import time
+
+def get_peak_memory():
+    '''Returns the peak resident set size of the process in bytes (None if
+    it cannot be determined on this platform)'''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is given in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def get_size(paths):
+    '''Returns the total size of all files in bytes'''
+
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+class Span:
+    '''A timed stage. rows and bytes_written can be set inside the with-block'''
+
+    __slots__ = ('name','seconds','rows','bytes_written','peak_memory')
+
+    def __init__(self,name):
+        self.name = name
+        self.seconds = None
+        self.rows = None
+        self.bytes_written = None
+        self.peak_memory = None
+
+    def to_dict(self):
+        return {attribute:getattr(self,attribute) for attribute in self.__slots__}
+
+class _NullSpan:
+    '''A span that ignores everything that is set on it'''
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        return False
+
+    def __setattr__(self,name,value):
+        pass
+
+class NullProfiler:
+    '''A profiler that does nothing (used when profiling is switched off)'''
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self,name):
+        return self._span
+
+    def annotate(self,**kwargs):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+class _ActiveSpan:
+    '''Context manager that times a span and reports it to its profiler'''
+
+    __slots__ = ('profiler','span','start')
+
+    def __init__(self,profiler,span):
+        self.profiler = profiler
+        self.span = span
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self,*exc_info):
+        self.span.seconds = time.perf_counter() - self.start
+        self.span.peak_memory = get_peak_memory()
+        self.profiler._finish(self.span)
+        return False
+
+class Profiler:
+    '''Collects the spans of one or more runs
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Called with the dictionary of every finished span (see Span.to_dict).
+        The default is None.
+
+    '''
+
+    enabled = True
+
+    def __init__(self,callback=None):
+        self.callback = callback
+        self.spans = []
+        self.annotations = {}
+        self.start = time.perf_counter()
+
+    def span(self,name):
+        return _ActiveSpan(self,Span(name))
+
+    def annotate(self,**kwargs):
+        '''Add information about the run (e.g. the engine or whether it was skipped)'''
+
+        self.annotations.update(kwargs)
+
+    def _finish(self,span):
+        self.spans.append(span)
+        if self.callback is not None:
+            self.callback(span.to_dict())
+
+    def to_dict(self):
+        '''Returns all spans and the totals of all spans'''
+
+        return {**self.annotations,
+                'wall_seconds':time.perf_counter() - self.start,
+                'bytes_written':sum(span.bytes_written or 0 for span in self.spans),
+                'peak_memory':get_peak_memory(),
+                'spans':[span.to_dict() for span in self.spans]}
+
+    def write(self,path):
+        '''Write the result of to_dict() to a .json file'''
+
+        with open(path,'w') as f:
+            json.dump(self.to_dict(),f,indent=2)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Render the content of the environment.yml file, the requirements.txt file
+and the CRAN installation script and write files atomically
+
+Notes:
+
+- The renderers only take (column) sequences of package names, versions and
+  channels. They do not depend on how the .tsv file was read, so all engines
+  produce exactly the same files.
+- Every file is written once and atomically: the content is written to a
+  temporary file in the same directory which then replaces the target file.
+  Concurrent readers therefore never see a half-written file.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+from contextlib import contextmanager
+
+def iter_yml(channels,conda_packages,pip_packages,has_pip,yml_name=None,
+             write_conda_channels=False,pip_requirements_file=False):
+    '''Yields the content of the environment.yml file in pieces
+
+    Parameters
+    ----------
+    channels : list of str
+        Channels in the order in which they should appear in the 'channels:' section.
+    conda_packages : iterable of tuples
+        (package_name,version,conda_channel) of every conda package in the
+        order in which they should appear. Empty cells are None.
+    pip_packages : iterable of str
+        Names of all pip packages.
+    has_pip : bool
+        If True, the 'pip:' section is written.
+    yml_name, write_conda_channels, pip_requirements_file : optional
+        See run().
+
+    '''
+
+    # yml-header
+    header = []
+
+    if yml_name:
+        header.append(f"name: {yml_name}\n")
+
+    header.append('channels:\n')
+
+    if write_conda_channels == False:
+        header += [f"- {channel}\n" for channel in channels]
+
+    header.append('- defaults\n')
+    header.append('dependencies:\n')
+
+    yield ''.join(header)
+
+    # conda packages. Missing channels are written as 'nan' (like pandas does)
+    if write_conda_channels:
+        yield from (f"- {'nan' if channel is None else channel}::{name}{'' if version is None else version}\n"
+                    for name,version,channel in conda_packages)
+    else:
+        yield from (f"- {name}{'' if version is None else version}\n" for name,version,_ in conda_packages)
+
+    # pip packages. These two lines are needed in any case
+    if has_pip:
+        yield '- pip\n- pip:\n'
+
+        if pip_requirements_file:
+            yield '  - -r requirements.txt'
+        else:
+            yield from (f"  - {name}\n" for name in pip_packages)
+
+def render_yml(channels,conda_packages,pip_packages,has_pip,yml_name=None,
+               write_conda_channels=False,pip_requirements_file=False):
+    '''Returns the content of the environment.yml file (see iter_yml)'''
+
+    return ''.join(iter_yml(channels,conda_packages,pip_packages,has_pip,yml_name,
+                            write_conda_channels,pip_requirements_file))
+
+def iter_requirements(pip_packages):
+    '''Yields the lines of the requirements.txt file'''
+
+    return (f"{name}\n" for name in pip_packages)
+
+def render_requirements(pip_packages):
+    '''Returns the content of the requirements.txt file'''
+
+    return ''.join(iter_requirements(pip_packages))
+
+def render_cran_installation_script(yml_name,cran_packages,cran_mirror,parallel=False,
+                                    ncpus=None,dependency_levels=False,local_repo=None):
+    '''Returns a bash script that installs CRAN-packages inside a conda environment
+    (see render_parallel_cran_installation_script if parallel is True)'''
+
+    if parallel:
+        return render_parallel_cran_installation_script(yml_name,cran_packages,cran_mirror,ncpus,
+                                                        dependency_levels,local_repo)
+
+    # parse list of CRAN-packages to a single string with packages separated by comma
+    cran_packages = ','.join(f"'{package}'" for package in cran_packages)
+
+    # the bash script allows you to:
+    # 1. activate the conda environment from within a bash-script as suggested here:
+    # https://github.com/conda/conda/issues/7980#issuecomment-472648567
+    # 2. use RScript to install packages within the conda environment.
+    # We have to specify a mirror because otherwise script will halt because
+    # we would have to choose one:
+    # https://stackoverflow.com/questions/50870927/using-install-packages-inside-a-shell-script-through-terminal-to-automatically
+    return ('#!/bin/bash\n'
+            "CONDA_BASE=$(conda info --base) && source $CONDA_BASE/etc/profile.d/conda.sh\n"
+            f"conda activate {yml_name} && Rscript -e \"install.packages(c({cran_packages}),repos=\'{cran_mirror}\')\"")
+
+# the part of the parallel installation script that does not depend on the
+# arguments. It expects packages, repos, ncpus and by_level to be defined
+_PARALLEL_CRAN_INSTALLATION = r"""
+# a single query of all installed packages, so packages that are already
+# installed are skipped (running the script again only installs what is missing)
+missing <- setdiff(packages,rownames(installed.packages()))
+cat(sprintf('%d of %d CRAN-packages are already installed\n',length(packages) - length(missing),length(packages)))
+
+# install packages in batches of the same dependency level: every batch only
+# depends on packages of earlier batches (or on packages that are not listed)
+batches <- list(missing)
+if (by_level && length(missing) > 1) {
+  dependencies <- tools::package_dependencies(missing,db=available.packages(repos=repos),recursive=TRUE)
+  batches <- list()
+  remaining <- missing
+  while (length(remaining) > 0) {
+    ready <- remaining[vapply(remaining,function(p) !any(dependencies[[p]] %in% setdiff(remaining,p)),logical(1))]
+    # circular dependencies are installed together
+    if (length(ready) == 0) ready <- remaining
+    batches[[length(batches) + 1]] <- ready
+    remaining <- setdiff(remaining,ready)
+  }
+}
+
+failed <- character(0)
+for (i in seq_along(batches)) {
+  batch <- batches[[i]]
+  if (length(batch) == 0) next
+  cat(sprintf('Installing %d CRAN-packages (batch %d of %d, Ncpus=%d)\n',length(batch),i,length(batches),ncpus))
+  start <- Sys.time()
+  install.packages(batch,repos=repos,Ncpus=ncpus)
+
+  # packages are built in parallel, so the time of a package is the time
+  # from the start of its batch until its installation was finished
+  for (package in batch) {
+    meta <- system.file('Meta','package.rds',package=package)
+    if (meta == '') {
+      failed <- c(failed,package)
+      cat(sprintf('%-30s failed\n',package))
+    } else {
+      cat(sprintf('%-30s %8.1f s\n',package,as.numeric(difftime(file.mtime(meta),start,units='secs'))))
+    }
+  }
+}
+
+if (length(failed) > 0) {
+  cat(sprintf('Could not install: %s\n',paste(failed,collapse=', ')))
+  quit(status=1)
+}
+"""
+
+def render_parallel_cran_installation_script(yml_name,cran_packages,cran_mirror,ncpus=None,
+                                             dependency_levels=False,local_repo=None):
+    '''Returns a bash script that only installs the CRAN-packages that are
+    not installed yet, builds them in parallel and reports the time of
+    every package
+
+    Parameters
+    ----------
+    yml_name : str
+        Name of the conda environment.
+    cran_packages : iterable of str
+        Names of all CRAN-packages.
+    cran_mirror : str
+        URL of the CRAN-mirror.
+    ncpus : int, optional
+        Number of packages that are built in parallel. If None, the number
+        of cores of the machine that runs the script. The default is None.
+    dependency_levels : bool, optional
+        If True, packages are installed in batches of the same dependency
+        level. The default is False.
+    local_repo : str, optional
+        URL or path of a local CRAN-like repository (e.g. a binary cache)
+        that is searched before the mirror. Paths are converted to file://
+        URLs. The default is None.
+
+    '''
+
+    repos = [f"CRAN='{cran_mirror}'"]
+    if local_repo:
+        if '://' not in local_repo:
+            local_repo = 'file://' + os.path.abspath(local_repo).replace(os.sep,'/')
+        repos.insert(0,f"LOCAL='{local_repo}'")
+
+    packages = ',\n  '.join(f"'{package}'" for package in cran_packages)
+
+    # the R code is passed on stdin, so it is not subject to quoting by bash
+    return ('#!/bin/bash\n'
+            "CONDA_BASE=$(conda info --base) && source $CONDA_BASE/etc/profile.d/conda.sh\n"
+            f"conda activate {yml_name} && Rscript -e 'source(file(\"stdin\"))' <<'EOF'\n"
+            f"packages <- c(\n  {packages})\n"
+            f"repos <- c({','.join(repos)})\n"
+            f"ncpus <- {f'{int(ncpus)}L' if ncpus else 'max(1L,parallel::detectCores(),na.rm=TRUE)'}\n"
+            f"by_level <- {'TRUE' if dependency_levels else 'FALSE'}\n"
+            f"{_PARALLEL_CRAN_INSTALLATION}"
+            'EOF\n')
+
+@contextmanager
+def atomic_open(path,binary=False,keep_unchanged=False):
+    '''Open a file for writing (in text mode, or in binary mode if binary is
+    True) that only replaces path when the with-block finishes without errors.
+    If keep_unchanged is True, path is not replaced (and keeps its
+    modification time) if it already has the written content'''
+
+    directory,name = os.path.split(os.path.abspath(path))
+    tmp_path = os.path.join(directory,f".{name}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+
+    try:
+        with open(tmp_path,'xb' if binary else 'x') as f:
+            yield f
+
+        if keep_unchanged and os.path.isfile(path) and _same_content(tmp_path,path):
+            os.remove(tmp_path)
+            return
+
+        # keep the permissions of an existing file
+        if os.path.exists(path):
+            os.chmod(tmp_path,os.stat(path).st_mode & 0o7777)
+
+        os.replace(tmp_path,path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_atomic(path,content,keep_unchanged=False):
+    '''Write content to path with a single write and replace path atomically
+    (see atomic_open for keep_unchanged)'''
+
+    with atomic_open(path,keep_unchanged=keep_unchanged) as f:
+        f.write(content)
+
+def _same_content(path,other_path):
+    '''True if two files have the same content (compared block by block)'''
+
+    if os.path.getsize(path) != os.path.getsize(other_path):
+        return False
+
+    with open(path,'rb') as f, open(other_path,'rb') as other:
+        while True:
+            block = f.read(1 << 20)
+            if block != other.read(1 << 20):
+                return False
+            if not block:
+                return True
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Load repodata.json files of local conda channels into an on-disk index
+
+Notes:
+
+- The index is a SQLite database (only the standard library is needed) with
+  one row per package file and an index on the package name, so looking up
+  all builds of a package does not require reading the repodata.json files.
+- Every repodata.json file is imported once. Its size and modification time
+  (and, if they changed, its sha256 hash) are stored in the index. A file is
+  only imported again when its content has changed.
+- Channels are given as name=path pairs, where path is the directory of a
+  (mirrored) channel that contains one directory per subdir (e.g.
+  linux-64/repodata.json and noarch/repodata.json).
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+import sqlite3
+
+from .manifest import hash_file
+
+# increase whenever the layout of the tables changes
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE sources (id INTEGER PRIMARY KEY,
+                      path TEXT UNIQUE,
+                      channel TEXT,
+                      subdir TEXT,
+                      base_url TEXT,
+                      size INTEGER,
+                      mtime_ns INTEGER,
+                      sha256 TEXT);
+CREATE TABLE packages (source_id INTEGER,
+                       name TEXT,
+                       version TEXT,
+                       build TEXT,
+                       build_number INTEGER,
+                       timestamp INTEGER,
+                       depends TEXT,
+                       constrains TEXT,
+                       track_features TEXT,
+                       url TEXT,
+                       md5 TEXT);
+CREATE INDEX packages_name ON packages (name, source_id);
+'''
+
+def get_default_index_path():
+    '''The index is stored in the user's cache directory by default'''
+
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return os.path.join(cache_dir,'tcy','repodata.sqlite')
+
+class PackageRecord:
+    '''A single package file of a channel'''
+
+    __slots__ = ('name','version','build','build_number','timestamp','depends','constrains',
+                 'track_features','url','md5','channel','subdir')
+
+    def __init__(self,name,version,build,build_number,timestamp,depends,constrains,
+                 track_features,url,md5,channel,subdir):
+        self.name = name
+        self.version = version
+        self.build = build
+        self.build_number = build_number
+        self.timestamp = timestamp
+        self.depends = depends
+        self.constrains = constrains
+        self.track_features = track_features
+        self.url = url
+        self.md5 = md5
+        self.channel = channel
+        self.subdir = subdir
+
+    def __repr__(self):
+        return f"PackageRecord({self.channel}::{self.name}-{self.version}-{self.build})"
+
+class RepodataIndex:
+    '''An on-disk index of the packages of one or more channels
+
+    Parameters
+    ----------
+    index_path : str, optional
+        Path to the SQLite database. The default is get_default_index_path().
+
+    '''
+
+    def __init__(self,index_path=None):
+        self.index_path = index_path or get_default_index_path()
+
+        index_dir = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(index_dir,exist_ok=True)
+
+        self.connection = sqlite3.connect(self.index_path)
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript('DROP TABLE IF EXISTS packages; DROP TABLE IF EXISTS sources;'
+                                          + SCHEMA + f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+        # ids of the repodata.json files that are used for lookups
+        self.source_ids = []
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+    def add_channel(self,channel,channel_dir,subdirs,base_url=None):
+        '''Use the repodata.json files of a channel for all following lookups
+        (and import them if they are new or have changed)
+
+        Parameters
+        ----------
+        channel : str
+            Name of the channel (e.g. 'conda-forge').
+        channel_dir : str
+            Directory that contains one directory per subdir.
+        subdirs : list of str
+            Subdirs that should be used (e.g. ['linux-64','noarch']). Subdirs
+            without a repodata.json file are skipped.
+        base_url : str, optional
+            URL of the channel that is used for the URLs of the packages. The
+            default is None (the base_url from the repodata.json file or the
+            path to the channel directory).
+
+        '''
+
+        paths = {subdir:os.path.abspath(os.path.join(channel_dir,subdir,'repodata.json')) for subdir in subdirs}
+        paths = {subdir:path for subdir,path in paths.items() if os.path.isfile(path)}
+
+        if not paths:
+            raise ValueError(f"{channel_dir} does not contain a repodata.json file for any of these subdirs: "
+                             f"{', '.join(subdirs)}")
+
+        for subdir,path in paths.items():
+            self.source_ids.append(self._import(path,channel,subdir,base_url))
+
+    def _import(self,path,channel,subdir,base_url):
+        '''Import a repodata.json file unless it is already up to date. Returns its id'''
+
+        stat = os.stat(path)
+        row = self.connection.execute('SELECT id, channel, base_url, size, mtime_ns, sha256 FROM sources WHERE path = ?',
+                                      (path,)).fetchone()
+
+        if row is not None and row[1:3] == (channel,base_url):
+            if row[3:5] == (stat.st_size,stat.st_mtime_ns):
+                return row[0]
+
+            # the file was touched, check if its content has changed
+            sha256 = hash_file(path)
+            if sha256 == row[5]:
+                self.connection.execute('UPDATE sources SET size = ?, mtime_ns = ? WHERE id = ?',
+                                        (stat.st_size,stat.st_mtime_ns,row[0]))
+                self.connection.commit()
+                return row[0]
+        else:
+            sha256 = hash_file(path)
+
+        with open(path,'rb') as f:
+            repodata = json.load(f)
+
+        info = repodata.get('info') or {}
+        url = (base_url or info.get('base_url') or channel_dir_url(os.path.dirname(os.path.dirname(path)))).rstrip('/')
+        if not url.endswith('/' + subdir):
+            url = f"{url}/{subdir}"
+
+        with self.connection:
+            if row is not None:
+                self.connection.execute('DELETE FROM packages WHERE source_id = ?',(row[0],))
+                self.connection.execute('DELETE FROM sources WHERE id = ?',(row[0],))
+
+            source_id = self.connection.execute('INSERT INTO sources (path, channel, subdir, base_url, size, mtime_ns, sha256) '
+                                                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                                (path,channel,subdir,base_url,stat.st_size,stat.st_mtime_ns,sha256)).lastrowid
+
+            self.connection.executemany('INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        _iter_packages(repodata,source_id,url))
+
+        return source_id
+
+    def get_records(self,name):
+        '''Returns all package records of a package in the channels that were added'''
+
+        if not self.source_ids:
+            return []
+
+        placeholders = ','.join('?' * len(self.source_ids))
+        rows = self.connection.execute('SELECT p.name, p.version, p.build, p.build_number, p.timestamp, p.depends, '
+                                       'p.constrains, p.track_features, p.url, p.md5, s.channel, s.subdir '
+                                       'FROM packages p JOIN sources s ON p.source_id = s.id '
+                                       f"WHERE p.name = ? AND p.source_id IN ({placeholders})",
+                                       [name,*self.source_ids])
+
+        return [PackageRecord(name,version,build,build_number,timestamp,
+                              tuple(depends.split('\n')) if depends else (),
+                              tuple(constrains.split('\n')) if constrains else (),
+                              track_features,url,md5,channel,subdir)
+                for name,version,build,build_number,timestamp,depends,constrains,track_features,url,md5,channel,subdir
+                in rows]
+
+def channel_dir_url(channel_dir):
+    '''file:// URL of a local channel directory'''
+
+    return 'file://' + os.path.abspath(channel_dir).replace(os.sep,'/')
+
+def _iter_packages(repodata,source_id,url):
+    '''Yields the rows of the packages table for a repodata.json file. If a
+    package is available as .conda and as .tar.bz2 file, only the .conda file
+    is used (like conda does)'''
+
+    conda_packages = repodata.get('packages.conda') or {}
+    stems = {fn[:-len('.conda')] for fn in conda_packages}
+
+    packages = [(fn,record) for fn,record in (repodata.get('packages') or {}).items()
+                if fn[:-len('.tar.bz2')] not in stems]
+    packages += conda_packages.items()
+
+    for fn,record in packages:
+        yield (source_id,
+               record['name'],
+               record['version'],
+               record.get('build',''),
+               record.get('build_number',0),
+               record.get('timestamp',0),
+               '\n'.join(record.get('depends') or []),
+               '\n'.join(record.get('constrains') or []),
+               record.get('track_features') or '',
+               f"{url}/{fn}",
+               record.get('md5',''))
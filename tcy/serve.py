@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+Serve environment files over HTTP from a single packages.tsv file
+
+Notes:
+
+- The server is built on asyncio (standard library only) and listens on
+  127.0.0.1 by default. It understands GET and HEAD requests and keeps
+  connections alive.
+- Paths: /environment.yml, /requirements.txt, /install_cran_packages.sh
+  and /spec.json (the EnvironmentSpec as JSON). The arguments of run() are
+  passed as query parameters: operating_system (or os), languages (repeated
+  or separated by comma), yml_name, write_conda_channels,
+  pip_requirements_file, cran_mirror and the cran_* options of the parallel
+  CRAN installation script. Booleans are 'true' or 'false'.
+- The .tsv file is validated once and kept in memory as a tcy.catalog.Catalog.
+  Before every request, the modification time and size of the file are
+  checked. If the content (sha256) has changed, the file is validated and
+  loaded again. Until a changed file passes validation, the last valid
+  catalog is served.
+- Rendered responses are kept in a bounded LRU cache. The key is the sha256
+  of the .tsv file, the path and the (normalized) parameters that the file
+  depends on, so e.g. requirements.txt is shared by all values of yml_name.
+- Every response has an ETag (a hash of its content). Requests with a
+  matching If-None-Match header are answered with 304 Not Modified.
+
+Usage:
+
+    tcy serve --tsv_path ./environments/packages.tsv --port 8000
+    curl 'http://127.0.0.1:8000/environment.yml?os=linux&languages=python&yml_name=ubuntu'
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from .catalog import Catalog
+from .manifest import hash_file
+from .tcy import build, get_cran_options
+from .validation import validate, TsvValidationError, OPERATING_SYSTEMS
+
+# path: (content type, parameters that the content depends on)
+ROUTES = {'/environment.yml':('text/yaml; charset=utf-8',
+                              ('operating_system','languages','yml_name','write_conda_channels','pip_requirements_file')),
+          '/requirements.txt':('text/plain; charset=utf-8',('operating_system','languages')),
+          '/install_cran_packages.sh':('text/x-shellscript; charset=utf-8',
+                                      ('operating_system','languages','yml_name','cran_mirror','cran_parallel',
+                                       'cran_ncpus','cran_dependency_levels','cran_local_repo')),
+          '/spec.json':('application/json',('operating_system','languages','yml_name'))}
+
+REASONS = {200:'OK',304:'Not Modified',400:'Bad Request',404:'Not Found',
+           405:'Method Not Allowed',500:'Internal Server Error',503:'Service Unavailable'}
+
+# longest request head that is accepted
+MAX_HEAD_SIZE = 16384
+
+class RequestError(ValueError):
+    '''An invalid request (answered with the given status code)'''
+
+    def __init__(self,status,message):
+        self.status = status
+        super().__init__(message)
+
+def _parse_bool(name,values):
+    value = values[-1].lower()
+    if value in ('true','1','yes'):
+        return True
+    if value in ('false','0','no',''):
+        return False
+    raise RequestError(400,f"{name} must be 'true' or 'false' but got {values[-1]!r}")
+
+def parse_options(path,query):
+    '''Returns the normalized parameters of a request that the content of
+    path depends on (as a tuple of (name,value) pairs that can be used as
+    cache key)
+
+    Raises
+    ------
+    RequestError
+        If a parameter is unknown, missing or invalid.
+
+    '''
+
+    params = parse_qs(query,keep_blank_values=True)
+    if 'os' in params:
+        params.setdefault('operating_system',[]).extend(params.pop('os'))
+
+    allowed = ROUTES[path][1]
+    known = ('operating_system','languages','yml_name','write_conda_channels','pip_requirements_file','cran_mirror',
+             'cran_parallel','cran_ncpus','cran_dependency_levels','cran_local_repo')
+    unknown = sorted(set(params) - set(known))
+    if unknown:
+        raise RequestError(400,f"Unknown parameters: {', '.join(unknown)}")
+
+    operating_system = params.get('operating_system',[None])[-1]
+    if operating_system not in OPERATING_SYSTEMS:
+        raise RequestError(400,f"operating_system must be one of {', '.join(OPERATING_SYSTEMS)}")
+
+    languages = [language for value in params.get('languages',['all']) for language in value.split(',') if language]
+    languages = 'all' if not languages or 'all' in languages else tuple(sorted(set(languages)))
+
+    options = {'operating_system':operating_system,
+               'languages':languages,
+               'yml_name':params.get('yml_name',[None])[-1] or None,
+               'write_conda_channels':_parse_bool('write_conda_channels',params.get('write_conda_channels',['false'])),
+               'pip_requirements_file':_parse_bool('pip_requirements_file',params.get('pip_requirements_file',['false'])),
+               'cran_mirror':params.get('cran_mirror',['https://cloud.r-project.org'])[-1]}
+
+    try:
+        options.update(get_cran_options(_parse_bool('cran_parallel',params.get('cran_parallel',['false'])),
+                                        params.get('cran_ncpus',[None])[-1] or None,
+                                        _parse_bool('cran_dependency_levels',params.get('cran_dependency_levels',['false'])),
+                                        params.get('cran_local_repo',[None])[-1]))
+    except ValueError as e:
+        raise RequestError(400,str(e))
+
+    return tuple((name,options[name]) for name in allowed)
+
+class EnvironmentService:
+    '''Renders environment files from an in-memory catalog of a .tsv file
+
+    Parameters
+    ----------
+    tsv_path : str
+        Path to the packages.tsv file.
+    cache_size : int, optional
+        Maximum number of rendered responses that are kept. The default is 256.
+    log : callable, optional
+        Called with a message for every request and reload. The default is print.
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file does not pass validation when the service is created.
+
+    '''
+
+    def __init__(self,tsv_path,cache_size=256,log=print):
+        self.tsv_path = tsv_path
+        self.cache_size = cache_size
+        self.log = log
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # (catalog,sha256) of the .tsv file. Replaced as a whole, because load()
+        # runs in an executor while render() reads it on the event loop
+        self.state = (None,None)
+        self.signature = None
+        self.reload_lock = asyncio.Lock()
+        self.load()
+
+    @property
+    def catalog(self):
+        return self.state[0]
+
+    @property
+    def catalog_sha256(self):
+        return self.state[1]
+
+    def _get_signature(self):
+        stat = os.stat(self.tsv_path)
+        return stat.st_mtime_ns,stat.st_size,stat.st_ino
+
+    def load(self):
+        '''Validate the .tsv file and replace the catalog (if its content has changed)'''
+
+        signature = self._get_signature()
+        sha256 = hash_file(self.tsv_path)
+
+        if sha256 != self.catalog_sha256:
+            report = validate(self.tsv_path)
+            if not report.ok:
+                raise TsvValidationError(report)
+            catalog = Catalog(report.table)
+            self.state = (catalog,sha256)
+            self.log(f"Loaded {self.tsv_path} ({len(catalog)} rows, sha256 {sha256[:12]})")
+
+        self.signature = signature
+
+    async def reload_if_changed(self):
+        '''Load the .tsv file again if it has changed. Keeps the last valid
+        catalog if the changed file does not pass validation'''
+
+        try:
+            if self._get_signature() == self.signature:
+                return
+        except OSError:
+            return
+
+        async with self.reload_lock:
+            try:
+                if self._get_signature() == self.signature:
+                    return
+                await asyncio.get_running_loop().run_in_executor(None,self.load)
+            except (OSError,ValueError) as e:
+                # do not try again until the file changes
+                try:
+                    self.signature = self._get_signature()
+                except OSError:
+                    pass
+                self.log(f"Keeping the last valid catalog: {e}")
+
+    def render(self,path,options,state=None):
+        '''Returns (body,etag) of a path for normalized options (see
+        parse_options). state is the (catalog,sha256) to render from (the
+        current one if None)'''
+
+        # the body is rendered from the same catalog whose hash is part of the key
+        catalog,sha256 = self.state if state is None else state
+        key = (sha256,path,options)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        o = dict(options)
+        spec = build(o['operating_system'],yml_name=o.get('yml_name'),languages=o['languages'],catalog=catalog)
+
+        if path == '/environment.yml':
+            body = spec.to_yml(o['write_conda_channels'],o['pip_requirements_file'])
+        elif path == '/requirements.txt':
+            body = spec.to_requirements()
+        elif path == '/install_cran_packages.sh':
+            try:
+                body = spec.to_cran_script(o['cran_mirror'],o['cran_parallel'],o['cran_ncpus'],
+                                           o['cran_dependency_levels'],o['cran_local_repo'])
+            except TypeError as e:
+                raise RequestError(400,str(e))
+        else:
+            body = json.dumps(spec.to_dict(),indent=2) + '\n'
+
+        body = body.encode('utf-8')
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+        self.cache[key] = (body,etag)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return body,etag
+
+    async def respond(self,method,target,headers):
+        '''Returns (status,headers,body) for a request'''
+
+        if method not in ('GET','HEAD'):
+            return 405,{'Allow':'GET, HEAD'},b''
+
+        url = urlsplit(target)
+        if url.path not in ROUTES:
+            raise RequestError(404,f"Unknown path {url.path}. Valid paths are: {', '.join(ROUTES)}")
+
+        options = parse_options(url.path,url.query)
+
+        await self.reload_if_changed()
+        state = self.state
+        body,etag = self.render(url.path,options,state)
+
+        response_headers = {'Content-Type':ROUTES[url.path][0],
+                            'ETag':etag,
+                            'Cache-Control':'no-cache',
+                            'X-Tcy-Catalog-Sha256':state[1]}
+
+        if _matches(headers.get('if-none-match'),etag):
+            return 304,response_headers,b''
+
+        return 200,response_headers,body
+
+    async def handle(self,reader,writer):
+        '''Answer all requests of a connection'''
+
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError,asyncio.LimitOverrunError,ConnectionError):
+                    return
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method,target,version = lines[0].split(' ')
+                except ValueError:
+                    await self._send(writer,'HEAD',400,{},b'Malformed request line\n',False)
+                    return
+
+                headers = {}
+                for line in lines[1:]:
+                    name,separator,value = line.partition(':')
+                    if separator:
+                        headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (headers.get('connection','').lower() != 'close'
+                              and (version == 'HTTP/1.1' or headers.get('connection','').lower() == 'keep-alive'))
+
+                try:
+                    status,response_headers,body = await self.respond(method,target,headers)
+                except RequestError as e:
+                    status,response_headers,body = e.status,{'Content-Type':'text/plain; charset=utf-8'},f"{e}\n".encode()
+                except Exception as e:
+                    status,response_headers,body = 500,{'Content-Type':'text/plain; charset=utf-8'},f"{e}\n".encode()
+
+                self.log(f"{method} {target} {status}")
+                await self._send(writer,method,status,response_headers,body,keep_alive)
+
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def _send(self,writer,method,status,headers,body,keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status,'')}",
+                 *(f"{name}: {value}" for name,value in headers.items()),
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if method != 'HEAD' and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+def _matches(if_none_match,etag):
+    '''True if an If-None-Match header matches an ETag (weak comparison)'''
+
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+async def start_server(tsv_path,host='127.0.0.1',port=8000,cache_size=256,log=print):
+    '''Create the service and start listening. Returns (service,server), the
+    server is an asyncio.Server (port 0 picks a free port, see
+    server.sockets[0].getsockname())'''
+
+    service = EnvironmentService(tsv_path,cache_size,log)
+    server = await asyncio.start_server(service.handle,host,port,limit=MAX_HEAD_SIZE)
+    return service,server
+
+async def serve(tsv_path,host='127.0.0.1',port=8000,cache_size=256,log=print):
+    '''Serve environment files until the task is cancelled'''
+
+    service,server = await start_server(tsv_path,host,port,cache_size,log)
+    host,port = server.sockets[0].getsockname()[:2]
+    log(f"Serving {tsv_path} on http://{host}:{port}")
+
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy serve',
+                                     description='Serve environment files over HTTP from a single packages.tsv file')
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--host',type=str,required=False,default='127.0.0.1',
+                        help='Address to listen on. The default is 127.0.0.1 (only this machine).')
+    parser.add_argument('--port',type=int,required=False,default=8000,
+                        help='Port to listen on. The default is 8000')
+    parser.add_argument('--cache_size',type=int,required=False,default=256,
+                        help='Maximum number of rendered responses that are kept in memory. \
+                        The default is 256')
+
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.tsv_path,args.host,args.port,args.cache_size))
+    except (TsvValidationError,OSError) as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        pass
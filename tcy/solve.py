@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Solve the conda packages of packages.tsv offline against local repodata.json
+files and write an explicit spec file (like the *_solved.txt files that are
+created with micromamba)
+
+Notes:
+
+- The conda packages are selected like run() selects them. Their version
+  column is used as match spec (e.g. numpy>=1.21). If there are pip
+  packages, pip is added (like in the .yml file).
+- The repodata.json files of all channels are loaded into an on-disk index
+  (see tcy.repodata), so only the first solve has to read them.
+- Channels are used with strict priority in the order in which they appear in
+  the 'channels:' section of the .yml file: a package is always taken from
+  the first channel that has it.
+- The solver is a depth-first search. It always continues with the package
+  that has the fewest matching candidates and tries the newest version (then
+  the highest build number and the newest build) first. When a package has no
+  candidate left, it jumps back to the latest package that contributed to the
+  conflict (conflict-directed backjumping). The result is a valid set of
+  packages, but where several solutions exist it can differ from the one
+  conda or micromamba would pick.
+
+Usage:
+
+    tcy solve linux --channel conda-forge=/mirror/conda-forge --output environment_solved.txt
+
+@author: Johannes.Wiesner
+"""
+
+import sys
+import heapq
+
+from .matchspec import parse_match_spec, parse_version
+from .render import write_atomic
+from .repodata import RepodataIndex, PackageRecord
+from .tcy import select_packages, get_conda_channels, normalize_languages
+from .validation import validate, TsvValidationError
+
+# conda subdir of each operating system
+SUBDIRS = {'linux':'linux-64','windows':'win-64'}
+
+# virtual packages that are assumed to be present on a machine of each subdir
+DEFAULT_VIRTUAL_PACKAGES = {'linux-64':{'__unix':'0','__linux':'5.15','__glibc':'2.35','__archspec':'1'},
+                            'win-64':{'__win':'0','__archspec':'1'}}
+
+# give up after this many dead ends
+MAX_BACKTRACKS = 100_000
+
+class SolveError(ValueError):
+    '''Raised when the packages cannot be solved with the given channels'''
+
+class Solver:
+    '''Find a set of packages that satisfies a list of match specs
+
+    Parameters
+    ----------
+    index : tcy.repodata.RepodataIndex
+        Index of all channels.
+    channels : list of str
+        Channels in the order of their priority.
+    virtual_packages : dict, optional
+        Maps the names of virtual packages (e.g. '__glibc') to their
+        versions. The default is None (no virtual packages).
+    max_backtracks : int, optional
+        Give up after this many dead ends. The default is MAX_BACKTRACKS.
+
+    '''
+
+    def __init__(self,index,channels,virtual_packages=None,max_backtracks=MAX_BACKTRACKS):
+        self.index = index
+        self.channels = list(channels)
+        self.max_backtracks = max_backtracks
+        self.virtual_packages = {name:(PackageRecord(name,version,'0',0,0,(),(),'',None,'','@','@'),parse_version(version))
+                                 for name,version in (virtual_packages or {}).items()}
+
+        self._records = {}
+        self._candidates = {}
+
+        # how often each package had no candidates left (used for error messages)
+        self.conflicts = {}
+
+    def get_records(self,name):
+        '''Returns all (record,version) pairs of a package, grouped by channel
+        in the order of priority and sorted from best to worst inside each channel'''
+
+        if name not in self._records:
+            records = []
+            for record in self.index.get_records(name):
+                try:
+                    records.append((record,parse_version(record.version)))
+                except ValueError:
+                    continue
+
+            # sort by the least important key first (Python's sort is stable)
+            records.sort(key=lambda pair: pair[0].timestamp or 0,reverse=True)
+            records.sort(key=lambda pair: pair[0].build_number or 0,reverse=True)
+            records.sort(key=lambda pair: pair[1],reverse=True)
+            records.sort(key=lambda pair: len(pair[0].track_features.split()))
+
+            priority = {channel:i for i,channel in enumerate(self.channels)}
+            records = [pair for pair in records if pair[0].channel in priority]
+            records.sort(key=lambda pair: priority[pair[0].channel])
+
+            self._records[name] = records
+
+        return self._records[name]
+
+    def get_candidates(self,name,specs):
+        '''Returns all (record,version) pairs of a package that match all specs'''
+
+        key = (name,specs)
+
+        if key not in self._candidates:
+            records = self.get_records(name)
+
+            # strict channel priority: only use the first channel that has the
+            # package (unless a spec asks for a certain channel)
+            channel = next((spec.channel for spec in specs if spec.channel),None)
+            if channel is None and records:
+                channel = records[0][0].channel
+
+            self._candidates[key] = [(record,version) for record,version in records
+                                     if record.channel == channel
+                                     and all(spec.match(name,version,record.build) for spec in specs)]
+
+        return self._candidates[key]
+
+    def solve(self,specs):
+        '''Returns a dictionary that maps package names to the PackageRecord
+        that was chosen for each package
+
+        Raises
+        ------
+        SolveError
+            If there is no solution (or none was found after max_backtracks
+            dead ends).
+
+        '''
+
+        specs = [parse_match_spec(spec) if isinstance(spec,str) else spec for spec in specs]
+
+        for spec in specs:
+            if not spec.name.startswith('__') and not self.get_records(spec.name):
+                raise SolveError(f"{spec.name} was not found in any of these channels: {', '.join(self.channels)}")
+
+        # virtual packages and the specs of the user are not assigned in a frame (depth -1)
+        state = _State({name:(record,version,-1) for name,(record,version) in self.virtual_packages.items()},{},{},{})
+        for spec in specs:
+            state = state.require(spec,-1)
+
+        # depth-first search with conflict-directed backjumping. Every frame
+        # holds a state, the package that is assigned in this frame, the
+        # iterator over its candidates and the frames that caused conflicts
+        frames = []
+        backtracks = 0
+
+        while True:
+            name = self.next_package(state)
+            if name is None:
+                return self._result(state)
+
+            frames.append(_Frame(state,name,iter(self.get_candidates(name,state.specs(name)))))
+
+            while True:
+                frame = frames[-1]
+                record = self._next_candidate(frame)
+
+                if record is not None:
+                    state = frame.state.assign(*record,len(frames) - 1)
+                    break
+
+                # all candidates failed: jump back to the latest frame that
+                # contributed to the conflict (the frames in between cannot help)
+                self.conflicts[frame.name] = self.conflicts.get(frame.name,0) + 1
+                backtracks += 1
+                culprits = frame.conflicts | frame.state.providers.get(frame.name,frozenset())
+                culprits.discard(-1)
+
+                if not culprits or backtracks > self.max_backtracks:
+                    raise self._error(specs,exhausted=bool(culprits))
+
+                depth = max(culprits)
+                del frames[depth + 1:]
+                frames[depth].conflicts |= culprits - {depth}
+
+    def _next_candidate(self,frame):
+        '''Returns (record,version) of the next candidate that is compatible
+        with the assigned packages. Frames of conflicting packages are added
+        to frame.conflicts'''
+
+        assigned = frame.state.assigned
+
+        for record,version in frame.candidates:
+            conflict = self.find_conflict(assigned,record)
+            if conflict is None:
+                return record,version
+            frame.conflicts.add(assigned[conflict][2])
+
+        return None
+
+    def find_conflict(self,assigned,record):
+        '''Returns the name of an assigned package that violates a dependency
+        or constraint of record (None if there is no conflict)'''
+
+        for spec in record.depends + record.constrains:
+            spec = parse_match_spec(spec)
+            if spec.name in assigned:
+                other,version,_ = assigned[spec.name]
+                if not spec.match(other.name,version,other.build):
+                    return spec.name
+
+        return None
+
+    def next_package(self,state):
+        '''Returns the unassigned package with the fewest candidates (None if
+        all required packages have been assigned)'''
+
+        pending = [name for name in state.requirements if name not in state.assigned]
+        if not pending:
+            return None
+
+        return min(pending,key=lambda name: len(self.get_candidates(name,state.specs(name))))
+
+    def _result(self,state):
+        return {name:record for name,(record,_,_) in state.assigned.items() if name not in self.virtual_packages}
+
+    def _error(self,specs,exhausted):
+        conflicts = sorted(self.conflicts,key=lambda name: -self.conflicts[name])[:10]
+        reason = f"gave up after {self.max_backtracks} dead ends" if exhausted else 'there is no solution'
+        return SolveError(f"Could not solve {', '.join(str(spec) for spec in specs[:10])}"
+                          f"{', ...' if len(specs) > 10 else ''} ({reason}). "
+                          f"These packages could not be satisfied most often: {', '.join(conflicts)}")
+
+class _Frame:
+
+    __slots__ = ('state','name','candidates','conflicts')
+
+    def __init__(self,state,name,candidates):
+        self.state = state
+        self.name = name
+        self.candidates = candidates
+        self.conflicts = set()
+
+class _State:
+    '''Assigned packages (with the depth of the frame that assigned them), the
+    specs of all packages (and the depths of the frames that added them).
+    States are never modified, assign() and require() return new ones'''
+
+    __slots__ = ('assigned','requirements','constraints','providers')
+
+    def __init__(self,assigned,requirements,constraints,providers):
+        self.assigned = assigned
+        self.requirements = requirements
+        self.constraints = constraints
+        self.providers = providers
+
+    def specs(self,name):
+        return self.requirements.get(name,()) + self.constraints.get(name,())
+
+    def require(self,spec,depth):
+        return _State(self.assigned,
+                      {**self.requirements,spec.name:self.requirements.get(spec.name,()) + (spec,)},
+                      self.constraints,
+                      {**self.providers,spec.name:self.providers.get(spec.name,frozenset()) | {depth}})
+
+    def assign(self,record,version,depth):
+        requirements = dict(self.requirements)
+        constraints = dict(self.constraints)
+        providers = dict(self.providers)
+
+        # constraints only apply if the package is (or will be) installed
+        # anyway, so they filter candidates but do not add a package
+        for specs,target in ((record.depends,requirements),(record.constrains,constraints)):
+            for spec in specs:
+                spec = parse_match_spec(spec)
+                target[spec.name] = target.get(spec.name,()) + (spec,)
+                providers[spec.name] = providers.get(spec.name,frozenset()) | {depth}
+
+        return _State({**self.assigned,record.name:(record,version,depth)},requirements,constraints,providers)
+
+def sort_records(records):
+    '''Sort records so that every package comes after its dependencies (ties
+    and cycles are resolved alphabetically)'''
+
+    dependencies = {name:{parse_match_spec(spec).name for spec in record.depends} & records.keys() - {name}
+                    for name,record in records.items()}
+    dependents = {name:[] for name in records}
+    for name,names in dependencies.items():
+        for dependency in names:
+            dependents[dependency].append(name)
+
+    missing = {name:len(names) for name,names in dependencies.items()}
+    ready = [name for name,n in missing.items() if n == 0]
+    heapq.heapify(ready)
+    order = []
+
+    while len(order) < len(records):
+
+        # break a cycle with the alphabetically first remaining package
+        if not ready:
+            ready = [min(name for name,n in missing.items() if n > 0)]
+            missing[ready[0]] = 0
+
+        name = heapq.heappop(ready)
+        if missing.get(name) == -1:
+            continue
+        missing[name] = -1
+        order.append(records[name])
+
+        for dependent in dependents[name]:
+            if missing[dependent] > 0:
+                missing[dependent] -= 1
+                if missing[dependent] == 0:
+                    heapq.heappush(ready,dependent)
+
+    return order
+
+def render_explicit(records,subdir):
+    '''Returns the content of an explicit spec file (like conda list --explicit --md5)'''
+
+    lines = ['# This file may be used to create an environment using:\n',
+             '# $ conda create --name <env> --file <this file>\n',
+             f"# platform: {subdir}\n",
+             '@EXPLICIT\n']
+    lines += [f"{record.url}#{record.md5}\n" if record.md5 else f"{record.url}\n" for record in records]
+
+    return ''.join(lines)
+
+def get_specs(table,operating_system,languages='all'):
+    '''Returns the match specs of all conda packages (and pip, if there are
+    pip packages) and the channels in the order of the .yml file'''
+
+    table = select_packages(table,operating_system,normalize_languages(languages))
+
+    specs = [f"{name}{version or ''}" for name,version,manager in table.rows(['package_name','version','package_manager'])
+             if manager == 'conda']
+
+    if 'pip' in table['package_manager']:
+        specs.append('pip')
+
+    return specs,get_conda_channels(table) + ['defaults']
+
+def run_solve(operating_system,
+              channels,
+              tsv_path='./packages.tsv',
+              output_path='environment_solved.txt',
+              languages='all',
+              subdir=None,
+              index_path=None,
+              channel_alias=None,
+              virtual_packages=None):
+    '''Solves the conda packages of the .tsv file against local channels and
+    writes an explicit spec file
+
+    Parameters
+    ----------
+    operating_system : str
+        Can be 'linux' or 'windows' (see run()).
+    channels : dict
+        Maps channel names to local channel directories (which contain one
+        directory per subdir with a repodata.json file).
+    tsv_path : str, optional
+        Path to a valid packages.tsv file. The default is './packages.tsv'.
+    output_path : str, optional
+        Path of the explicit spec file. The default is 'environment_solved.txt'.
+    languages : str or list of str, optional
+        See run(). The default is 'all'.
+    subdir : str, optional
+        The conda subdir (e.g. 'linux-64'). If None, it is chosen based on
+        operating_system. The default is None.
+    index_path : str, optional
+        Path to the SQLite index of all repodata.json files. The default
+        is None (see tcy.repodata.get_default_index_path).
+    channel_alias : str, optional
+        If given, the URLs in the spec file point to <channel_alias>/<channel>
+        (e.g. 'https://conda.anaconda.org') instead of the local directories.
+        The default is None.
+    virtual_packages : dict, optional
+        Maps virtual packages to versions (e.g. {'__glibc':'2.35'}). The
+        default is None (DEFAULT_VIRTUAL_PACKAGES of the subdir).
+
+    Returns
+    -------
+    records : list of tcy.repodata.PackageRecord
+        All packages of the solution in the order of the spec file.
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json.
+    SolveError
+        If the packages cannot be solved with the given channels.
+
+    '''
+
+    report = validate(tsv_path)
+
+    if not report.ok:
+        raise TsvValidationError(report)
+
+    subdir = subdir or SUBDIRS[operating_system]
+    if virtual_packages is None:
+        virtual_packages = DEFAULT_VIRTUAL_PACKAGES.get(subdir,{})
+
+    specs,priority = get_specs(report.table,operating_system,languages)
+
+    # channels that are not used in the .tsv file have the lowest priority
+    priority = [channel for channel in priority if channel in channels]
+    priority += [channel for channel in channels if channel not in priority]
+
+    with RepodataIndex(index_path) as index:
+        for channel in priority:
+            base_url = f"{channel_alias.rstrip('/')}/{channel}" if channel_alias else None
+            index.add_channel(channel,channels[channel],[subdir,'noarch'],base_url)
+
+        solution = Solver(index,priority,virtual_packages).solve(specs)
+
+    records = sort_records(solution)
+    write_atomic(output_path,render_explicit(records,subdir))
+
+    return records
+
+def parse_pairs(pairs,what):
+    '''Parse a list of 'key=value' strings into a dictionary'''
+
+    result = {}
+    for pair in pairs or []:
+        key,separator,value = pair.partition('=')
+        if not separator or not key or not value:
+            raise ValueError(f"{what} must be given as NAME=VALUE but got {pair!r}")
+        result[key] = value
+    return result
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy solve',
+                                     description='Solve the conda packages of packages.tsv offline against local channels \
+                                     and write an explicit spec file')
+    parser.add_argument('os',type=str,choices=list(SUBDIRS),
+                        help="Operating system (see 'tcy --help').")
+    parser.add_argument('--channel',type=str,action='append',required=True,metavar='NAME=DIR',
+                        help='A local channel: its name and the directory that contains one \
+                        directory per subdir (e.g. linux-64/repodata.json). Can be given several times.')
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--output',type=str,required=False,default='environment_solved.txt',
+                        help='Path of the explicit spec file. The default is environment_solved.txt')
+    parser.add_argument('--languages',type=str,required=False,default='all',nargs='+',
+                        help="Filter for certain programming languages. Valid inputs \
+                        are python, julia, r or all.")
+    parser.add_argument('--subdir',type=str,required=False,default=None,
+                        help="conda subdir (e.g. linux-64). By default linux-64 for linux and win-64 for windows.")
+    parser.add_argument('--index_path',type=str,required=False,default=None,
+                        help='Path to the on-disk index of the repodata.json files. \
+                        The default is ~/.cache/tcy/repodata.sqlite')
+    parser.add_argument('--channel_alias',type=str,required=False,default=None,
+                        help='Write URLs that point to <channel_alias>/<channel> (e.g. \
+                        https://conda.anaconda.org) instead of the local channel directories.')
+    parser.add_argument('--virtual_package',type=str,action='append',required=False,metavar='NAME=VERSION',
+                        help='A virtual package of the target machine (e.g. __glibc=2.35). \
+                        Replaces the defaults of the subdir. Can be given several times.')
+
+    args = parser.parse_args(argv)
+
+    try:
+        virtual_packages = parse_pairs(args.virtual_package,'Virtual packages') if args.virtual_package else None
+        records = run_solve(args.os,
+                            parse_pairs(args.channel,'Channels'),
+                            tsv_path=args.tsv_path,
+                            output_path=args.output,
+                            languages=args.languages,
+                            subdir=args.subdir,
+                            index_path=args.index_path,
+                            channel_alias=args.channel_alias,
+                            virtual_packages=virtual_packages)
+        print(f"Solved {len(records)} packages: {args.output}")
+    except (TsvValidationError,SolveError,ValueError) as e:
+        sys.exit(str(e))
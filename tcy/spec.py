@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+A structured, in-memory description of an environment (the result of
+tcy.build) and its renderers
+
+Notes:
+
+- An EnvironmentSpec holds everything that ends up in the environment files:
+  the channels (from most to least frequently used), the conda packages
+  (name, version and channel), the pip packages and the CRAN packages.
+- Every file can be rendered to a string (to_yml, to_requirements,
+  to_cran_script) or written to any writable stream (write_yml,
+  write_requirements, write_cran_script). Binary streams (e.g. io.BytesIO
+  or files opened with 'wb') receive UTF-8 encoded bytes, all other streams
+  receive strings. Nothing is written to disk unless the stream is a file.
+- The renderers are the same that run() uses, so the content is identical
+  to the files that run() writes.
+
+Usage:
+
+    import io
+    from tcy import build
+
+    spec = build('linux',tsv_path='./packages.tsv')
+    spec.to_yml()
+    spec.write_yml(io.BytesIO())
+
+@author: Johannes.Wiesner
+"""
+
+import io
+
+from .render import iter_yml, iter_requirements, render_cran_installation_script
+
+class EnvironmentSpec:
+    '''The packages and channels of an environment
+
+    Parameters
+    ----------
+    name : str or None
+        The "name:" attribute of the .yml file (see run()).
+    channels : list of str
+        Channels from most to least frequently used.
+    conda_packages : list of tuples
+        (package_name,version,conda_channel) of every conda package in the
+        order of the .yml file. Empty cells are None.
+    pip_packages : list of str
+        Names of all pip packages.
+    cran_packages : list of str
+        Names of all CRAN packages.
+    has_cran : bool, optional
+        True if the selection contains packages that are installed with
+        CRAN (the installation script is only written in this case). The
+        default is bool(cran_packages).
+
+    '''
+
+    __slots__ = ('name','channels','conda_packages','pip_packages','cran_packages','has_cran')
+
+    def __init__(self,name,channels,conda_packages,pip_packages,cran_packages,has_cran=None):
+        self.name = name
+        self.channels = channels
+        self.conda_packages = conda_packages
+        self.pip_packages = pip_packages
+        self.cran_packages = cran_packages
+        self.has_cran = bool(cran_packages) if has_cran is None else has_cran
+
+    @property
+    def has_pip(self):
+        '''True if the .yml file needs a 'pip:' section'''
+
+        return bool(self.pip_packages)
+
+    def iter_yml(self,write_conda_channels=False,pip_requirements_file=False):
+        '''Yields the content of the environment.yml file in pieces (see run()
+        for the arguments)'''
+
+        return iter_yml(self.channels,self.conda_packages,self.pip_packages,self.has_pip,self.name,
+                        write_conda_channels,pip_requirements_file)
+
+    def to_yml(self,write_conda_channels=False,pip_requirements_file=False):
+        '''Returns the content of the environment.yml file'''
+
+        return ''.join(self.iter_yml(write_conda_channels,pip_requirements_file))
+
+    def write_yml(self,stream,write_conda_channels=False,pip_requirements_file=False):
+        '''Writes the content of the environment.yml file to a stream'''
+
+        _write(stream,self.iter_yml(write_conda_channels,pip_requirements_file))
+
+    def to_requirements(self):
+        '''Returns the content of the requirements.txt file'''
+
+        return ''.join(iter_requirements(self.pip_packages))
+
+    def write_requirements(self,stream):
+        '''Writes the content of the requirements.txt file to a stream'''
+
+        _write(stream,iter_requirements(self.pip_packages))
+
+    def to_cran_script(self,cran_mirror='https://cloud.r-project.org',parallel=False,ncpus=None,
+                       dependency_levels=False,local_repo=None):
+        '''Returns the bash script that installs the CRAN packages inside the
+        environment (see run() for the arguments). Raises TypeError if the
+        spec has no name'''
+
+        if not self.name:
+            raise TypeError('When creating installation scripts for CRAN-packages you must specify a yml_name')
+
+        return render_cran_installation_script(self.name,self.cran_packages,cran_mirror,parallel,
+                                               ncpus,dependency_levels,local_repo)
+
+    def write_cran_script(self,stream,cran_mirror='https://cloud.r-project.org',parallel=False,ncpus=None,
+                          dependency_levels=False,local_repo=None):
+        '''Writes the CRAN installation script to a stream'''
+
+        _write(stream,[self.to_cran_script(cran_mirror,parallel,ncpus,dependency_levels,local_repo)])
+
+    def to_dict(self):
+        '''Returns the spec as a JSON serializable dictionary'''
+
+        return {'name':self.name,
+                'channels':list(self.channels),
+                'conda_packages':[{'package_name':n,'version':v,'conda_channel':c} for n,v,c in self.conda_packages],
+                'pip_packages':list(self.pip_packages),
+                'cran_packages':list(self.cran_packages)}
+
+    def __eq__(self,other):
+        return isinstance(other,EnvironmentSpec) and all(getattr(self,a) == getattr(other,a) for a in self.__slots__)
+
+    def __repr__(self):
+        return (f"EnvironmentSpec(name={self.name!r}, channels={self.channels!r}, "
+                f"conda_packages={len(self.conda_packages)}, pip_packages={len(self.pip_packages)}, "
+                f"cran_packages={len(self.cran_packages)})")
+
+def _is_binary(stream):
+    '''True if a stream expects bytes'''
+
+    mode = getattr(stream,'mode','')
+    return isinstance(stream,(io.RawIOBase,io.BufferedIOBase)) or (isinstance(mode,str) and 'b' in mode)
+
+def _write(stream,pieces):
+    '''Write pieces of text to a text or binary stream'''
+
+    if _is_binary(stream):
+        stream.write(''.join(pieces).encode('utf-8'))
+    else:
+        for piece in pieces:
+            stream.write(piece)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Create environment files from very large .tsv files with (almost) constant memory
+
+Notes:
+
+- The .tsv file is read row by row. Every row is validated on the fly
+  (see tcy.validation.StreamingValidator) and only the cells of selected
+  packages that are needed for the output files are kept.
+- Selected packages are sorted with an external merge sort: packages are
+  collected in a buffer of at most buffer_rows rows. Full buffers are sorted
+  and spilled to temporary files which are merged lazily when the files
+  are written. Peak memory therefore depends on buffer_rows, not on the size
+  of the .tsv file.
+- The written files are identical to the ones of the 'csv' and 'pandas' engines.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import heapq
+import pickle
+import tempfile
+
+from .profiling import NULL_PROFILER, get_size
+from .render import iter_yml, iter_requirements, atomic_open
+from .table import iter_tsv
+from .validation import StreamingValidator, TsvValidationError, FILE_RULES, ValidationReport
+from .tcy import (get_output_paths, normalize_languages, is_selected, sort_key,
+                  sort_channels, write_cran_installation_script)
+
+# default number of rows that are sorted in memory before they are spilled to disk
+DEFAULT_BUFFER_ROWS = 100_000
+
+# maximal number of records that are pickled together in a run file
+CHUNK_ROWS = 1_000
+
+# maximal number of run files that are merged at once
+MAX_FANOUT = 64
+
+class ExternalSorter:
+    '''Sort (key,record) pairs that do not fit into memory
+
+    Parameters
+    ----------
+    buffer_rows : int, optional
+        Maximal number of pairs that are kept in memory. The default is
+        DEFAULT_BUFFER_ROWS.
+    tmp_dir : str, optional
+        Directory for the temporary run files. The default is None (the
+        default directory of the tempfile module).
+
+    '''
+
+    def __init__(self,buffer_rows=DEFAULT_BUFFER_ROWS,tmp_dir=None):
+        self.buffer_rows = buffer_rows
+        self.tmp_dir = tmp_dir
+        # a merge keeps one chunk of every run file in memory, so that at most
+        # buffer_rows pairs are held in memory while runs are merged as well
+        self.chunk_rows = max(1,min(CHUNK_ROWS,buffer_rows // MAX_FANOUT))
+        self.buffer = []
+        self.runs = []
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def add(self,key,record):
+        self.buffer.append((key,record))
+        self.n_rows += 1
+        if len(self.buffer) >= self.buffer_rows:
+            self._spill(sorted(self.buffer,key=_get_key))
+            self.buffer = []
+
+    def _spill(self,pairs):
+        '''Write sorted pairs to a new run file'''
+
+        f = tempfile.TemporaryFile(dir=self.tmp_dir)
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) == self.chunk_rows:
+                pickle.dump(chunk,f,protocol=pickle.HIGHEST_PROTOCOL)
+                chunk = []
+        if chunk:
+            pickle.dump(chunk,f,protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(f)
+
+    def __iter__(self):
+        '''Yields all records in the order of their keys (records with equal
+        keys in the order in which they were added)'''
+
+        # merge in several passes if there are too many run files. Every pass
+        # merges groups of consecutive runs and heapq.merge prefers earlier
+        # inputs for equal keys, so the newest pairs (the buffer) come last
+        while len(self.runs) > MAX_FANOUT:
+            runs,self.runs = self.runs,[]
+            for i in range(0,len(runs),MAX_FANOUT):
+                group = runs[i:i + MAX_FANOUT]
+                if len(group) == 1:
+                    self.runs.extend(group)
+                    continue
+                self._spill(heapq.merge(*(_read_run(f) for f in group),key=_get_key))
+                for f in group:
+                    f.close()
+
+        self.buffer.sort(key=_get_key)
+        for _,record in heapq.merge(*(_read_run(f) for f in self.runs),self.buffer,key=_get_key):
+            yield record
+
+    def close(self):
+        for f in self.runs:
+            f.close()
+        self.runs = []
+        self.buffer = []
+
+def _get_key(pair):
+    return pair[0]
+
+def _read_run(f):
+    '''Yields the pairs of a run file chunk by chunk'''
+
+    f.seek(0)
+    while True:
+        try:
+            chunk = pickle.load(f)
+        except EOFError:
+            return
+        yield from chunk
+
+def write_environment_files(tsv_path,
+                            operating_system,
+                            yml_name=None,
+                            yml_file_name='environment.yml',
+                            pip_requirements_file=False,
+                            write_conda_channels=False,
+                            yml_dir=None,
+                            cran_installation_script=False,
+                            cran_mirror='https://cloud.r-project.org',
+                            languages='all',
+                            cran_parallel=False,
+                            cran_ncpus=None,
+                            cran_dependency_levels=False,
+                            cran_local_repo=None,
+                            test_configs=None,
+                            buffer_rows=DEFAULT_BUFFER_ROWS,
+                            tmp_dir=None,
+                            profiler=NULL_PROFILER):
+    '''Validates the .tsv file and creates the environment files in a single
+    pass over the file. Takes the same arguments as run() (without engine and
+    force) plus the validation rules, the size of the sort buffer and the
+    directory for temporary files. Returns the paths to all files that were
+    written.
+
+    Parsing, validation and selection happen in the same pass, so they are
+    reported as a single 'stream' span (the external sort is finished while
+    the files are written).
+
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json.
+
+    '''
+
+    if not os.path.isfile(tsv_path):
+        report = ValidationReport(tsv_path)
+        for rule in FILE_RULES:
+            report.violations += rule({'tsv_path':tsv_path})
+        raise TsvValidationError(report)
+
+    yml_path,requirements_path,cran_installation_script_path = get_output_paths(yml_dir,yml_file_name)
+    languages = normalize_languages(languages)
+
+    # one sorter for each package manager, because conda packages, pip packages
+    # and CRAN-packages are written to different sections (or files)
+    sorters = {manager:ExternalSorter(buffer_rows,tmp_dir) for manager in ['conda','pip','cran']}
+    channel_counts = {}
+    has_cran_packages = False
+
+    try:
+        with profiler.span('stream') as span:
+            rows = iter_tsv(tsv_path)
+            columns = next(rows)
+            validator = StreamingValidator(tsv_path,columns,test_configs,buffer_rows,tmp_dir)
+            n_rows = 0
+
+            if validator.active:
+                position = {column:i for i,column in enumerate(columns)}
+                i_name,i_version,i_manager,i_channel,i_include,i_language,i_bug_flag = (
+                    position[c] for c in ['package_name','version','package_manager','conda_channel',
+                                          'include','language','bug_flag'])
+
+                for i,row in enumerate(rows):
+                    validator.add(i,row)
+                    n_rows += 1
+
+                    if not is_selected(row[i_bug_flag],row[i_language],row[i_include],operating_system,languages):
+                        continue
+
+                    channel = row[i_channel]
+                    if channel is not None:
+                        channel_counts[channel] = channel_counts.get(channel,0) + 1
+
+                    # sort by language, then by conda channel (and keep the order of the file)
+                    manager = row[i_manager]
+                    if manager == 'cran':
+                        has_cran_packages = True
+                        if row[i_language] != 'r':
+                            continue
+                    if manager in sorters:
+                        sorters[manager].add((sort_key(row[i_language],channel),i),
+                                             (row[i_name],row[i_version],channel))
+
+            report = validator.finish()
+            span.rows = n_rows
+
+        if not report.ok:
+            raise TsvValidationError(report)
+
+        written_paths = [yml_path]
+        has_pip = len(sorters['pip']) > 0
+
+        with profiler.span('write') as span:
+            if has_pip and pip_requirements_file == True:
+                with atomic_open(requirements_path) as f:
+                    f.writelines(iter_requirements(package_name for package_name,_,_ in sorters['pip']))
+                written_paths.append(requirements_path)
+
+            with atomic_open(yml_path) as f:
+                f.writelines(iter_yml(sort_channels(channel_counts),
+                                      sorters['conda'],
+                                      (package_name for package_name,_,_ in sorters['pip']),
+                                      has_pip,
+                                      yml_name,
+                                      write_conda_channels,
+                                      pip_requirements_file == True))
+
+            span.rows = len(sorters['conda']) + len(sorters['pip'])
+            if profiler.enabled:
+                span.bytes_written = get_size(written_paths)
+
+        if cran_installation_script and has_cran_packages:
+
+            if not yml_name:
+                raise TypeError('When creating installation scripts for CRAN-packages you must specify a yml_name')
+
+            with profiler.span('write_cran_script') as span:
+                write_cran_installation_script(cran_installation_script_path,yml_name,
+                                               (package_name for package_name,_,_ in sorters['cran']),cran_mirror,
+                                               cran_parallel=cran_parallel,cran_ncpus=cran_ncpus,
+                                               cran_dependency_levels=cran_dependency_levels,
+                                               cran_local_repo=cran_local_repo)
+                written_paths.append(cran_installation_script_path)
+
+                span.rows = len(sorters['cran'])
+                if profiler.enabled:
+                    span.bytes_written = get_size([cran_installation_script_path])
+
+    finally:
+        for sorter in sorters.values():
+            sorter.close()
+
+    return written_paths
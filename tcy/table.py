@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+A lightweight, column-oriented representation of a .tsv file that is built
+on the csv module of the standard library
+
+Notes:
+
+- Reading a .tsv file with this module does not require pandas (which takes
+  several hundred milliseconds to import). It is the default engine of tcy.
+- Cells are parsed exactly like pd.read_csv(tsv_path,sep='\\t',dtype=str)
+  would parse them: every cell is a string and cells that pandas would
+  interpret as missing (e.g. '', 'NA', 'nan') are None.
+
+@author: Johannes.Wiesner
+"""
+
+import csv
+
+# the strings that pd.read_csv interprets as NaN by default
+# (see pandas._libs.parsers.STR_NA_VALUES)
+NA_VALUES = frozenset(['','#N/A','#N/A N/A','#NA','-1.#IND','-1.#QNAN','-NaN',
+                       '-nan','1.#IND','1.#QNAN','<NA>','N/A','NA','NULL','NaN',
+                       'None','n/a','nan','null'])
+
+class Table:
+    '''Column-oriented table where each column is a list of strings (or None)
+
+    Parameters
+    ----------
+    columns : list of str
+        The column names in the order in which they appear in the file.
+    data : dict
+        Maps each column name to a list of cell values.
+    index : list of int, optional
+        Position of each row in the original file (0 is the first row after
+        the header). Used to report cells in spreadsheet-program style even
+        for subsets of the table. The default is range(n_rows).
+
+    '''
+
+    __slots__ = ('columns','data','index')
+
+    def __init__(self,columns,data,index=None):
+        self.columns = list(columns)
+        self.data = data
+        if index is None:
+            index = range(len(data[self.columns[0]]) if self.columns else 0)
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self,column):
+        return self.data[column]
+
+    def __contains__(self,column):
+        return column in self.data
+
+    def take(self,positions):
+        '''Returns a new table that only contains the rows at the given positions'''
+
+        positions = list(positions)
+
+        # columns that are not lists (see tcy.cache.CategoricalColumn) know how to take rows
+        data = {c:values.take(positions) if hasattr(values,'take') else [values[i] for i in positions]
+                for c,values in self.data.items()}
+        return Table(self.columns,data,[self.index[i] for i in positions])
+
+    def rows(self,columns=None):
+        '''Iterate over the rows as tuples of the given columns'''
+
+        return zip(*(self.data[c] for c in (columns or self.columns)))
+
+    @classmethod
+    def from_dataframe(cls,df):
+        '''Create a table from a (string-typed) pandas data frame'''
+
+        data = {c:[v if isinstance(v,str) else None for v in df[c].tolist()] for c in df.columns}
+        return cls(df.columns,data,df.index.tolist())
+
+    def to_dataframe(self):
+        '''Convert the table to a pandas data frame (requires pandas)'''
+
+        import pandas as pd
+        return pd.DataFrame(self.data,columns=self.columns,index=self.index,dtype='str')
+
+def iter_tsv(tsv_path):
+    '''Read in a .tsv file line by line. Yields the header first and then
+    every row as list of cell values (with the same length as the header)'''
+
+    with open(tsv_path,newline='',encoding='utf-8-sig') as f:
+        reader = csv.reader(f,delimiter='\t')
+
+        header = next(reader,None)
+        if header is None:
+            raise ValueError(f"{tsv_path} is empty")
+
+        yield header
+        n_columns = len(header)
+
+        for line_number,row in enumerate(reader,start=2):
+
+            # pandas skips blank lines
+            if not row:
+                continue
+
+            if len(row) > n_columns:
+                raise ValueError(f"Error tokenizing {tsv_path}: expected {n_columns} "
+                                 f"fields in line {line_number}, saw {len(row)}")
+
+            # pandas pads rows that have too few fields with NaN
+            if len(row) < n_columns:
+                row = row + [''] * (n_columns - len(row))
+
+            yield [None if cell in NA_VALUES else cell for cell in row]
+
+def read_tsv(tsv_path):
+    '''Read in a .tsv file as Table'''
+
+    rows = iter_tsv(tsv_path)
+    header = next(rows)
+    columns = [list(values) for values in zip(*rows)] or [[] for _ in header]
+
+    return Table(header,dict(zip(header,columns)))
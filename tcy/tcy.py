@@ -14,11 +14,15 @@ Notes:
 @author: Johannes.Wiesner
 """
 
-import pandas as pd
 import os
-from pathlib import Path
-import argparse
-import pytest
+import sys
+from . import manifest
+from .catalog import Catalog
+from .profiling import NULL_PROFILER, get_size
+from .render import render_yml, render_requirements, render_cran_installation_script, write_atomic
+from .spec import EnvironmentSpec
+from .table import Table, read_tsv
+from .validation import validate, TsvValidationError, ValidationReport
 
 def run(operating_system,
         yml_name=None,
@@ -29,7 +33,21 @@ def run(operating_system,
         yml_dir=None,
         cran_installation_script=False,
         cran_mirror='https://cloud.r-project.org',
-        languages='all'):
+        languages='all',
+        engine='csv',
+        force=False,
+        incremental_validation=False,
+        cache=False,
+        cran_parallel=False,
+        cran_ncpus=None,
+        cran_dependency_levels=False,
+        cran_local_repo=None,
+        precedence=None,
+        strict_merge=False,
+        layer_column=None,
+        layer_rules=None,
+        layers=None,
+        profiler=None):
 
     '''Parses the .tsv file and creates an environment.yml file
     
@@ -58,9 +76,11 @@ def run(operating_system,
         https://stackoverflow.com/a/65983247/8792159 for a preview.
         If False, all found channels are put in the 'channels:' section in the 
         order from most frequently to least frequently used channel. 
-    tsv_path: str, optional
+    tsv_path: str or list of str, optional
         Path to a valid packages.tsv file. If not otherwise specified, 
         the function will expect packages.tsv to be in the current working directory. 
+        Several .tsv files (a list of paths, a directory or a glob pattern) are
+        merged into a hidden .tsv file next to the .yml file first (see tcy.merge).
         The default is \'./packages.tsv\'.
     yml_dir: str, optional
         Path to a valid directory where environment.yml should be placed in.
@@ -78,14 +98,258 @@ def run(operating_system,
     languages: str or list of str, optional
         Filter for languages. Valid arguments are python, julia, r, or all.
         The default is 'all'
+    engine: str, optional
+        Can be 'csv', 'pandas' or 'streaming'. The 'csv' engine only relies on
+        the standard library and is much faster to start. The 'pandas' engine 
+        requires pandas. The 'streaming' engine reads the .tsv file row by row
+        and sorts the packages on disk, so its memory usage does not grow with 
+        the size of the .tsv file. All engines produce exactly the same files.
+        The default is 'csv'.
+    force: boolean, optional
+        If False, nothing is done when neither the .tsv file, the validation
+        rules, the tcy version nor any of the other arguments have changed 
+        since the last run and the files of the last run are unchanged (this
+        information is stored in a hidden manifest file next to the .yml file).
+        If True, all files are always validated and rewritten. The default is False.
+    incremental_validation: boolean, optional
+        If True, only rows that were added or changed since the last successful
+        validation are validated (the hashes of all rows are stored in a hidden
+        file next to the .tsv file). Only used by the 'csv' and 'pandas' engines,
+        the 'streaming' engine always validates all rows. The default is False.
+    cache: boolean, optional
+        If True, a validated .tsv file is compiled into a binary cache next
+        to it (e.g. .packages.tsv.tcy-cache) and later runs load the cache
+        instead of parsing and validating the .tsv file again, as long as the
+        content of the .tsv file, the validation rules and the tcy version are
+        unchanged (see tcy.cache). Only used by the 'csv' and 'pandas' engines.
+        The default is False.
+    cran_parallel: boolean, optional
+        If True, the CRAN installation script queries the installed packages
+        once and only installs packages that are missing, builds packages in
+        parallel and reports the installation time of every package. Running
+        the script again therefore only installs what is missing. If False,
+        the script installs all packages with a single install.packages().
+        The default is False.
+    cran_ncpus: int, optional
+        Number of packages that are built in parallel (Ncpus of
+        install.packages). If None, the number of cores of the machine that
+        runs the script is used. Only used if cran_parallel is True.
+        The default is None.
+    cran_dependency_levels: boolean, optional
+        If True, CRAN-packages are installed in batches of the same dependency
+        level (every batch only depends on earlier batches). Only used if
+        cran_parallel is True. The default is False.
+    cran_local_repo: str, optional
+        URL or path of a local CRAN-like repository (e.g. a cache of binary
+        packages) that is searched before cran_mirror. Only used if
+        cran_parallel is True. The default is None.
+    precedence: str or list of str, optional
+        Only used if several .tsv files are merged. The merged files (paths,
+        file names or file names without extension) from highest to lowest
+        precedence. Files that are not listed follow, later files before
+        earlier ones. The default is None (later files take precedence).
+    strict_merge: boolean, optional
+        Only used if several .tsv files are merged. If True, conflicts between
+        the merged files raise a MergeConflictError. If False, every conflict
+        is reported as MergeConflictWarning and resolved by precedence.
+        The default is False.
+    layer_column: str, optional
+        If given, the packages are split into layers by this column of the
+        .tsv file and one .yml file is written per layer (e.g.
+        environment.01-base.yml) together with a manifest that contains the
+        hash of every layer (e.g. environment.layers.json) instead of a single
+        .yml file. See tcy.layers. The default is None.
+    layer_rules: str or list of dict, optional
+        Rules that split the packages into layers (or the path to a .json
+        file that contains them). Only used if layer_column is None. See
+        tcy.layers. The default is None.
+    layers: str or list of str, optional
+        The order of the layers (comma-separated if str). Layers that are not
+        listed follow. Only used with layer_column or layer_rules. The
+        default is None.
+    profiler: tcy.profiling.Profiler, optional
+        If given, every stage of the run (parsing, validation, selection, 
+        writing) is timed and reported to the profiler. See tcy.profiling.
+        The default is None.
 
     Returns
     -------
     None.
 
+    Raises
+    ------
+    TsvValidationError
+        If the .tsv file violates any of the rules in test_configs.json. The
+        found violations are available as the 'report' attribute.
+
     '''
 
-    # get path to .yml file
+    if profiler is None:
+        profiler = NULL_PROFILER
+    
+    profiler.annotate(engine=engine,operating_system=operating_system,skipped=False)
+    
+    yml_path = get_output_paths(yml_dir,yml_file_name)[0]
+    manifest_path = manifest.get_manifest_path(yml_path)
+    
+    # several .tsv files are merged into a single one (unless nothing has changed)
+    merge_paths = None
+    if not isinstance(tsv_path,str) and len(tsv_path) == 1:
+        tsv_path = tsv_path[0]
+    if not isinstance(tsv_path,str) or os.path.isdir(tsv_path) or any(c in tsv_path for c in '*?['):
+        from .merge import get_merge_order
+        merge_paths = get_merge_order(tsv_path,precedence)
+    
+    # all arguments that change the content of the output files
+    options = {'operating_system':operating_system,
+               'yml_name':yml_name,
+               'yml_file_name':yml_file_name,
+               'pip_requirements_file':bool(pip_requirements_file),
+               'write_conda_channels':bool(write_conda_channels),
+               'cran_installation_script':bool(cran_installation_script),
+               'cran_mirror':cran_mirror,
+               'languages':normalize_languages(languages),
+               'cran_options':get_cran_options(cran_parallel,cran_ncpus,cran_dependency_levels,cran_local_repo)}
+    if options['languages'] != 'all':
+        options['languages'] = sorted(options['languages'])
+    if merge_paths is not None:
+        options['merge'] = {'precedence':precedence.split(',') if isinstance(precedence,str) else precedence,
+                            'strict_merge':bool(strict_merge)}
+    if layer_column is not None or layer_rules is not None:
+        if engine == 'streaming':
+            raise ValueError("Layers are not supported by the 'streaming' engine")
+        # the content of a rules file changes the output files as well
+        from .layers import load_layer_rules
+        options['layers'] = {'layer_column':layer_column,
+                             'layer_rules':[[layer,conditions] for layer,conditions in load_layer_rules(layer_rules)]
+                                           if layer_rules is not None else None,
+                             'layers':layers.split(',') if isinstance(layers,str) else layers}
+    
+    # skip everything if nothing has changed since the last run
+    with profiler.span('check_manifest'):
+        # the content of every merged file (in the order of precedence) is part of the inputs
+        input_paths = merge_paths if merge_paths is not None else [tsv_path]
+        inputs = (manifest.get_inputs(merge_paths or tsv_path,options)
+                  if all(os.path.isfile(path) for path in input_paths) else None)
+        up_to_date = not force and inputs and manifest.is_up_to_date(manifest_path,inputs)
+    
+    if up_to_date:
+        profiler.annotate(skipped=True)
+        return
+    
+    if merge_paths is not None:
+        tsv_path = merge_tsv_files(merge_paths,yml_path,strict_merge,profiler)
+    
+    # a cached table has already passed validation with the same rules
+    cache_key = cached_table = None
+    if cache and engine in ('csv','pandas') and os.path.isfile(tsv_path):
+        from .cache import get_cache_path, get_key, load_cache, write_cache
+        with profiler.span('load_cache') as span:
+            cache_key = get_key(tsv_path)
+            cached_table = load_cache(get_cache_path(tsv_path),cache_key)
+            span.rows = len(cached_table) if cached_table is not None else None
+    
+    # check provided .tsv file for errors. The file is only parsed once, the
+    # validated file is reused for everything that follows
+    if cached_table is not None:
+        report = ValidationReport(tsv_path,table=cached_table)
+        df = cached_table.to_dataframe() if engine == 'pandas' else None
+    elif engine == 'pandas':
+        import pandas as pd
+        with profiler.span('parse') as span:
+            df = pd.read_csv(tsv_path,sep='\t',index_col=None,header=0,dtype=str) if os.path.isfile(tsv_path) else None
+            table = Table.from_dataframe(df) if df is not None else None
+            n_rows = span.rows = len(table) if table is not None else 0
+        with profiler.span('validate') as span:
+            report = validate(tsv_path,table=table,incremental=incremental_validation)
+            span.rows = n_rows
+    elif engine == 'csv':
+        with profiler.span('parse') as span:
+            table = read_tsv(tsv_path) if os.path.isfile(tsv_path) else None
+            n_rows = span.rows = len(table) if table is not None else 0
+        with profiler.span('validate') as span:
+            report = validate(tsv_path,table=table,incremental=incremental_validation)
+            span.rows = n_rows
+    elif engine == 'streaming':
+        # validation happens while the file is streamed
+        from .streaming import write_environment_files as write_environment_files_streaming
+        report = None
+    else:
+        raise ValueError(f"engine must be 'csv', 'pandas' or 'streaming' but got {engine!r}")
+    
+    if report is not None and not report.ok:
+        raise TsvValidationError(report)
+    
+    if cache_key is not None and cached_table is None:
+        with profiler.span('write_cache') as span:
+            write_cache(get_cache_path(tsv_path),report.table,cache_key)
+            span.rows = len(report.table)
+    
+    if engine == 'streaming':
+        written_paths = write_environment_files_streaming(tsv_path,
+                                                          operating_system,
+                                                          yml_name=yml_name,
+                                                          yml_file_name=yml_file_name,
+                                                          pip_requirements_file=pip_requirements_file,
+                                                          write_conda_channels=write_conda_channels,
+                                                          yml_dir=yml_dir,
+                                                          cran_installation_script=cran_installation_script,
+                                                          cran_mirror=cran_mirror,
+                                                          languages=languages,
+                                                          **options['cran_options'],
+                                                          profiler=profiler)
+    elif engine == 'pandas' and 'layers' not in options:
+        yml_path,requirements_path,cran_installation_script_path = get_output_paths(yml_dir,yml_file_name)
+        written_paths = _write_files_pandas(df,operating_system,normalize_languages(languages),yml_name,
+                                            pip_requirements_file,write_conda_channels,
+                                            cran_installation_script,cran_mirror,yml_path,
+                                            requirements_path,cran_installation_script_path,profiler,
+                                            options['cran_options'])
+    else:
+        written_paths = write_environment_files(report.table,
+                                                operating_system,
+                                                yml_name=yml_name,
+                                                yml_file_name=yml_file_name,
+                                                pip_requirements_file=pip_requirements_file,
+                                                write_conda_channels=write_conda_channels,
+                                                yml_dir=yml_dir,
+                                                cran_installation_script=cran_installation_script,
+                                                cran_mirror=cran_mirror,
+                                                languages=languages,
+                                                **options['cran_options'],
+                                                layer_column=layer_column,
+                                                layer_rules=layer_rules,
+                                                layers=layers,
+                                                profiler=profiler)
+    
+    if inputs:
+        with profiler.span('write_manifest'):
+            manifest.write_manifest(manifest_path,inputs,written_paths)
+
+def merge_tsv_files(tsv_paths,yml_path,strict_merge=False,profiler=NULL_PROFILER):
+    '''Merge several .tsv files (ordered from highest to lowest precedence,
+    see tcy.merge.get_merge_order) into a hidden .tsv file next to the .yml
+    file and return its path (see run()). The merged file is only replaced
+    if its content changes'''
+    
+    import warnings
+    from .merge import merge_catalogs, get_merged_path, MergeConflictWarning
+    
+    merged_path = get_merged_path(yml_path)
+    
+    with profiler.span('merge') as span:
+        result = merge_catalogs(tsv_paths,merged_path,strict=strict_merge,ordered=True)
+        span.rows = result.n_rows
+    
+    for conflict in result.conflicts:
+        warnings.warn(str(conflict),MergeConflictWarning,stacklevel=3)
+    
+    return merged_path
+
+def get_output_paths(yml_dir,yml_file_name):
+    '''Returns the paths to the .yml file, the requirements.txt file and
+    the CRAN installation script'''
+    
     if yml_dir:
         yml_path = os.path.join(yml_dir,yml_file_name)
         requirements_path = os.path.join(yml_dir,'requirements.txt')
@@ -94,103 +358,280 @@ def run(operating_system,
         yml_path = yml_file_name
         requirements_path = 'requirements.txt'
         cran_installation_script_path = 'install_cran_packages.sh'
-        
-    # check provided .tsv file for errors using pytest
-    # Note: We need to pass the absolute filepath of the test script to pytest
-    # to this script can be excuted from anywhere (otherwise it would
-    # only work if the test script would be in the current working directory)
-    filepath_test = os.path.join(Path(__file__).resolve().parent,'test_tsv_file.py')
-    pytest.main([filepath_test,"--tsv_path",tsv_path,'-qqqq','--tb','no'])
     
-    # read in .tsv file
-    df = pd.read_csv(tsv_path,sep='\t',index_col=None,header=0)
+    return yml_path,requirements_path,cran_installation_script_path
+
+def normalize_languages(languages):
+    ''''all' may also be passed as list (e.g. by the CLI), a single language
+    may also be passed as str'''
+
+    if isinstance(languages,str):
+        return 'all' if languages == 'all' else [languages]
+    if 'all' in languages:
+        return 'all'
+    return languages
 
-    # remove packages that generally don't work (for now) on all platforms
-    df = df.loc[df['bug_flag'] != 'cross-platform']
+def get_cran_options(cran_parallel=False,cran_ncpus=None,cran_dependency_levels=False,cran_local_repo=None):
+    '''Returns the options of the parallel CRAN installation script (all
+    defaults if cran_parallel is False, because they are not used then)'''
     
-    # remove packages that won't work for the specified operating system
-    df = df.loc[df['bug_flag'] != operating_system]
+    if not cran_parallel:
+        return {'cran_parallel':False,'cran_ncpus':None,'cran_dependency_levels':False,'cran_local_repo':None}
+    
+    if cran_ncpus is not None and int(cran_ncpus) < 1:
+        raise ValueError(f"cran_ncpus must be at least 1 but got {cran_ncpus}")
+    
+    return {'cran_parallel':True,
+            'cran_ncpus':int(cran_ncpus) if cran_ncpus is not None else None,
+            'cran_dependency_levels':bool(cran_dependency_levels),
+            'cran_local_repo':cran_local_repo or None}
+
+def write_environment_files(table,
+                            operating_system,
+                            yml_name=None,
+                            yml_file_name='environment.yml',
+                            pip_requirements_file=False,
+                            write_conda_channels=False,
+                            yml_dir=None,
+                            cran_installation_script=False,
+                            cran_mirror='https://cloud.r-project.org',
+                            languages='all',
+                            cran_parallel=False,
+                            cran_ncpus=None,
+                            cran_dependency_levels=False,
+                            cran_local_repo=None,
+                            layer_column=None,
+                            layer_rules=None,
+                            layers=None,
+                            profiler=NULL_PROFILER,
+                            write=write_atomic,
+                            remove=os.remove):
+    '''Creates the environment.yml file (and optional requirements.txt and
+    CRAN installation script) from an already validated table. Takes the
+    same arguments as run() (without tsv_path, engine and force). table can
+    also be a tcy.catalog.Catalog (e.g. to write the files of many targets
+    from the same indexes). The content of the files is rendered from the
+    EnvironmentSpec of build(). Every file is passed to write(path,content),
+    which writes it atomically by default (tcy watch collects the files in
+    memory instead). With layer_column or layer_rules, one .yml file is
+    written per layer instead of a single one (see tcy.layers), and the
+    files of layers that became empty are passed to remove(path). Returns
+    the paths to all files that were written.'''
     
-    # filter for languages if specified by user
-    if not languages == 'all':
-        df = df.loc[df['language'].isin(languages),:]
+    yml_path,requirements_path,cran_installation_script_path = get_output_paths(yml_dir,yml_file_name)
+    layered = layer_column is not None or layer_rules is not None
     
-    # filter for only for packages that should be included
-    df = df.loc[df['include'] == True]
+    if layered and pip_requirements_file == True:
+        raise ValueError('pip_requirements_file cannot be combined with layers (pip packages '
+                         'are written to the .yml file of their layer)')
     
-    # sort by language, then by package manager, then by conda channel
-    df.sort_values(by=['language','package_manager','conda_channel'],inplace=True)
+    with profiler.span('select') as span:
+        table = get_catalog(table)
+        spec = build(operating_system,yml_name=yml_name,languages=languages,catalog=table)
+        span.rows = len(spec.conda_packages) + len(spec.pip_packages) + len(spec.cran_packages)
     
-    # get all conda channels, sort by frequency and if there are ties sort alphabetically
-    conda_channels = df['conda_channel'].value_counts().sort_index(ascending=False).sort_values(ascending=False).index
+    with profiler.span('write') as span:
+        if layered:
+            from .layers import write_layers
+            written_paths = write_layers(table,operating_system,yml_name,yml_file_name,write_conda_channels,
+                                         yml_dir,languages,layer_column,layer_rules,layers,write=write,
+                                         remove=remove)
+        else:
+            written_paths = [yml_path]
+            
+            if spec.has_pip and pip_requirements_file == True:
+                write(requirements_path,spec.to_requirements())
+                written_paths.append(requirements_path)
+            
+            write(yml_path,spec.to_yml(write_conda_channels,pip_requirements_file == True))
         
-    # write yml-header
-    with open(yml_path,'w') as f:
+        span.rows = len(spec.conda_packages) + len(spec.pip_packages)
+        if profiler.enabled:
+            span.bytes_written = get_size(written_paths)
     
-        if yml_name:
-            f.write(f"name: {yml_name}\n")
+    if spec.has_cran and cran_installation_script:
         
-        f.write('channels:\n')
+        # raises a TypeError if there is no yml_name
+        cran_installation_script_content = spec.to_cran_script(cran_mirror,cran_parallel,cran_ncpus,
+                                                               cran_dependency_levels,cran_local_repo)
         
-        if write_conda_channels == False:
-            for channel in conda_channels:
-                f.write(f"- {channel}\n")   
+        with profiler.span('write_cran_script') as span:
+            write(cran_installation_script_path,cran_installation_script_content)
+            written_paths.append(cran_installation_script_path)
+            
+            span.rows = len(spec.cran_packages)
+            if profiler.enabled:
+                span.bytes_written = get_size([cran_installation_script_path])
+    
+    return written_paths
+
+def build(operating_system,yml_name=None,languages='all',tsv_path='./packages.tsv',catalog=None):
+    '''Selects the packages for an operating system and returns them as
+    EnvironmentSpec, without writing any file
+    
+    Parameters
+    ----------
+    operating_system : str
+        See run().
+    yml_name : str, optional
+        The "name:" attribute of the .yml file (see run()). The default is None.
+    languages : str or list of str, optional
+        See run(). The default is 'all'.
+    tsv_path : str, optional
+        Path to a valid packages.tsv file. Only used if catalog is None.
+        The default is './packages.tsv'.
+    catalog : tcy.catalog.Catalog or tcy.table.Table, optional
+        An already validated table (or its catalog). Building many specs from
+        the same catalog does not read or validate any file. The default is
+        None (read and validate tsv_path).
+    
+    Returns
+    -------
+    spec : tcy.spec.EnvironmentSpec
+        Channels and conda, pip and CRAN packages. Render the files with
+        spec.to_yml(), spec.to_requirements() and spec.to_cran_script() (or
+        write them to any stream with the write_* methods).
+    
+    Raises
+    ------
+    TsvValidationError
+        If catalog is None and the .tsv file violates any of the rules in
+        test_configs.json.
+    
+    '''
+    
+    if catalog is None:
+        report = validate(tsv_path)
+        if not report.ok:
+            raise TsvValidationError(report)
+        catalog = report.table
+    
+    catalog = get_catalog(catalog)
+    mask = catalog.get_mask(operating_system,normalize_languages(languages))
+    
+    return get_spec(catalog.take(mask),sort_channels(catalog.get_channel_counts(mask)),yml_name)
+
+def get_spec(table,channels,yml_name=None):
+    '''Returns the EnvironmentSpec of the selected (and sorted) rows of a table'''
+    
+    package_name,package_manager = table['package_name'],table['package_manager']
+    
+    # column arrays of conda, pip and CRAN packages
+    conda_packages = [(n,v,c) for n,v,c,m in zip(package_name,table['version'],table['conda_channel'],package_manager)
+                      if m == 'conda']
+    pip_packages = [n for n,m in zip(package_name,package_manager) if m == 'pip']
+    cran_packages = [n for n,m,l in zip(package_name,package_manager,table['language'])
+                     if m == 'cran' and l == 'r']
+    
+    return EnvironmentSpec(yml_name,channels,conda_packages,pip_packages,cran_packages,
+                           has_cran='cran' in package_manager)
+
+def is_selected(bug_flag,language,include,operating_system,languages='all'):
+    '''True if a package should be included for the given operating system
+    and languages'''
+    
+    # remove packages that generally don't work (for now) on all platforms,
+    # packages that won't work for the specified operating system, packages
+    # of other languages and packages that should not be included
+    return (bug_flag != 'cross-platform'
+            and bug_flag != operating_system
+            and (languages == 'all' or language in languages)
+            and include is not None and include.lower() == 'true')
+
+def sort_key(*values):
+    '''Sort key for cells that puts empty cells last (like pd.DataFrame.sort_values)'''
+    
+    return tuple((v is None,v or '') for v in values)
+
+def select_packages(table,operating_system,languages='all'):
+    '''Returns a sorted subset of the table that only contains packages that
+    should be included for the given operating system and languages. table
+    can also be a tcy.catalog.Catalog, whose indexes are then reused'''
+    
+    catalog = get_catalog(table)
+    return catalog.take(catalog.get_mask(operating_system,languages))
+
+def get_catalog(table):
+    '''Returns the catalog (sorted order and selection indexes) of a table'''
+    
+    return table if isinstance(table,Catalog) else Catalog(table)
+
+def get_conda_channels(table):
+    '''Returns all conda channels sorted by frequency. Ties are sorted in
+    reverse alphabetical order'''
+    
+    counts = {}
+    for channel in table['conda_channel']:
+        if channel is not None:
+            counts[channel] = counts.get(channel,0) + 1
+    
+    return sort_channels(counts)
+
+def sort_channels(counts):
+    '''Sort channels by their number of packages. Ties are sorted in reverse
+    alphabetical order'''
+    
+    return sorted(sorted(counts,reverse=True),key=lambda channel: -counts[channel])
+
+def write_cran_installation_script(path,yml_name,cran_packages,cran_mirror,write=write_atomic,
+                                   cran_parallel=False,cran_ncpus=None,cran_dependency_levels=False,
+                                   cran_local_repo=None):
+    '''Write a bash script that installs CRAN-packages inside a conda environment'''
+    
+    write(path,render_cran_installation_script(yml_name,cran_packages,cran_mirror,cran_parallel,
+                                               cran_ncpus,cran_dependency_levels,cran_local_repo))
+
+def _write_files_pandas(df,operating_system,languages,yml_name,pip_requirements_file,
+                        write_conda_channels,cran_installation_script,cran_mirror,
+                        yml_path,requirements_path,cran_installation_script_path,profiler=NULL_PROFILER,
+                        cran_options=None):
+    '''The pandas engine of run(). Produces the same files as the default
+    csv engine and returns the paths to all files that were written'''
+    
+    with profiler.span('select') as span:
+        
+        # remove packages that generally don't work (for now) on all platforms
+        df = df.loc[df['bug_flag'] != 'cross-platform']
         
-        f.write('- defaults\n')
-        f.write('dependencies:\n')
+        # remove packages that won't work for the specified operating system
+        df = df.loc[df['bug_flag'] != operating_system]
+        
+        # filter for languages if specified by user
+        if not languages == 'all':
+            df = df.loc[df['language'].isin(languages),:]
+        
+        # filter for only for packages that should be included
+        df = df.loc[df['include'].str.lower() == 'true']
+        
+        # sort by language, then by package manager, then by conda channel
+        df.sort_values(by=['language','package_manager','conda_channel'],inplace=True)
+        
+        # get all conda channels, sort by frequency and if there are ties sort alphabetically
+        conda_channels = df['conda_channel'].value_counts().sort_index(ascending=False).sort_values(ascending=False,kind='stable').index
+        
+        span.rows = len(df)
+    
+    written_paths = [yml_path]
     
-    # write conda packages
-    with open(yml_path,'a') as f:
+    with profiler.span('write') as span:
         
+        # column arrays of conda and pip packages (empty cells as None)
+        df = df.astype(object).where(df.notna(),None)
         df_conda = df.loc[df['package_manager'] == 'conda']
+        conda_packages = zip(df_conda['package_name'].tolist(),df_conda['version'].tolist(),df_conda['conda_channel'].tolist())
+        pip_packages = df.loc[df['package_manager'] == 'pip','package_name'].tolist()
+        has_pip = 'pip' in df['package_manager'].values
         
-        for idx,row in df_conda.iterrows():
-            
-            row = row.to_dict()
-            package_name = row['package_name']
-            version = row['version']
-            conda_channel = row['conda_channel']
-            
-            command = f"{package_name}"
-            
-            if write_conda_channels:
-                command = f"{conda_channel}::{command}"
-            if not pd.isna(version):
-                command = f"{command}{version}"
-            command = f"- {command}\n"
-           
-            f.write(command)
-    
-    # write pip packages
-    if 'pip' in df['package_manager'].values:
-    
-        with open(yml_path,'a') as f:
-            
-            df_pip = df.loc[df['package_manager'] == 'pip']
-            
-            # these two lines are needed in any case
-            f.write('- pip\n')
-            f.write('- pip:\n')
+        write_atomic(yml_path,render_yml(conda_channels,conda_packages,pip_packages,has_pip,yml_name,
+                                         write_conda_channels,pip_requirements_file == True))
         
-            if pip_requirements_file == False:
-                        
-                for idx,row in df_pip.iterrows():
-                    row = row.to_dict()
-                    package_name = row['package_name']
-                    command = f"{package_name}"
-                    command = f"  - {command}\n"
-                    f.write(command)
-                    
-            if pip_requirements_file == True:
-                
-                f.write('  - -r requirements.txt')
-            
-                with open(requirements_path,'w') as rf:
-                    for idx,row in df_pip.iterrows():
-                        row = row.to_dict()
-                        package_name = row['package_name']
-                        command = f"{package_name}\n"
-                        rf.write(command)
+        if has_pip and pip_requirements_file == True:
+            write_atomic(requirements_path,render_requirements(pip_packages))
+            written_paths.append(requirements_path)
+        
+        span.rows = len(df_conda) + len(pip_packages)
+        if profiler.enabled:
+            span.bytes_written = get_size(written_paths)
     
     if 'cran' in df['package_manager'].values:
     
@@ -198,28 +639,40 @@ def run(operating_system,
             
             if not yml_name:
                 raise TypeError('When creating installation scripts for CRAN-packages you must specify a yml_name')
-                        
-            # subset dataframe to CRAN-packages 
-            df_cran = df.loc[(df['language'] == 'R') & (df['package_manager'] == 'cran'),:]
-            
-            # parse list of CRAN-packages to a single string with packages separated by comma
-            cran_packages = ','.join(f"'{package}'" for package in df_cran['package_name'])
             
-            # write bash script that allows you to:
-            # 1. activate the conda environment from within a bash-script as suggested here:
-            # https://github.com/conda/conda/issues/7980#issuecomment-472648567
-            # 2. use RScript to install packages within the conda environment. 
-            # We have to specify a mirror because otherwise script will halt because 
-            # we would have to choose one:
-            # https://stackoverflow.com/questions/50870927/using-install-packages-inside-a-shell-script-through-terminal-to-automatically
-            with open(cran_installation_script_path,'w') as f:
-                f.write('#!/bin/bash\n')
-                f.write("CONDA_BASE=$(conda info --base) && source $CONDA_BASE/etc/profile.d/conda.sh\n")
-                f.write(f"conda activate {yml_name} && Rscript -e \"install.packages(c({cran_packages}),repos=\'{cran_mirror}\')\"")
-
-def main():
-
-    parser = argparse.ArgumentParser(description='Parse the information from packages.tsv and return environment.yml file')
+            with profiler.span('write_cran_script') as span:
+                
+                # subset dataframe to CRAN-packages 
+                df_cran = df.loc[(df['language'] == 'r') & (df['package_manager'] == 'cran'),:]
+                
+                write_cran_installation_script(cran_installation_script_path,yml_name,df_cran['package_name'],
+                                               cran_mirror,**(cran_options or {}))
+                written_paths.append(cran_installation_script_path)
+                
+                span.rows = len(df_cran)
+                if profiler.enabled:
+                    span.bytes_written = get_size([cran_installation_script_path])
+    
+    return written_paths
+
+# subcommands of the command line application that live in their own modules.
+# They are only imported when they are called.
+SUBCOMMANDS = {'batch':'tcy.batch','solve':'tcy.solve','delta':'tcy.delta','watch':'tcy.watch','serve':'tcy.serve','check':'tcy.check','compare':'tcy.compare','merge':'tcy.merge'}
+
+def main(argv=None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in SUBCOMMANDS:
+        import importlib
+        return importlib.import_module(SUBCOMMANDS[argv[0]]).main(argv[1:])
+
+    # argparse is only needed for the command line application
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Parse the information from packages.tsv and return environment.yml file',
+                                     epilog=f"Further subcommands: {', '.join(SUBCOMMANDS)} (see 'tcy <subcommand> --help')")
 
     # add positional arguments
     parser.add_argument('os',type=str,choices=['linux','windows'],
@@ -244,10 +697,18 @@ def main():
                         (e.g. conda-forge::spyder). In this case the \'defaults\' channel \
                         is the only channel that appears in the \'channels:\' section. See: \
                         https://stackoverflow.com/a/65983247/8792159 for a preview.')
-    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+    parser.add_argument('--tsv_path',type=str,required=False,default=['./packages.tsv'],nargs='+',
                         help='Optional Path to the input packages.tsv file. \
                         If not otherwise specified, the function will expect packages.tsv \
-                        to be in the current working directory.')
+                        to be in the current working directory. Several .tsv files, \
+                        directories or glob patterns are merged first (later files take precedence).')
+    parser.add_argument('--precedence',type=str,required=False,default=None,
+                        help='Comma-separated .tsv files (paths, file names or file names without \
+                        extension) from highest to lowest precedence. Only used if several \
+                        .tsv files are merged.')
+    parser.add_argument('--strict_merge',action='store_true',
+                        help='Fail if the merged .tsv files conflict instead of resolving the \
+                        conflicts by precedence.')
     parser.add_argument('--yml_dir',type=str,required=False,
                         help='Path to a valid directory where environment.yml \
                         should be placed in. If not given, environment.yml will \
@@ -260,24 +721,101 @@ def main():
     parser.add_argument('--cran_mirror',type=str,required=False,default='https://cloud.r-project.org',
                         help="A valid URL to a CRAN-Mirror where packages should be downloaded from. \
                         The default is \'https://cloud.r-project.org\'")
+    parser.add_argument('--cran_parallel',action='store_true',
+                        help='Write a CRAN installation script that skips packages that are \
+                        already installed, builds packages in parallel and reports the \
+                        installation time of every package.')
+    parser.add_argument('--cran_ncpus',type=int,required=False,default=None,
+                        help='Number of CRAN-packages that are built in parallel. If not given, \
+                        the number of cores of the machine that runs the script. Only used \
+                        with --cran_parallel.')
+    parser.add_argument('--cran_dependency_levels',action='store_true',
+                        help='Install CRAN-packages in batches of the same dependency level. \
+                        Only used with --cran_parallel.')
+    parser.add_argument('--cran_local_repo',type=str,required=False,default=None,
+                        help='URL or path of a local CRAN-like repository (e.g. a cache of binary \
+                        packages) that is searched before --cran_mirror. Only used with --cran_parallel.')
     parser.add_argument('--languages',type=str,required=False,default='all',nargs='+',
                         help="Filter for certain programming languages. Valid inputs \
                         are python, julia, r or all.")
+    parser.add_argument('--layer_column',type=str,required=False,default=None,
+                        help='Split the packages into layers by this column of the .tsv file and \
+                        write one .yml file per layer plus a manifest with the hash of every layer.')
+    parser.add_argument('--layer_rules',type=str,required=False,default=None,metavar='JSON_PATH',
+                        help='Split the packages into layers by the rules in this .json file \
+                        (instead of --layer_column).')
+    parser.add_argument('--layers',type=str,required=False,default=None,
+                        help='Comma-separated order of the layers (e.g. base,python,r). Layers \
+                        that are not listed follow.')
+
+    parser.add_argument('--engine',type=str,required=False,default='csv',choices=['csv','pandas','streaming'],
+                        help="Engine that is used to parse the .tsv file. The 'csv' engine \
+                        only relies on the standard library and starts much faster. The \
+                        'pandas' engine requires pandas. The 'streaming' engine keeps memory \
+                        usage constant for very large .tsv files. All produce the same files. \
+                        The default is \'csv\'")
+
+    parser.add_argument('--force',action='store_true',
+                        help='Validate the .tsv file and rewrite all files even if nothing \
+                        has changed since the last run.')
+
+    parser.add_argument('--incremental_validation',action='store_true',
+                        help='Only validate rows of the .tsv file that were added or changed \
+                        since the last successful validation.')
+
+    parser.add_argument('--cache',action='store_true',
+                        help='Compile the validated .tsv file into a binary cache next to it \
+                        and load the cache in later runs instead of parsing and validating \
+                        the .tsv file again (as long as its content is unchanged).')
+
+    parser.add_argument('--profile',type=str,required=False,default=None,metavar='JSON_PATH',
+                        help='Write a breakdown of the run (wall time, rows, bytes written \
+                        and peak memory of every stage) to this .json file.')
 
     # parse arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # conflicts between merged .tsv files are printed as plain messages
+    import warnings
+    warnings.formatwarning = lambda message,category,*args,**kwargs: f"{category.__name__}: {message}\n"
+
+    if args.profile:
+        from .profiling import Profiler
+        profiler = Profiler()
+    else:
+        profiler = None
 
     # parse .tsv file and get .yml file
-    run(operating_system=args.os,
-        yml_name=args.yml_name,
-        yml_file_name=args.yml_file_name,
-        write_conda_channels=args.write_conda_channels,
-        pip_requirements_file=args.pip_requirements_file,
-        tsv_path=args.tsv_path,
-        yml_dir=args.yml_dir,
-        cran_installation_script=args.cran_installation_script,
-        cran_mirror=args.cran_mirror,
-        languages=args.languages)
+    try:
+        run(operating_system=args.os,
+            yml_name=args.yml_name,
+            yml_file_name=args.yml_file_name,
+            write_conda_channels=args.write_conda_channels,
+            pip_requirements_file=args.pip_requirements_file,
+            tsv_path=args.tsv_path,
+            yml_dir=args.yml_dir,
+            cran_installation_script=args.cran_installation_script,
+            cran_mirror=args.cran_mirror,
+            languages=args.languages,
+            engine=args.engine,
+            force=args.force,
+            incremental_validation=args.incremental_validation,
+            cache=args.cache,
+            cran_parallel=args.cran_parallel,
+            cran_ncpus=args.cran_ncpus,
+            cran_dependency_levels=args.cran_dependency_levels,
+            cran_local_repo=args.cran_local_repo,
+            precedence=args.precedence,
+            strict_merge=args.strict_merge,
+            layer_column=args.layer_column,
+            layer_rules=args.layer_rules,
+            layers=args.layers,
+            profiler=profiler)
+    except (TsvValidationError,ValueError) as e:
+        sys.exit(str(e))
+    finally:
+        if profiler is not None:
+            profiler.write(args.profile)
 
 if __name__ == '__main__':
     main()
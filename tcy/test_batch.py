@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Test creating the environment files of many targets with tcy batch
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+
+import pytest
+from tcy.batch import check_targets, run_batch
+from tcy.tcy import run
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\tlayer\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\tbase\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\tpython\n'
+       'mne\t\tconda\tbioconda\ttrue\tpython\twindows\tpython\n'
+       'requests\t\tpip\t\ttrue\tpython\t\tpython\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\tbase\n'
+       'lme4\t\tcran\t\ttrue\tr\t\tr\n')
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+def read_files(yml_dir):
+    '''Returns the content of all files except hidden ones (e.g. the manifest of run())'''
+
+    files = {}
+    for name in sorted(os.listdir(yml_dir)):
+        if not name.startswith('.') and os.path.isfile(os.path.join(yml_dir,name)):
+            with open(os.path.join(yml_dir,name)) as f:
+                files[name] = f.read()
+    return files
+
+def get_targets(yml_dir):
+    return [{'operating_system':'linux','yml_name':'ubuntu','yml_file_name':'ubuntu.yml','yml_dir':yml_dir,
+             'cran_installation_script':True},
+            {'operating_system':'windows','yml_file_name':'windows.yml','yml_dir':yml_dir,
+             'write_conda_channels':True,'languages':'python'},
+            {'operating_system':'linux','yml_file_name':'layered.yml','yml_dir':yml_dir,'layer_column':'layer'},
+            {'operating_system':'windows','yml_file_name':'pip.yml','yml_dir':os.path.join(yml_dir,'pip'),
+             'pip_requirements_file':True}]
+
+def test_same_files_as_run(tsv_path,tmp_path):
+    '''A batch writes the same files as separate calls of run()'''
+
+    batch_dir,run_dir = str(tmp_path / 'batch'),str(tmp_path / 'run')
+    for yml_dir in (batch_dir,run_dir):
+        os.makedirs(os.path.join(yml_dir,'pip'))
+
+    yml_paths = run_batch(get_targets(batch_dir),tsv_path)
+    for target in get_targets(run_dir):
+        run(tsv_path=tsv_path,**target)
+
+    assert [os.path.basename(path) for path in yml_paths] == ['ubuntu.yml','windows.yml','layered.yml','pip.yml']
+    assert list(read_files(batch_dir)) == ['install_cran_packages.sh','layered.01-base.yml','layered.02-python.yml',
+                                           'layered.03-r.yml','layered.layers.json','ubuntu.yml','windows.yml']
+    assert list(read_files(os.path.join(batch_dir,'pip'))) == ['pip.yml','requirements.txt']
+    assert read_files(batch_dir) == read_files(run_dir)
+    assert read_files(os.path.join(batch_dir,'pip')) == read_files(os.path.join(run_dir,'pip'))
+
+    # the same files are written by a pool of processes
+    parallel_dir = str(tmp_path / 'parallel')
+    os.makedirs(os.path.join(parallel_dir,'pip'))
+    run_batch(get_targets(parallel_dir),tsv_path,processes=2)
+    assert read_files(parallel_dir) == read_files(batch_dir)
+
+def test_same_path(tsv_path,tmp_path):
+    '''Nothing is written if two targets would write the same file'''
+
+    yml_dir = str(tmp_path / 'out')
+    os.mkdir(yml_dir)
+    targets = [{'operating_system':'linux','yml_dir':yml_dir},
+               {'operating_system':'windows','yml_dir':yml_dir}]
+
+    with pytest.raises(ValueError,match='Targets 0 and 1 would both write to'):
+        run_batch(targets,tsv_path)
+
+    # also if only the CRAN installation scripts collide
+    targets = [{'operating_system':'linux','yml_dir':yml_dir,'yml_file_name':'linux.yml',
+                'yml_name':'linux','cran_installation_script':True},
+               {'operating_system':'windows','yml_dir':yml_dir,'yml_file_name':'windows.yml',
+                'yml_name':'windows','cran_installation_script':True}]
+
+    with pytest.raises(ValueError,match='install_cran_packages.sh'):
+        run_batch(targets,tsv_path)
+
+    assert os.listdir(yml_dir) == []
+
+def test_invalid_targets(tsv_path,tmp_path):
+    yml_dir = str(tmp_path)
+
+    with pytest.raises(ValueError,match='pip_requirements_file cannot be combined with layers'):
+        check_targets([{'operating_system':'linux','yml_dir':yml_dir,'layer_column':'layer',
+                        'pip_requirements_file':True}])
+
+    for target,match in [({'yml_dir':yml_dir},'must specify an operating_system'),
+                         ({'operating_system':'macos'},'invalid operating_system'),
+                         ({'operating_system':'linux','languages':['python','rust']},'invalid languages: rust'),
+                         ({'operating_system':'linux','engine':'pandas'},'unknown keys: engine'),
+                         ({'operating_system':'linux','cran_installation_script':True},'must specify a yml_name')]:
+        with pytest.raises(ValueError,match=match):
+            check_targets([target])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Test that tables survive a round-trip through the binary cache
+
+Notes:
+
+- Every column encoding of tcy.cache (categorical with 1 and 2 byte codes,
+  strings with and without empty cells, json) is written and loaded again.
+- All files are written to a temporary directory, so these tests do not need
+  the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import pytest
+from tcy.cache import (CategoricalColumn, get_cache_path, get_key, write_cache,
+                       load_cache, load_table, _encode_column)
+from tcy.table import Table
+from tcy.tcy import run
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'scikit-learn\t\tpip\t\ttrue\tpython\twindows\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n'
+       'r-stats\t\tcran\t\tfalse\tr\t\n')
+
+def get_table(n_rows=600):
+    '''Returns a table that needs every column encoding'''
+
+    return Table(['tiny','many','names','sparse','nul'],
+                 {'tiny':[('a','b',None)[i % 3] for i in range(n_rows)],
+                  'many':[str(i % 300) for i in range(n_rows)],
+                  'names':[f"package-{i}" for i in range(n_rows)],
+                  'sparse':[None if i % 2 else f"ä{i}" for i in range(n_rows)],
+                  'nul':[f"x\0{i}" if i == 0 else f"x{i}" for i in range(n_rows)]})
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+def test_encodings():
+    table = get_table()
+    encodings = {column:_encode_column(table[column])[0] for column in table.columns}
+
+    assert encodings['tiny']['encoding'] == 'categorical' and encodings['tiny']['typecode'] == 'B'
+    assert encodings['many']['encoding'] == 'categorical' and encodings['many']['typecode'] == 'H'
+    assert encodings['names'] == {'encoding':'string','has_empty':False}
+    assert encodings['sparse'] == {'encoding':'string','has_empty':True}
+    assert encodings['nul'] == {'encoding':'json'}
+
+def test_round_trip(tsv_path,tmp_path):
+    table = get_table()
+    cache_path = str(tmp_path / 'table.tcy-cache')
+    key = get_key(tsv_path)
+
+    write_cache(cache_path,table,key)
+    loaded = load_cache(cache_path,key)
+
+    assert loaded.columns == table.columns
+    assert len(loaded) == len(table)
+    for column in table.columns:
+        assert list(loaded[column]) == table[column]
+
+    # categorical columns are read from the mapped file and can be subset
+    assert isinstance(loaded['tiny'],CategoricalColumn)
+    assert 'b' in loaded['tiny'] and 'c' not in loaded['tiny']
+    assert list(loaded.take([5,1])['tiny']) == [None,'b']
+
+def test_empty_table(tsv_path,tmp_path):
+    cache_path = str(tmp_path / 'table.tcy-cache')
+    key = get_key(tsv_path)
+
+    write_cache(cache_path,Table(['a','b'],{'a':[],'b':[]}),key)
+    loaded = load_cache(cache_path,key)
+
+    assert loaded.columns == ['a','b'] and len(loaded) == 0
+
+def test_invalid_cache(tsv_path,tmp_path):
+    '''Caches of other files and broken caches are ignored'''
+
+    cache_path = str(tmp_path / 'table.tcy-cache')
+    key = get_key(tsv_path)
+    write_cache(cache_path,get_table(),key)
+
+    assert load_cache(cache_path,{**key,'tsv_sha256':'0' * 64}) is None
+    assert load_cache(str(tmp_path / 'missing.tcy-cache'),key) is None
+
+    with open(cache_path,'r+b') as f:
+        f.write(b'garbage!')
+    assert load_cache(cache_path,key) is None
+
+def test_run_writes_cache(tsv_path,tmp_path):
+    '''run() caches the validated file and uses the cache until the file changes'''
+
+    assert load_table(tsv_path) is None
+
+    run('linux',tsv_path=tsv_path,yml_dir=str(tmp_path),cache=True)
+    with open(tmp_path / 'environment.yml') as f:
+        expected = f.read()
+
+    table = load_table(tsv_path)
+    assert list(table['package_name']) == ['python','numpy','scikit-learn','r-base','r-stats']
+    assert list(table['version']) == [None,'>=1.21',None,None,None]
+
+    (tmp_path / 'environment.yml').unlink()
+    run('linux',tsv_path=tsv_path,yml_dir=str(tmp_path),cache=True)
+    with open(tmp_path / 'environment.yml') as f:
+        assert f.read() == expected
+
+    with open(tsv_path,'a') as f:
+        f.write('scipy\t\tconda\tconda-forge\ttrue\tpython\t\n')
+    assert load_table(tsv_path) is None
+    assert get_cache_path(tsv_path).endswith('.packages.tsv.tcy-cache')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Test the bitmap indexes of tcy.catalog against the row by row selection
+
+Notes:
+
+- The tables are built in memory by the tests, so these tests do not need
+  the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import itertools
+
+import pytest
+from tcy.catalog import Catalog
+from tcy.table import Table
+from tcy.tcy import is_selected, sort_key
+
+COLUMNS = ['package_name','version','package_manager','conda_channel','include','language','bug_flag']
+
+def get_table(n_rows,n_channels=4):
+    '''Returns a table whose rows cover all combinations of the indexed columns'''
+
+    combinations = itertools.cycle(itertools.product(['conda','pip','cran'],
+                                                     ['true','false','True',None],
+                                                     ['python','r','julia'],
+                                                     [None,'linux','windows','cross-platform']))
+    channels = [f"channel-{i}" for i in range(n_channels)] + [None]
+
+    rows = []
+    for i in range(n_rows):
+        manager,include,language,bug_flag = next(combinations)
+        rows.append([f"package-{i}",None,manager,channels[i % len(channels)],include,language,bug_flag])
+
+    return Table(COLUMNS,{column:[row[i] for row in rows] for i,column in enumerate(COLUMNS)})
+
+def select(table,operating_system,languages):
+    '''The positions of the selected rows in the order of the .yml file, row by row'''
+
+    positions = [i for i in range(len(table))
+                 if is_selected(table['bug_flag'][i],table['language'][i],table['include'][i],
+                                operating_system,languages)]
+    return sorted(positions,key=lambda i: sort_key(*(table[c][i] for c in ['language','package_manager',
+                                                                          'conda_channel'])))
+
+@pytest.mark.parametrize('n_rows,n_channels',[(0,4),(1,4),(7,4),(1000,4),(1000,300)])
+def test_get_mask(n_rows,n_channels):
+    '''get_mask selects the same rows as is_selected (the second case has more
+    than 256 channels, which are indexed from their positions)'''
+
+    table = get_table(n_rows,n_channels)
+    catalog = Catalog(table)
+    assert len(catalog.indexes['conda_channel']) == min(n_rows,n_channels + 1)
+
+    for operating_system in ['linux','windows']:
+        for languages in ['all',['python'],['r','julia'],[]]:
+            mask = catalog.get_mask(operating_system,languages)
+            positions = select(table,operating_system,languages)
+
+            assert catalog.get_positions(mask) == positions
+            assert catalog.count(mask) == len(positions)
+            assert catalog.take(mask)['package_name'] == [table['package_name'][i] for i in positions]
+
+            counts = {}
+            for i in positions:
+                if table['conda_channel'][i] is not None:
+                    counts[table['conda_channel'][i]] = counts.get(table['conda_channel'][i],0) + 1
+            assert catalog.get_channel_counts(mask) == counts
+
+def test_bitmaps():
+    '''A bitmap has one bit per row in the sorted order'''
+
+    table = get_table(60)
+    catalog = Catalog(table)
+
+    assert catalog.all == (1 << 60) - 1
+    for column,index in catalog.indexes.items():
+        # every row has exactly one value
+        assert sum(index.values()) == catalog.all
+        for value,mask in index.items():
+            assert [table[column][i] for i in catalog.get_positions(mask)] == [value] * catalog.count(mask)
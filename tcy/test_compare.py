@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Test tcy compare with a few small solved exports
+
+Notes:
+
+- The exports are written to a temporary directory by the tests, so these
+  tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+
+import pytest
+from tcy.compare import find_exports, select_exports, run_compare, CompareIndex
+
+URL = 'https://conda.anaconda.org/conda-forge/linux-64'
+
+EXPORTS = {'ubuntu/ubuntu_solved.txt':('@EXPLICIT\n'
+                                       f"{URL}/python-3.11.5-h1_0.conda#0123\n"
+                                       f"{URL}/numpy-1.26.0-py311_0.tar.bz2\n"
+                                       f"{URL}/r-base-4.3.1-h1_0.conda\n"),
+           'ubuntu/ubuntu_solved_pip-requirements.txt':'requests==2.31.0\nScikit_Learn==1.3.0\n',
+           # not used, because ubuntu has an explicit file and a requirements file
+           'ubuntu/ubuntu_solved.yml':'dependencies:\n  - pandas=2.1.0=py311_0\n',
+           'windows_solved.yml':('name: windows\n'
+                                 'dependencies:\n'
+                                 '  - python=3.11.5=h2_0\n'
+                                 '  - numpy=1.26.0=py311_0\n'
+                                 '  - pip:\n'
+                                 '    - requests==2.32.0\n'
+                                 '    - scikit-learn==1.3.0\n'),
+           'snapshots/2025-01/ubuntu_solved.txt':('@EXPLICIT\n'
+                                                 f"{URL}/python-3.11.5-h1_0.conda\n"
+                                                 f"{URL}/numpy-1.25.2-py311_0.conda\n"
+                                                 f"{URL}/r-base-4.3.1-h1_0.conda\n"),
+           'README.md':'not an export\n'}
+
+@pytest.fixture
+def root(tmp_path):
+    '''Returns the directory with all exports'''
+
+    for relative_path,content in EXPORTS.items():
+        path = tmp_path / 'environments' / relative_path
+        path.parent.mkdir(parents=True,exist_ok=True)
+        path.write_text(content)
+
+    return str(tmp_path / 'environments')
+
+def test_find_exports(root):
+    exports = find_exports([root])
+
+    assert sorted(exports.values()) == [('snapshots/2025-01/ubuntu','explicit'),
+                                        ('ubuntu','explicit'),('ubuntu','pip'),('ubuntu','yml'),
+                                        ('windows','yml')]
+    assert sorted(select_exports(exports).values()) == [('snapshots/2025-01/ubuntu','explicit'),
+                                                        ('ubuntu','explicit'),('ubuntu','pip'),
+                                                        ('windows','yml')]
+
+    with pytest.raises(ValueError):
+        find_exports([os.path.join(root,'missing')])
+
+def test_comparison(root):
+    comparison = run_compare([root])
+
+    assert comparison.targets == ['snapshots/2025-01/ubuntu','ubuntu','windows']
+    assert comparison.drift == [('conda','numpy'),('pip','requests')]
+    assert comparison.builds == [('conda','python')]
+    assert comparison.missing == [('conda','r-base'),('pip','requests'),('pip','scikit-learn')]
+    assert ('conda','pandas') not in comparison.table
+
+    assert comparison.to_tsv().splitlines() == [
+        'package_manager\tpackage_name\tstatus\tsnapshots/2025-01/ubuntu\tubuntu\twindows',
+        'conda\tnumpy\tdrift\t1.25.2=py311_0\t1.26.0=py311_0\t1.26.0=py311_0',
+        'conda\tpython\tbuild\t3.11.5=h1_0\t3.11.5=h1_0\t3.11.5=h2_0',
+        'conda\tr-base\tmissing\t4.3.1=h1_0\t4.3.1=h1_0\t',
+        'pip\trequests\tdrift,missing\t\t2.31.0\t2.32.0',
+        'pip\tscikit-learn\tmissing\t\t1.3.0\t1.3.0']
+
+    assert 'numpy: 1.26.0 (ubuntu, windows), 1.25.2 (snapshots/2025-01/ubuntu)' in comparison.report()
+
+def test_filters(root):
+    comparison = run_compare([root],targets=['ubuntu','win*'],package='numpy')
+
+    assert comparison.targets == ['ubuntu','windows']
+    assert comparison.table == {('conda','numpy'):{'ubuntu':('1.26.0','py311_0'),'windows':('1.26.0','py311_0')}}
+    assert comparison.status == {}
+
+def test_index(root,tmp_path):
+    '''Only new and changed files are parsed again'''
+
+    index_path = str(tmp_path / 'index.sqlite')
+    exports = select_exports(find_exports([root]))
+
+    with CompareIndex(index_path) as index:
+        assert index.update(exports) == 4
+        table = index.get_table(exports)
+        assert index.update(exports) == 0
+
+        # touched, but not changed
+        path = os.path.join(root,'windows_solved.yml')
+        os.utime(path,ns=(0,0))
+        assert index.update(exports) == 0
+
+        with open(path,'a') as f:
+            f.write('  - scipy=1.11.2=py311_0\n')
+        assert index.update(exports) == 1
+        changed = index.get_table(exports)
+
+    assert changed.pop(('conda','scipy')) == {'windows':('1.11.2','py311_0')}
+    assert changed == table
+
+    # files are parsed in parallel with the same result
+    assert run_compare([root],index_path=str(tmp_path / 'parallel.sqlite'),processes=2).table == \
+           run_compare([root],index_path=index_path).table
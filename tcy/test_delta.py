@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Test tcy delta with a small .tsv file and a solved environment
+
+Notes:
+
+- All files are written to a temporary directory by the tests, so these
+  tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import pytest
+from tcy.delta import (read_solved_yml, read_pip_requirements, is_satisfied,
+                       run_delta, get_delta_paths, main)
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'scipy\t=1.11.2=py311*\tconda\tconda-forge\ttrue\tpython\t\n'
+       'pandas\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'matplotlib\t\tconda\tconda-forge\tfalse\tpython\t\n'
+       'Scikit_Learn\t\tpip\t\ttrue\tpython\t\n'
+       'nilearn\t\tpip\t\ttrue\tpython\t\n'
+       'requests\t\tpip\t\ttrue\tpython\tlinux\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n')
+
+SOLVED_YML = '''name: env
+channels:
+  - conda-forge
+dependencies:
+  - python=3.11.5=hab00c5b_0_cpython
+  - conda-forge::numpy=1.20.3=py311h64a7726_0
+  - scipy=1.11.2=py312h1234_0
+  - matplotlib=3.8.0=py311h38be061_0
+  - r-base=4.3.1=h1234_0
+  - pip:
+    - scikit-learn==1.3.0
+    - requests==2.31.0
+prefix: /opt/conda/envs/env
+'''
+
+@pytest.fixture
+def files(tmp_path):
+    '''Returns the paths to the .tsv file and the solved .yml file'''
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    solved_yml_path = tmp_path / 'env_solved.yml'
+    solved_yml_path.write_text(SOLVED_YML)
+    return str(tsv_path),str(solved_yml_path)
+
+def test_read_solved_yml(files):
+    conda_packages,pip_packages = read_solved_yml(files[1])
+
+    assert conda_packages['python'] == ('3.11.5','hab00c5b_0_cpython')
+    assert conda_packages['numpy'] == ('1.20.3','py311h64a7726_0')
+    assert set(conda_packages) == {'python','numpy','scipy','matplotlib','r-base'}
+    assert pip_packages == {'scikit-learn':('scikit-learn','1.3.0'),'requests':('requests','2.31.0')}
+
+def test_read_pip_requirements(tmp_path):
+    path = tmp_path / 'requirements.txt'
+    path.write_text('# frozen\n--index-url https://example.org\nNumPy==1.26.0\nrequests[socks]==2.31.0 ; python_version>"3"\nnilearn\n')
+
+    assert read_pip_requirements(str(path)) == {'numpy':('NumPy','1.26.0'),
+                                                'requests':('requests','2.31.0'),
+                                                'nilearn':('nilearn',None)}
+
+def test_is_satisfied():
+    assert is_satisfied('numpy',None,None)
+    assert is_satisfied('numpy','>=1.21','1.26.0')
+    assert not is_satisfied('numpy','>=1.21','1.20.3')
+    assert not is_satisfied('numpy','>=1.21',None)
+
+    # the build is compared if the version column and the solved file have one
+    assert is_satisfied('scipy','=1.11.2=py311*','1.11.2','py311h1234_0')
+    assert not is_satisfied('scipy','=1.11.2=py311*','1.11.2','py312h1234_0')
+    assert is_satisfied('scipy','=1.11.2=py311*','1.11.2')
+    assert not is_satisfied('scipy','=1.11.2=py311*','1.11.3','py311h1234_0')
+
+    # invalid version columns are never satisfied
+    assert not is_satisfied('numpy','>=1.21(','1.26.0')
+
+def test_run_delta(files,tmp_path):
+    tsv_path,solved_yml_path = files
+    requirements_path = tmp_path / 'env_solved_pip-requirements.txt'
+    requirements_path.write_text('scikit-learn==1.3.0\n')
+
+    delta = run_delta('linux',solved_yml_path,str(requirements_path),tsv_path=tsv_path,yml_dir=str(tmp_path),
+                      languages=['python'])
+
+    assert delta.conda_added == [('pandas',None,'conda-forge')]
+    assert delta.conda_respecified == [('numpy','>=1.21','conda-forge'),('scipy','=1.11.2=py311*','conda-forge')]
+    assert delta.pip_added == ['nilearn']
+    # r-base is not removed because only python packages were selected
+    assert delta.removed == [('conda','matplotlib'),('pip','requests')]
+
+    yml_path,pip_path,removals_path = get_delta_paths(str(tmp_path),'update.yml')
+    with open(yml_path) as f:
+        assert f.read() == ('channels:\n'
+                            '- conda-forge\n'
+                            '- defaults\n'
+                            'dependencies:\n'
+                            '- numpy>=1.21\n'
+                            '- scipy=1.11.2=py311*\n'
+                            '- pandas\n')
+    with open(pip_path) as f:
+        assert f.read() == 'nilearn\n'
+    with open(removals_path) as f:
+        assert f.read() == 'package_manager\tpackage_name\nconda\tmatplotlib\npip\trequests\n'
+
+def test_main_invalid_file(files,tmp_path):
+    '''Files that cannot be decoded end the CLI with an error message'''
+
+    tsv_path,_ = files
+    solved_yml_path = tmp_path / 'broken_solved.yml'
+    solved_yml_path.write_bytes(b'dependencies:\n  - numpy=1.26\xff\n')
+
+    with pytest.raises(SystemExit) as e:
+        main(['linux','--solved_yml',str(solved_yml_path),'--tsv_path',tsv_path,'--yml_dir',str(tmp_path)])
+    assert 'decode' in str(e.value.code)
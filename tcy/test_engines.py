@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the csv, pandas and streaming engines of run() write the same files
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+- The pandas engine is skipped if pandas is not installed.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import importlib.util
+
+import pytest
+from tcy.tcy import run, normalize_languages
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'mne\t\tconda\tbioconda\ttrue\tpython\twindows\n'
+       'scipy\t\tconda\tconda-forge\tfalse\tpython\t\n'
+       'requests\t>=2\tpip\t\ttrue\tpython\t\n'
+       'nilearn\t\tpip\t\ttrue\tpython\tlinux\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n'
+       'r-ggplot2\t\tconda\tr\ttrue\tr\t\n'
+       'lme4\t\tcran\t\ttrue\tr\t\n'
+       'brms\t\tcran\t\ttrue\tr\tcross-platform\n'
+       'julia\t\tconda\tconda-forge\ttrue\tjulia\t\n')
+
+ENGINES = ['csv','streaming',
+           pytest.param('pandas',marks=pytest.mark.skipif(importlib.util.find_spec('pandas') is None,
+                                                          reason='pandas is not installed'))]
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+def read_files(yml_dir):
+    '''Returns the content of all files except hidden ones (e.g. the manifest of run())'''
+
+    files = {}
+    for name in sorted(os.listdir(yml_dir)):
+        if not name.startswith('.'):
+            with open(os.path.join(yml_dir,name)) as f:
+                files[name] = f.read()
+    return files
+
+def run_engine(tsv_path,tmp_path,engine,**kwargs):
+    yml_dir = tmp_path / engine
+    yml_dir.mkdir(exist_ok=True)
+    run(tsv_path=tsv_path,yml_dir=str(yml_dir),engine=engine,force=True,**kwargs)
+    return read_files(str(yml_dir))
+
+@pytest.mark.parametrize('engine',ENGINES)
+@pytest.mark.parametrize('kwargs',[{'operating_system':'linux'},
+                                   {'operating_system':'windows','write_conda_channels':True},
+                                   {'operating_system':'linux','pip_requirements_file':True},
+                                   {'operating_system':'linux','languages':'python'},
+                                   {'operating_system':'windows','languages':['python','julia']},
+                                   {'operating_system':'linux','languages':['r'],'yml_name':'r_env',
+                                    'cran_installation_script':True},
+                                   {'operating_system':'linux','yml_name':'env','cran_installation_script':True,
+                                    'cran_parallel':True,'cran_ncpus':2}])
+def test_engines(tsv_path,tmp_path,engine,kwargs):
+    '''Every engine writes the same files as the csv engine'''
+
+    expected = run_engine(tsv_path,tmp_path,'csv',**kwargs)
+    assert run_engine(tsv_path,tmp_path,engine,**kwargs) == expected
+
+    if kwargs.get('pip_requirements_file'):
+        assert expected['requirements.txt'] == 'requests\n'
+    if kwargs.get('cran_installation_script'):
+        assert 'lme4' in expected['install_cran_packages.sh']
+        assert 'brms' not in expected['install_cran_packages.sh']
+
+def test_single_language(tsv_path,tmp_path):
+    '''A single language passed as str is not matched by substring'''
+
+    assert normalize_languages('all') == 'all'
+    assert normalize_languages(['python','all']) == 'all'
+    assert normalize_languages('r') == ['r']
+
+    files = run_engine(tsv_path,tmp_path,'csv',operating_system='linux',languages='r')
+    assert files == run_engine(tsv_path,tmp_path,'streaming',operating_system='linux',languages=['r'])
+    assert '- r-base\n' in files['environment.yml'] and 'python' not in files['environment.yml']
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Test incremental validation with the row hashes of the last validation
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+- The number of rows that are checked is recorded by wrapping
+  tcy.validation.check_table.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+
+import pytest
+from tcy import validation
+from tcy.incremental import get_sidecar_path, hash_rows
+from tcy.validation import validate, load_test_configs
+
+HEADER = 'package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+
+ROWS = ['python\t\tconda\tconda-forge\ttrue\tpython\t\n',
+        'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n',
+        'scipy\t\tconda\tconda-forge\ttrue\tpython\t\n',
+        'requests\t\tpip\t\ttrue\tpython\t\n']
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(HEADER + ''.join(ROWS))
+    return str(tsv_path)
+
+@pytest.fixture
+def checked(monkeypatch):
+    '''The number of rows of every call of check_table'''
+
+    checked = []
+    check_table = validation.check_table
+
+    def record(context):
+        checked.append(len(context['table']))
+        return check_table(context)
+
+    monkeypatch.setattr(validation,'check_table',record)
+    return checked
+
+def write_rows(tsv_path,rows):
+    with open(tsv_path,'w') as f:
+        f.write(HEADER + ''.join(rows))
+
+def test_known_rows(tsv_path,checked):
+    '''Only added and changed rows are checked, their position does not matter'''
+
+    assert validate(tsv_path,incremental=True).ok
+    assert os.path.isfile(get_sidecar_path(tsv_path))
+    assert validate(tsv_path,incremental=True).ok
+
+    write_rows(tsv_path,ROWS[::-1] + ['pandas\t\tconda\tconda-forge\ttrue\tpython\t\n'])
+    assert validate(tsv_path,incremental=True).ok
+
+    assert checked == [4,0,1]
+
+def test_changed_cell(tsv_path,checked):
+    '''A changed cell of a known row is checked again, errors are reported
+    for the full table'''
+
+    validate(tsv_path,incremental=True)
+    write_rows(tsv_path,[ROWS[0],'numpy\t>=1.21 \tconda\tconda-forge\ttrue\tpython\t\n'] + ROWS[2:])
+
+    report = validate(tsv_path,incremental=True)
+
+    assert [(v.rule,v.cells) for v in report.violations] == [('whitespaces',['B3'])]
+    assert checked == [4,1,4]
+
+    # the invalid row is not remembered
+    assert not validate(tsv_path,incremental=True).ok
+    write_rows(tsv_path,ROWS)
+    assert validate(tsv_path,incremental=True).ok
+    assert checked == [4,1,4,1,4,0]
+
+def test_conflicting_duplicate(tsv_path):
+    '''A new duplicate conflicts with an unchanged row'''
+
+    validate(tsv_path,incremental=True)
+    write_rows(tsv_path,ROWS + ['numpy\t<1.20\tconda\tconda-forge\ttrue\tpython\t\n'])
+
+    report = validate(tsv_path,incremental=True)
+
+    assert [(v.rule,v.cells) for v in report.violations] == [('conflicting_duplicates',['B3','B6'])]
+    assert [v.message for v in report.violations] == [v.message for v in validate(tsv_path).violations]
+
+def test_changed_test_configs(tsv_path,tmp_path,checked):
+    '''Rows that passed with other rules (e.g. of an edited copy of
+    test_configs.json) are checked again'''
+
+    validate(tsv_path,incremental=True)
+
+    test_configs_path = tmp_path / 'test_configs.json'
+    test_configs = load_test_configs()
+    test_configs['valid_options']['bug_flag'].append('macos')
+    test_configs_path.write_text(json.dumps(test_configs))
+
+    test_configs = load_test_configs(str(test_configs_path))
+    assert validate(tsv_path,test_configs,incremental=True).ok
+    assert validate(tsv_path,test_configs,incremental=True).ok
+
+    # the sidecar was written for the changed rules now
+    assert validate(tsv_path,incremental=True).ok
+
+    assert checked == [4,4,0,4]
+
+@pytest.mark.parametrize('corrupt',[lambda data: data[:-3],
+                                    lambda data: data[data.index(b'\n') + 1:],
+                                    lambda data: b'',
+                                    lambda data: b'\x00' * len(data)])
+def test_corrupt_sidecar(tsv_path,checked,corrupt):
+    '''A corrupt or truncated sidecar is ignored'''
+
+    validate(tsv_path,incremental=True)
+    sidecar_path = get_sidecar_path(tsv_path)
+    with open(sidecar_path,'rb') as f:
+        data = f.read()
+    with open(sidecar_path,'wb') as f:
+        f.write(corrupt(data))
+
+    assert validate(tsv_path,incremental=True).ok
+    assert checked == [4,4]
+
+    # and replaced by a valid one
+    assert validate(tsv_path,incremental=True).ok
+    assert checked == [4,4,0]
+
+def test_known_hashes(tsv_path,checked):
+    '''Row hashes kept by the caller are used instead of the sidecar'''
+
+    report = validate(tsv_path,known_hashes=set())
+    assert report.row_hashes == hash_rows(report.table)
+    assert not os.path.exists(get_sidecar_path(tsv_path))
+
+    write_rows(tsv_path,ROWS + ['numpy\t<1.20\tconda\tconda-forge\ttrue\tpython\t\n'])
+    report = validate(tsv_path,known_hashes=set(report.row_hashes))
+
+    assert [v.rule for v in report.violations] == ['conflicting_duplicates']
+    assert checked == [4,1,5]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Test layered environment files and their manifest
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+import hashlib
+
+import pytest
+from tcy.layers import assign_layers, build_layers, write_layers, load_layer_rules, get_layer_manifest_path
+from tcy.tcy import run
+from tcy.validation import validate
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\tlayer\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\tbase\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\tbase\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\tpython\n'
+       'r-ggplot2\t\tconda\tconda-forge\ttrue\tr\t\tr\n'
+       'scikit-learn\t\tpip\t\ttrue\tpython\t\tpython\n'
+       'ipython\t\tconda\tconda-forge\ttrue\tpython\t\t\n')
+
+RULES = [{'layer':'base','package_name':['python','r-base']},
+         {'layer':'python','language':'python','package_manager':'conda'},
+         {'layer':'pip','package_manager':'pip','conda_channel':None}]
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+@pytest.fixture
+def table(tsv_path):
+    return validate(tsv_path).table
+
+def read_manifest(yml_dir):
+    with open(get_layer_manifest_path(os.path.join(yml_dir,'environment.yml'))) as f:
+        return json.load(f)
+
+def test_assign_layers(table):
+    positions = list(range(len(table)))
+
+    order,assigned = assign_layers(table,positions,layer_column='layer')
+    assert order == ['base','python','r','default']
+    assert assigned == {'base':[0,1],'python':[2,4],'r':[3],'default':[5]}
+
+    order,assigned = assign_layers(table,positions,layer_column='layer',layers='r,base')
+    assert order == ['r','base','python','default']
+
+    order,assigned = assign_layers(table,positions,layer_rules=RULES)
+    assert order == ['base','python','pip','default']
+    assert assigned == {'base':[0,1],'python':[2,5],'default':[3],'pip':[4]}
+
+def test_invalid_layers(table,tmp_path):
+    with pytest.raises(ValueError):
+        assign_layers(table,[0],layer_column='tier')
+    with pytest.raises(ValueError):
+        assign_layers(table,[0])
+    with pytest.raises(ValueError):
+        assign_layers(table,[0],layer_rules=[{'layer':'base','tier':'1'}])
+    with pytest.raises(ValueError):
+        load_layer_rules([{'layer':'../base'}])
+
+    rules_path = tmp_path / 'rules.json'
+    rules_path.write_text(json.dumps(RULES))
+    assert load_layer_rules(str(rules_path)) == load_layer_rules(RULES)
+
+def test_build_layers(table):
+    '''Only non-empty layers are returned, the number of a layer is its
+    position in the order of all layers'''
+
+    layers = build_layers('linux',languages=['python'],catalog=table,layer_column='layer')
+
+    assert [(layer.name,layer.index) for layer in layers] == [('base',1),('python',2),('default',4)]
+    assert [layer.get_file_name() for layer in layers] == ['environment.01-base.yml','environment.02-python.yml',
+                                                          'environment.04-default.yml']
+    assert layers[1].spec.to_yml() == ('channels:\n'
+                                       '- conda-forge\n'
+                                       '- defaults\n'
+                                       'dependencies:\n'
+                                       '- numpy>=1.21\n'
+                                       '- pip\n'
+                                       '- pip:\n'
+                                       '  - scikit-learn\n')
+
+def test_manifest(table,tmp_path):
+    '''The manifest lists the hash of every layer file and a cumulative hash
+    that only changes if the layer or a lower layer changes'''
+
+    yml_dir = str(tmp_path)
+    written_paths = write_layers(table,'linux',yml_dir=yml_dir,layer_column='layer')
+    manifest = read_manifest(yml_dir)
+
+    assert [os.path.basename(path) for path in written_paths] == ['environment.01-base.yml','environment.02-python.yml',
+                                                                  'environment.03-r.yml','environment.04-default.yml',
+                                                                  'environment.layers.json']
+
+    cumulative = hashlib.sha256()
+    for entry in manifest['layers']:
+        with open(os.path.join(yml_dir,entry['file']),'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        cumulative.update(digest.encode('ascii'))
+        assert entry['sha256'] == digest
+        assert entry['cumulative_sha256'] == cumulative.hexdigest()
+
+    assert [(e['name'],e['conda_packages'],e['pip_packages']) for e in manifest['layers']] == [
+        ('base',2,0),('python',1,1),('r',1,0),('default',1,0)]
+
+    # a change of the r layer does not change the hashes of the layers below it
+    changed = table.take(range(len(table)))
+    changed.data = {**changed.data,'version':[None,None,'>=1.21','>=3.4',None,None]}
+    write_layers(changed,'linux',yml_dir=yml_dir,layer_column='layer')
+    entries = read_manifest(yml_dir)['layers']
+
+    assert [e['cumulative_sha256'] for e in entries[:2]] == [e['cumulative_sha256'] for e in manifest['layers'][:2]]
+    assert entries[2]['sha256'] != manifest['layers'][2]['sha256']
+    assert entries[3]['sha256'] == manifest['layers'][3]['sha256']
+    assert entries[3]['cumulative_sha256'] != manifest['layers'][3]['cumulative_sha256']
+
+def test_stale_files(table,tmp_path):
+    '''Files of layers that became empty are removed (through the remove
+    callable, so callers that do not write to disk can handle them)'''
+
+    yml_dir = str(tmp_path)
+    write_layers(table,'linux',yml_dir=yml_dir,layer_column='layer')
+
+    files = {}
+    removed = []
+    write_layers(table,'linux',yml_dir=yml_dir,languages=['r'],layer_column='layer',
+                 write=files.__setitem__,remove=removed.append)
+
+    assert sorted(os.path.basename(path) for path in files) == ['environment.01-base.yml','environment.03-r.yml',
+                                                               'environment.layers.json']
+    assert sorted(os.path.basename(path) for path in removed) == ['environment.02-python.yml',
+                                                                 'environment.04-default.yml']
+    assert os.path.isfile(os.path.join(yml_dir,'environment.02-python.yml'))
+
+    write_layers(table,'linux',yml_dir=yml_dir,languages=['r'],layer_column='layer')
+    assert sorted(os.listdir(yml_dir)) == ['environment.01-base.yml','environment.03-r.yml',
+                                           'environment.layers.json','packages.tsv']
+
+def list_files(yml_dir):
+    '''All files except hidden ones (e.g. the manifest of run())'''
+
+    return sorted(name for name in os.listdir(yml_dir) if not name.startswith('.'))
+
+def test_run(tsv_path,tmp_path):
+    yml_dir = str(tmp_path / 'out')
+    os.mkdir(yml_dir)
+
+    run('linux',tsv_path=tsv_path,yml_dir=yml_dir,layer_rules=RULES,layers='pip')
+    assert list_files(yml_dir) == ['environment.01-pip.yml','environment.02-base.yml',
+                                   'environment.03-python.yml','environment.04-default.yml',
+                                   'environment.layers.json']
+
+    run('linux',tsv_path=tsv_path,yml_dir=yml_dir,layer_rules=RULES,languages=['python'])
+    assert [e['file'] for e in read_manifest(yml_dir)['layers']] == ['environment.01-base.yml',
+                                                                     'environment.02-python.yml',
+                                                                     'environment.03-pip.yml']
+    assert list_files(yml_dir) == ['environment.01-base.yml','environment.02-python.yml',
+                                   'environment.03-pip.yml','environment.layers.json']
+
+    with pytest.raises(ValueError):
+        run('linux',tsv_path=tsv_path,yml_dir=yml_dir,layer_column='layer',pip_requirements_file=True)
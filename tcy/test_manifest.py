@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Test that run() skips writing the environment files if nothing has changed
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+- A file counts as rewritten if its modification time changes. All output
+  files are set to an old modification time before the second run.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import shutil
+import functools
+
+import pytest
+from tcy import manifest
+from tcy.tcy import run
+from tcy.validation import TEST_CONFIGS_PATH
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'requests\t\tpip\t\ttrue\tpython\t\n'
+       'lme4\t\tcran\t\ttrue\tr\t\n')
+
+OPTIONS = {'operating_system':'linux','yml_name':'env','pip_requirements_file':True,'cran_installation_script':True}
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+@pytest.fixture
+def yml_dir(tmp_path):
+    yml_dir = tmp_path / 'out'
+    yml_dir.mkdir()
+    return str(yml_dir)
+
+def get_output_paths(yml_dir):
+    return [os.path.join(yml_dir,name) for name in ('environment.yml','requirements.txt','install_cran_packages.sh')]
+
+def run_twice(tsv_path,yml_dir,change=None,**kwargs):
+    '''Runs tcy, applies change(), sets the modification times of all output
+    files to 0 and runs tcy again. Returns True if any file was rewritten'''
+
+    run(tsv_path=tsv_path,yml_dir=yml_dir,**OPTIONS)
+    if change is not None:
+        change()
+    for path in get_output_paths(yml_dir):
+        if os.path.isfile(path):
+            os.utime(path,ns=(0,0))
+
+    run(tsv_path=tsv_path,yml_dir=yml_dir,**{**OPTIONS,**kwargs})
+
+    return any(os.stat(path).st_mtime_ns != 0 for path in get_output_paths(yml_dir))
+
+def test_unchanged(tsv_path,yml_dir):
+    assert not run_twice(tsv_path,yml_dir)
+    assert os.path.isfile(manifest.get_manifest_path(os.path.join(yml_dir,'environment.yml')))
+
+def test_changed_tsv(tsv_path,yml_dir):
+    def change():
+        with open(tsv_path,'a') as f:
+            f.write('scipy\t\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert run_twice(tsv_path,yml_dir,change)
+    with open(os.path.join(yml_dir,'environment.yml')) as f:
+        assert '- scipy\n' in f.read()
+
+@pytest.mark.parametrize('kwargs',[{'operating_system':'windows'},
+                                   {'write_conda_channels':True},
+                                   {'cran_mirror':'https://cran.example.org'},
+                                   {'languages':['r']},
+                                   {'cran_parallel':True}])
+def test_changed_options(tsv_path,yml_dir,kwargs):
+    assert run_twice(tsv_path,yml_dir,**kwargs)
+
+def test_edited_output(tsv_path,yml_dir):
+    '''A file that was edited by hand is replaced again'''
+
+    yml_path = os.path.join(yml_dir,'environment.yml')
+    contents = []
+
+    def change():
+        with open(yml_path) as f:
+            contents.append(f.read())
+        with open(yml_path,'a') as f:
+            f.write('- scipy\n')
+
+    assert run_twice(tsv_path,yml_dir,change)
+    with open(yml_path) as f:
+        assert f.read() == contents[0]
+
+def test_removed_output(tsv_path,yml_dir):
+    assert run_twice(tsv_path,yml_dir,lambda: os.remove(os.path.join(yml_dir,'requirements.txt')))
+    assert os.path.isfile(os.path.join(yml_dir,'requirements.txt'))
+
+def test_force(tsv_path,yml_dir):
+    assert run_twice(tsv_path,yml_dir,force=True)
+
+def test_changed_test_configs(tsv_path,yml_dir,tmp_path,monkeypatch):
+    '''Other validation rules can make the same .tsv file invalid, so the
+    files are created again'''
+
+    test_configs_path = str(tmp_path / 'test_configs.json')
+    shutil.copyfile(TEST_CONFIGS_PATH,test_configs_path)
+    monkeypatch.setattr(manifest,'get_inputs',functools.partial(manifest.get_inputs,
+                                                                test_configs_path=test_configs_path))
+
+    assert not run_twice(tsv_path,yml_dir)
+
+    def change():
+        with open(test_configs_path,'a') as f:
+            f.write('\n')
+
+    assert run_twice(tsv_path,yml_dir,change)
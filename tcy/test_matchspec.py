@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Test parsing, ordering and satisfiability of conda versions and match specs,
+and the rules of the version column that are built on them
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import pytest
+from tcy.matchspec import (parse_version, VersionSpec, parse_constraint, parse_match_spec,
+                           compile_constraints, are_compatible)
+from tcy.check import check_solved
+from tcy.table import iter_tsv
+from tcy.validation import validate, StreamingValidator
+
+HEADER = 'package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+
+def test_version_order():
+    versions = ['0.4','0.4.1.rc','0.4.1','0.5a1','0.5b3','0.5c1','0.5','0.9.6',
+                '0.960923','1.0','1.1dev1','1.1a1','1.1.0dev1','1.1.a1','1.1.0rc1','1.1.0',
+                '1.1.0post1','1.1post1','1996.07.12','1!0.4.1','1!3.1.1.6','2!0.4.1']
+
+    # every version is older than the next one (some are equal, see below)
+    parsed = [parse_version(v) for v in versions]
+    for older,newer in zip(parsed,parsed[1:]):
+        assert older <= newer, (older,newer)
+
+    assert parse_version('0.4.1.dev0') < parse_version('0.4.1.rc') < parse_version('0.4.1')
+    assert parse_version('1.1dev1') < parse_version('1.1a1')
+    assert parse_version('1.0') == parse_version('1.0.0')
+    assert parse_version('1.1.0') < parse_version('1.1.0post1')
+    assert parse_version('1.2+2') > parse_version('1.2+1') > parse_version('1.2')
+    assert parse_version('1.10') > parse_version('1.9')
+    assert parse_version('1.2.3').startswith(parse_version('1.2'))
+    assert not parse_version('1.20').startswith(parse_version('1.2'))
+
+    for invalid in ('','1..2','1.2$'):
+        with pytest.raises(ValueError):
+            parse_version(invalid)
+
+@pytest.mark.parametrize('spec,matching,not_matching',
+                         [('','1.0',None),
+                          ('>=1.21','1.21.0','1.20.9'),
+                          ('>=1.21,<2','1.26.4','2.0'),
+                          ('1.21.*','1.21.5','1.210'),
+                          ('=1.21','1.21.5','1.22'),
+                          ('!=1.21.*','1.22','1.21.1'),
+                          ('~=1.21.2','1.21.9','1.22'),
+                          ('<1.21|>=2','2.1','1.21'),
+                          ('==1.21','1.21.0','1.21.1')])
+def test_version_spec(spec,matching,not_matching):
+    spec = VersionSpec(spec)
+    assert spec.match(matching)
+    if not_matching is not None:
+        assert not spec.match(not_matching)
+
+def test_constraint():
+    '''Cells of the version column, with and without a build'''
+
+    constraint = parse_constraint('=1.21=py311*')
+    assert str(constraint.version) == '1.21' and constraint.build == 'py311*'
+    assert constraint.match('1.21','py311h1234_0')
+    assert not constraint.match('1.21','py312h1234_0')
+    # the build is ignored if the solved package does not have one
+    assert constraint.match('1.21')
+
+    assert parse_constraint('>=1.21').build is None
+    assert parse_constraint('1.21.* *').build is None
+    assert parse_constraint('1.21.* py311_0').build == 'py311_0'
+
+    constraints,errors = compile_constraints(['>=1.21',None,'>=1.21','>=1.2(',''])
+    assert list(constraints) == ['>=1.21','']
+    assert list(errors) == ['>=1.2(']
+
+def test_match_spec():
+    spec = parse_match_spec('conda-forge::numpy>=1.21')
+    assert (spec.channel,spec.name,str(spec.version),spec.build) == ('conda-forge','numpy','>=1.21',None)
+    assert spec.match('numpy','1.26.0') and not spec.match('numpy','1.20') and not spec.match('scipy','1.26.0')
+
+    spec = parse_match_spec('python_abi 3.11.* *_cp311')
+    assert (spec.name,str(spec.version),spec.build) == ('python_abi','3.11.*','*_cp311')
+    assert spec.match('python_abi','3.11','2_cp311') and not spec.match('python_abi','3.11','2_cp312')
+
+    assert parse_match_spec('pip') is parse_match_spec('pip')
+
+    with pytest.raises(ValueError):
+        parse_match_spec('>=1.2')
+
+@pytest.mark.parametrize('specs,compatible',
+                         [(['>=1.21','<2'],True),
+                          (['>=1.21','<1.21'],False),
+                          (['>=1.21','<1.21.1'],True),
+                          (['1.21.*','>1.21'],True),
+                          (['1.21.*','1.22.*'],False),
+                          (['>=1.21',''],True),
+                          (['<1.21|>=2','>=1.21,<2'],False),
+                          (['=1.21=py311*','=1.21=py311h1_0'],True),
+                          (['=1.21=py311*','=1.21=py312*'],False),
+                          (['=1.21=py311h1_0','=1.21=py311h2_0'],False)])
+def test_are_compatible(specs,compatible):
+    assert are_compatible(specs) == compatible
+
+def validate_both(tmp_path,tsv):
+    '''Returns the messages of validate() and of the StreamingValidator'''
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(HEADER + tsv)
+
+    rows = iter_tsv(str(tsv_path))
+    validator = StreamingValidator(str(tsv_path),next(rows),buffer_rows=2,tmp_dir=str(tmp_path))
+    for position,row in enumerate(rows):
+        validator.add(position,row)
+
+    messages = [v.message for v in validate(str(tsv_path)).violations]
+    assert [v.message for v in validator.finish().violations] == messages
+    return messages
+
+def test_invalid_specs(tmp_path):
+    '''Only the versions of conda packages have to be valid match specs'''
+
+    messages = validate_both(tmp_path,'numpy\t>=1.21(\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'scipy\t>=1.11\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'requests\t>=2(\tpip\t\ttrue\tpython\t\n')
+    assert len(messages) == 1 and messages[0].endswith('Please check these cells: B2')
+
+def test_conflicting_duplicates(tmp_path):
+    '''Duplicates only conflict if they are selected for the same operating
+    system. The streaming validator spills them to disk (buffer_rows=2)'''
+
+    messages = validate_both(tmp_path,'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'scipy\t<1.11\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'numpy\t<1.20\tconda\tconda-forge\ttrue\tpython\twindows\n'
+                                      'scipy\t>=1.11\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'pandas\t>=2\tconda\tconda-forge\ttrue\tpython\t\n'
+                                      'pandas\t<2\tconda\tconda-forge\tfalse\tpython\t\n'
+                                      'numpy\t<2\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert messages == ['numpy is listed more than once for linux with version specs that cannot be '
+                        'satisfied together (>=1.21, <1.20, <2). Please check these cells: B2, B4, B8',
+                        'scipy is listed more than once for linux and windows with version specs that cannot be '
+                        'satisfied together (<1.11, >=1.11). Please check these cells: B3, B5']
+
+def test_check_solved(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(HEADER + 'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+                                 'scipy\t=1.11=py311*\tconda\tconda-forge\ttrue\tpython\t\n'
+                                 'pandas\t\tconda\tconda-forge\ttrue\tpython\t\n'
+                                 'requests\t\tpip\t\ttrue\tpython\t\n')
+    table = validate(str(tsv_path)).table
+
+    mismatches = check_solved(table,'linux',{'numpy':('1.20.3','py311_0'),'scipy':('1.11','py312h1_0')})
+    assert [(m.package_name,m.cell) for m in mismatches] == [('numpy','B2'),('scipy','B3'),('pandas','B4')]
+
+    assert check_solved(table,'linux',{'numpy':('1.26.0','py311_0'),'scipy':('1.11','py311h1_0'),
+                                       'pandas':('2.1.0','py311_0')}) == []
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Test merging several small .tsv files
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+
+import pytest
+from tcy.merge import (resolve_catalogs, order_by_precedence, merge_catalogs, get_merged_path,
+                       MergeConflictError, MergeConflictWarning)
+from tcy.tcy import run
+from tcy.validation import TsvValidationError
+
+HEADER = 'package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+
+BASE = (HEADER +
+        'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+        'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+        'scipy\t\tconda\tconda-forge\ttrue\tpython\t\n'
+        'requests\t\tpip\t\ttrue\tpython\t\n')
+
+NEURO = (HEADER +
+         'numpy\t<1.20\tconda\tconda-forge\ttrue\tpython\t\n'
+         'nilearn\t\tpip\t\ttrue\tpython\t\n'
+         'scipy\t>=1.11\tconda\tbioconda\ttrue\tpython\t\n')
+
+# same packages as NEURO, but compatible with BASE and with the columns in another order
+ML = ('package_name\tpackage_manager\tversion\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+      'numpy\tconda\t<2\tconda-forge\ttrue\tpython\t\n'
+      'scikit-learn\tpip\t\t\ttrue\tpython\t\n')
+
+@pytest.fixture
+def catalogs(tmp_path):
+    '''Returns the directory with base.tsv and teams/neuro.tsv'''
+
+    (tmp_path / 'teams').mkdir()
+    (tmp_path / 'base.tsv').write_text(BASE)
+    (tmp_path / 'teams' / 'neuro.tsv').write_text(NEURO)
+    (tmp_path / 'teams' / '.hidden.tsv').write_text('not a catalog\n')
+    return tmp_path
+
+def read_rows(path):
+    with open(path) as f:
+        return [line.rstrip('\n').split('\t') for line in f]
+
+def test_resolve_catalogs(catalogs):
+    base,teams = str(catalogs / 'base.tsv'),str(catalogs / 'teams')
+    neuro = os.path.join(teams,'neuro.tsv')
+
+    assert resolve_catalogs([base,teams]) == [base,neuro]
+    assert resolve_catalogs([str(catalogs / '*' / '*.tsv'),neuro,base]) == [neuro,base]
+
+    (catalogs / 'empty').mkdir()
+    with pytest.raises(ValueError):
+        resolve_catalogs([str(catalogs / 'empty')])
+
+def test_order_by_precedence():
+    paths = ['base.tsv','teams/neuro.tsv','teams/ml.tsv']
+
+    assert order_by_precedence(paths) == ['teams/ml.tsv','teams/neuro.tsv','base.tsv']
+    assert order_by_precedence(paths,'base,neuro') == ['base.tsv','teams/neuro.tsv','teams/ml.tsv']
+    assert order_by_precedence(paths,['teams/neuro.tsv']) == ['teams/neuro.tsv','teams/ml.tsv','base.tsv']
+
+    with pytest.raises(ValueError):
+        order_by_precedence(paths,'physics')
+
+def test_merge(catalogs):
+    '''Packages are taken from the input with the highest precedence, all
+    differences to other inputs are reported with their cells'''
+
+    base,neuro = str(catalogs / 'base.tsv'),str(catalogs / 'teams' / 'neuro.tsv')
+    output_path = str(catalogs / 'merged.tsv')
+
+    result = merge_catalogs([base,neuro],output_path,buffer_rows=2,tmp_dir=str(catalogs))
+
+    assert result.paths == [neuro,base] and result.n_rows == 5
+    assert read_rows(output_path) == [HEADER.rstrip('\n').split('\t'),
+                                      ['nilearn','','pip','','true','python',''],
+                                      ['numpy','<1.20','conda','conda-forge','true','python',''],
+                                      ['python','','conda','conda-forge','true','python',''],
+                                      ['requests','','pip','','true','python',''],
+                                      ['scipy','>=1.11','conda','bioconda','true','python','']]
+
+    assert [(c.package_name,c.column,c.value,c.other_value,c.location,c.other_location) for c in result.conflicts] == [
+        ('numpy','version','<1.20','>=1.21',f"{neuro}:B2",f"{base}:B3"),
+        ('scipy','conda_channel','bioconda','conda-forge',f"{neuro}:D4",f"{base}:D4")]
+
+    # the base catalog wins if it is listed first in precedence
+    result = merge_catalogs([base,neuro],output_path,precedence='base')
+    assert ['scipy','','conda','conda-forge','true','python',''] in read_rows(output_path)
+    assert [c.package_name for c in result.conflicts] == ['numpy','scipy']
+
+def test_compatible_inputs(catalogs):
+    '''Compatible version specs do not conflict, columns may be in another order'''
+
+    (catalogs / 'teams' / 'neuro.tsv').write_text(ML)
+    output_path = str(catalogs / 'merged.tsv')
+
+    result = merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'teams')],output_path,strict=True)
+
+    # the merged file has the columns of the input with the highest precedence
+    rows = read_rows(output_path)
+    assert result.conflicts == []
+    assert rows[0] == ML.split('\n')[0].split('\t')
+    assert rows[1:3] == [['numpy','conda','<2','conda-forge','true','python',''],
+                         ['python','conda','','conda-forge','true','python','']]
+
+    # an unchanged merged file is not replaced
+    os.utime(output_path,ns=(0,0))
+    merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'teams')],output_path)
+    assert os.stat(output_path).st_mtime_ns == 0
+
+def test_strict(catalogs):
+    '''Nothing is written if the inputs conflict in strict mode'''
+
+    output_path = str(catalogs / 'merged.tsv')
+
+    with pytest.raises(MergeConflictError) as e:
+        merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'teams')],output_path,strict=True)
+
+    assert len(e.value.conflicts) == 2
+    assert not os.path.exists(output_path)
+
+def test_invalid_inputs(catalogs):
+    output_path = str(catalogs / 'merged.tsv')
+
+    (catalogs / 'teams' / 'neuro.tsv').write_text(NEURO + 'nibabel\t\tpip\t\tmaybe\tpython\t\n')
+    with pytest.raises(TsvValidationError):
+        merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'teams')],output_path)
+
+    (catalogs / 'teams' / 'neuro.tsv').write_text('package_name\tversion\tpackage_manager\tconda_channel\t'
+                                                  'include\tlanguage\tbug_flag\textra\n')
+    with pytest.raises(ValueError,match='does not have the same columns'):
+        merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'teams')],output_path)
+
+    with pytest.raises(TsvValidationError):
+        merge_catalogs([str(catalogs / 'base.tsv'),str(catalogs / 'missing.tsv')],output_path)
+
+    assert not os.path.exists(output_path)
+
+def test_run(catalogs):
+    '''run() merges lists of inputs next to the .yml file and warns about conflicts'''
+
+    tsv_path = [str(catalogs / 'base.tsv'),str(catalogs / 'teams')]
+    yml_dir = str(catalogs)
+
+    with pytest.warns(MergeConflictWarning) as warnings:
+        run('linux',tsv_path=tsv_path,yml_dir=yml_dir)
+    assert len(warnings) == 2
+
+    with open(catalogs / 'environment.yml') as f:
+        assert '- numpy<1.20\n' in f.read()
+    assert os.path.isfile(get_merged_path(os.path.join(yml_dir,'environment.yml')))
+
+    with pytest.raises(MergeConflictError):
+        run('linux',tsv_path=tsv_path,yml_dir=yml_dir,precedence='base',strict_merge=True)
+
+    with pytest.warns(MergeConflictWarning):
+        run('linux',tsv_path=tsv_path,yml_dir=yml_dir,precedence='base')
+    with open(catalogs / 'environment.yml') as f:
+        assert '- numpy>=1.21\n' in f.read()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Test the CRAN installation scripts and writing files atomically
+
+Notes:
+
+- All files (including small inline .tsv files) are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import stat
+
+import pytest
+from tcy.render import (atomic_open, write_atomic, render_cran_installation_script,
+                        render_parallel_cran_installation_script)
+from tcy.tcy import run, get_cran_options
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n'
+       'lme4\t\tcran\t\ttrue\tr\t\n'
+       'brms\t\tcran\t\ttrue\tr\twindows\n'
+       'rpy2\t\tcran\t\ttrue\tpython\t\n'
+       'afex\t\tcran\t\tfalse\tr\t\n')
+
+ACTIVATE = ('#!/bin/bash\n'
+            'CONDA_BASE=$(conda info --base) && source $CONDA_BASE/etc/profile.d/conda.sh\n'
+            "conda activate env && Rscript -e 'source(file(\"stdin\"))' <<'EOF'\n")
+
+def test_atomic_open(tmp_path):
+    path = tmp_path / 'environment.yml'
+
+    with atomic_open(str(path)) as f:
+        f.write('name: env\n')
+        # path is only replaced when the with-block finishes
+        assert not path.exists()
+
+    assert path.read_text() == 'name: env\n'
+    assert os.listdir(tmp_path) == ['environment.yml']
+
+    with atomic_open(str(path),binary=True) as f:
+        f.write(b'name: other\n')
+    assert path.read_text() == 'name: other\n'
+
+def test_exception(tmp_path):
+    '''An error inside the with-block keeps the original file and removes the
+    temporary file'''
+
+    path = tmp_path / 'environment.yml'
+    path.write_text('name: env\n')
+
+    with pytest.raises(RuntimeError):
+        with atomic_open(str(path)) as f:
+            f.write('name: broken\n')
+            raise RuntimeError
+
+    assert path.read_text() == 'name: env\n'
+    assert os.listdir(tmp_path) == ['environment.yml']
+
+    # also for a file that did not exist before
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_open(str(tmp_path / 'requirements.txt')) as f:
+            raise KeyboardInterrupt
+    assert os.listdir(tmp_path) == ['environment.yml']
+
+def test_keep_unchanged(tmp_path):
+    path = tmp_path / 'environment.yml'
+    write_atomic(str(path),'name: env\n')
+    os.utime(path,ns=(0,0))
+
+    write_atomic(str(path),'name: env\n',keep_unchanged=True)
+    assert os.stat(path).st_mtime_ns == 0
+    assert os.listdir(tmp_path) == ['environment.yml']
+
+    # without keep_unchanged, the file is always replaced
+    write_atomic(str(path),'name: env\n')
+    assert os.stat(path).st_mtime_ns != 0
+
+    os.utime(path,ns=(0,0))
+    write_atomic(str(path),'name: other\n',keep_unchanged=True)
+    assert os.stat(path).st_mtime_ns != 0 and path.read_text() == 'name: other\n'
+
+@pytest.mark.skipif(os.name == 'nt',reason='permission bits are not supported on windows')
+def test_permissions(tmp_path):
+    '''An existing file keeps its permissions (e.g. an executable script)'''
+
+    path = tmp_path / 'install_cran_packages.sh'
+    path.write_text('#!/bin/bash\n')
+    os.chmod(path,0o750)
+
+    write_atomic(str(path),'#!/bin/bash\necho\n')
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o750
+    assert path.read_text() == '#!/bin/bash\necho\n'
+
+def test_cran_installation_script():
+    '''The script without cran_parallel is the same as before the parallel
+    mode was added'''
+
+    assert render_cran_installation_script('env',['lme4','brms'],'https://cloud.r-project.org') == (
+        '#!/bin/bash\n'
+        'CONDA_BASE=$(conda info --base) && source $CONDA_BASE/etc/profile.d/conda.sh\n'
+        'conda activate env && Rscript -e "install.packages(c(\'lme4\',\'brms\'),repos=\'https://cloud.r-project.org\')"')
+
+def test_parallel_header(tmp_path):
+    script = render_parallel_cran_installation_script('env',['lme4','brms'],'https://cloud.r-project.org')
+    assert script.startswith(ACTIVATE +
+                             "packages <- c(\n  'lme4',\n  'brms')\n"
+                             "repos <- c(CRAN='https://cloud.r-project.org')\n"
+                             'ncpus <- max(1L,parallel::detectCores(),na.rm=TRUE)\n'
+                             'by_level <- FALSE\n')
+    assert script.endswith('\nEOF\n')
+
+    # the local repository comes first, paths are converted to file:// URLs
+    script = render_parallel_cran_installation_script('env',['lme4'],'https://cran.example.org',ncpus=4,
+                                                      dependency_levels=True,local_repo=str(tmp_path / 'cache'))
+    local_url = 'file://' + os.path.abspath(str(tmp_path / 'cache')).replace(os.sep,'/')
+    assert script.startswith(ACTIVATE +
+                             "packages <- c(\n  'lme4')\n"
+                             f"repos <- c(LOCAL='{local_url}',CRAN='https://cran.example.org')\n"
+                             'ncpus <- 4L\n'
+                             'by_level <- TRUE\n')
+
+    script = render_parallel_cran_installation_script('env',['lme4'],'https://cloud.r-project.org',
+                                                      local_repo='https://cache.example.org/cran')
+    assert "repos <- c(LOCAL='https://cache.example.org/cran',CRAN='https://cloud.r-project.org')\n" in script
+
+    # render_cran_installation_script passes all options on
+    assert render_cran_installation_script('env',['lme4'],'https://cran.example.org',True,4,True,
+                                           str(tmp_path / 'cache')) == \
+           render_parallel_cran_installation_script('env',['lme4'],'https://cran.example.org',4,True,
+                                                    str(tmp_path / 'cache'))
+
+def test_cran_options(tmp_path):
+    # the options of the parallel script are ignored without cran_parallel
+    assert get_cran_options(False,0,True,'./cache') == get_cran_options()
+    assert get_cran_options(True,'2',1,'') == {'cran_parallel':True,'cran_ncpus':2,
+                                               'cran_dependency_levels':True,'cran_local_repo':None}
+
+    for cran_ncpus in (0,-1):
+        with pytest.raises(ValueError,match='cran_ncpus must be at least 1'):
+            get_cran_options(True,cran_ncpus)
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    with pytest.raises(ValueError):
+        run('linux','env',tsv_path=str(tsv_path),yml_dir=str(tmp_path),cran_installation_script=True,
+            cran_parallel=True,cran_ncpus=0)
+    assert not os.path.exists(tmp_path / 'install_cran_packages.sh')
+
+def test_run(tmp_path):
+    '''Only selected CRAN-packages of the language r are installed'''
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    script_path = tmp_path / 'install_cran_packages.sh'
+
+    run('windows','env',tsv_path=str(tsv_path),yml_dir=str(tmp_path),cran_installation_script=True)
+    assert script_path.read_text() == render_cran_installation_script('env',['lme4'],'https://cloud.r-project.org')
+
+    run('linux','env',tsv_path=str(tsv_path),yml_dir=str(tmp_path),cran_installation_script=True,
+        cran_parallel=True,cran_ncpus=2)
+    assert "packages <- c(\n  'lme4',\n  'brms')\nrepos" in script_path.read_text()
+    assert 'ncpus <- 2L\n' in script_path.read_text()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Test tcy serve with requests against a local server
+
+Notes:
+
+- Every test starts the server on a free port of 127.0.0.1 and serves a small
+  .tsv file from a temporary directory, so these tests do not need the
+  --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import json
+import asyncio
+
+import pytest
+from tcy.serve import start_server
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'scikit-learn\t\tpip\t\ttrue\tpython\twindows\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n')
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+async def request(port,target,headers=None,method='GET'):
+    '''Returns (status,headers,body) of a single request'''
+
+    reader,writer = await asyncio.open_connection('127.0.0.1',port)
+    lines = [f"{method} {target} HTTP/1.1",'Host: 127.0.0.1','Connection: close',
+             *(f"{name}: {value}" for name,value in (headers or {}).items())]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head,_,body = response.partition(b'\r\n\r\n')
+    status_line,*header_lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ',1) for line in header_lines)
+    return int(status_line.split(' ')[1]),headers,body
+
+def serve(tsv_path,test):
+    '''Run test(service,port) against a running server'''
+
+    async def main():
+        service,server = await start_server(tsv_path,port=0,log=lambda message: None)
+        async with server:
+            await test(service,server.sockets[0].getsockname()[1])
+
+    asyncio.run(main())
+
+def test_environment_yml(tsv_path):
+
+    async def test(service,port):
+        status,headers,body = await request(port,'/environment.yml?os=linux&languages=python&yml_name=env')
+        assert status == 200
+        assert headers['Content-Type'] == 'text/yaml; charset=utf-8'
+        assert body.decode() == ('name: env\n'
+                                 'channels:\n'
+                                 '- conda-forge\n'
+                                 '- defaults\n'
+                                 'dependencies:\n'
+                                 '- python\n'
+                                 '- numpy>=1.21\n'
+                                 '- pip\n'
+                                 '- pip:\n'
+                                 '  - scikit-learn\n')
+
+        status,_,body = await request(port,'/requirements.txt?os=windows')
+        assert status == 200 and body == b''
+
+        status,_,body = await request(port,'/spec.json?os=linux&languages=r')
+        assert status == 200 and json.loads(body)['conda_packages'][0]['package_name'] == 'r-base'
+
+    serve(tsv_path,test)
+
+def test_not_modified(tsv_path):
+    '''Requests with a matching ETag get 304 without a body. Equal options
+    are rendered only once'''
+
+    async def test(service,port):
+        status,headers,body = await request(port,'/environment.yml?os=linux')
+        etag = headers['ETag']
+
+        status,headers,body = await request(port,'/environment.yml?operating_system=linux',{'If-None-Match':etag})
+        assert status == 304 and body == b'' and headers['ETag'] == etag
+
+        status,_,_ = await request(port,'/environment.yml?os=linux',{'If-None-Match':f'W/{etag}, "other"'})
+        assert status == 304
+
+        status,_,body = await request(port,'/environment.yml?os=linux',{'If-None-Match':'"other"'})
+        assert status == 200 and body
+
+        assert service.misses == 1 and service.hits == 3
+
+    serve(tsv_path,test)
+
+def test_errors(tsv_path):
+
+    async def test(service,port):
+        assert (await request(port,'/environment.yml'))[0] == 400
+        assert (await request(port,'/environment.yml?os=linux&foo=1'))[0] == 400
+        assert (await request(port,'/environment.yml?os=linux&write_conda_channels=maybe'))[0] == 400
+        assert (await request(port,'/unknown?os=linux'))[0] == 404
+        assert (await request(port,'/environment.yml?os=linux',method='POST'))[0] == 405
+
+    serve(tsv_path,test)
+
+def test_reload(tsv_path):
+    '''A changed file is loaded before the next request, an invalid file is
+    ignored and the last valid catalog is served'''
+
+    async def test(service,port):
+        status,headers,body = await request(port,'/requirements.txt?os=linux')
+        assert body == b'scikit-learn\n'
+        sha256 = headers['X-Tcy-Catalog-Sha256']
+
+        with open(tsv_path,'a') as f:
+            f.write('nilearn\t\tpip\t\ttrue\tpython\t\n')
+
+        status,headers,body = await request(port,'/requirements.txt?os=linux')
+        assert body == b'scikit-learn\nnilearn\n'
+        assert headers['X-Tcy-Catalog-Sha256'] == service.catalog_sha256 != sha256
+        sha256 = service.catalog_sha256
+
+        with open(tsv_path,'a') as f:
+            f.write('nibabel\t\tpip\t\tmaybe\tpython\t\n')
+
+        status,headers,body = await request(port,'/requirements.txt?os=linux')
+        assert status == 200 and body == b'scikit-learn\nnilearn\n'
+        assert headers['X-Tcy-Catalog-Sha256'] == sha256
+
+    serve(tsv_path,test)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Test tcy solve against a tiny local channel
+
+Notes:
+
+- The channels are written to a temporary directory by the tests, so these
+  tests do not need a packages.tsv file (or the --tsv_path option).
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+
+import pytest
+from tcy.repodata import RepodataIndex
+from tcy.solve import Solver, SolveError, run_solve, sort_records
+
+def package(name,version,build='0',depends=(),constrains=(),build_number=0):
+    '''Returns (file name,record) of a package for a repodata.json file'''
+
+    return (f"{name}-{version}-{build}.tar.bz2",
+            {'name':name,'version':version,'build':build,'build_number':build_number,
+             'depends':list(depends),'constrains':list(constrains),'md5':f"md5-{name}-{version}"})
+
+CONDA_FORGE = {'linux-64':[package('python','3.11.0','h1_0'),
+                           package('python','3.12.0','h1_0',depends=['__glibc >=2.17']),
+                           package('numpy','1.26.0','py311_0',depends=['python >=3.11,<3.12']),
+                           package('numpy','2.0.0','py312_0',depends=['python >=3.12,<3.13']),
+                           package('scipy','1.11.0','py311_0',depends=['python >=3.11,<3.12','numpy <2'])],
+               'noarch':[package('pip','24.0','pyhd8ed1ab_0',depends=['python >=3.8'])]}
+
+OTHER = {'linux-64':[package('numpy','3.0.0','py312_0',depends=['python >=3.12,<3.13'])]}
+
+def write_channel(channel_dir,subdirs):
+    '''Write one repodata.json file per subdir'''
+
+    for subdir,packages in subdirs.items():
+        os.makedirs(os.path.join(channel_dir,subdir))
+        with open(os.path.join(channel_dir,subdir,'repodata.json'),'w') as f:
+            json.dump({'info':{'subdir':subdir},'packages':dict(packages)},f)
+
+@pytest.fixture
+def channels(tmp_path):
+    '''Returns {channel: directory} of two local channels'''
+
+    channels = {'conda-forge':str(tmp_path / 'conda-forge'),'other':str(tmp_path / 'other')}
+    write_channel(channels['conda-forge'],CONDA_FORGE)
+    write_channel(channels['other'],OTHER)
+    return channels
+
+@pytest.fixture
+def index(tmp_path,channels):
+    with RepodataIndex(str(tmp_path / 'index.sqlite')) as index:
+        for channel,channel_dir in channels.items():
+            index.add_channel(channel,channel_dir,['linux-64','noarch'])
+        yield index
+
+def solve(index,specs,channels=('conda-forge','other'),virtual_packages={'__glibc':'2.35'}):
+    '''Returns {name: version} of a solution'''
+
+    solution = Solver(index,channels,virtual_packages).solve(specs)
+    return {name:record.version for name,record in solution.items()}
+
+def test_newest_version(index):
+    assert solve(index,['numpy']) == {'numpy':'2.0.0','python':'3.12.0'}
+
+def test_backtracking(index):
+    '''numpy 2.0.0 needs python 3.12, so the solver has to go back to numpy 1.26'''
+
+    assert solve(index,['numpy','python 3.11.*']) == {'numpy':'1.26.0','python':'3.11.0'}
+    assert solve(index,['scipy','numpy']) == {'scipy':'1.11.0','numpy':'1.26.0','python':'3.11.0'}
+
+def test_virtual_packages(index):
+    '''python 3.12 needs __glibc, which is missing without virtual packages'''
+
+    assert solve(index,['python'],virtual_packages=None) == {'python':'3.11.0'}
+    assert solve(index,['python'],virtual_packages={'__glibc':'2.12'}) == {'python':'3.11.0'}
+
+def test_strict_channel_priority(index):
+    '''numpy 3.0.0 of the other channel is only used if it is asked for'''
+
+    assert solve(index,['numpy'])['numpy'] == '2.0.0'
+    assert solve(index,['other::numpy'])['numpy'] == '3.0.0'
+    assert solve(index,['numpy'],channels=('other','conda-forge'))['numpy'] == '3.0.0'
+
+def test_unsatisfiable(index):
+    with pytest.raises(SolveError,match='there is no solution'):
+        solve(index,['numpy>=2','python<3.12'])
+
+    with pytest.raises(SolveError,match='not found'):
+        solve(index,['pandas'])
+
+def test_sort_records(index):
+    '''Dependencies come first'''
+
+    solution = Solver(index,['conda-forge'],{'__glibc':'2.35'}).solve(['scipy','pip'])
+    assert [record.name for record in sort_records(solution)] == ['python','numpy','pip','scipy']
+
+def test_run_solve(tmp_path,channels):
+    '''Only the conda packages of the operating system are solved, pip is
+    added because there are pip packages'''
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+                        'numpy\t<2\tconda\tconda-forge\ttrue\tpython\t\n'
+                        'scipy\t\tconda\tconda-forge\ttrue\tpython\tlinux\n'
+                        'requests\t\tpip\t\ttrue\tpython\t\n'
+                        'pandas\t\tconda\tconda-forge\tfalse\tpython\t\n')
+    output_path = tmp_path / 'environment_solved.txt'
+
+    records = run_solve('linux',channels,tsv_path=str(tsv_path),output_path=str(output_path),
+                        index_path=str(tmp_path / 'index.sqlite'),channel_alias='https://conda.anaconda.org')
+
+    assert [(record.name,record.version) for record in records] == [('python','3.11.0'),('numpy','1.26.0'),('pip','24.0')]
+
+    lines = output_path.read_text().splitlines()
+    assert lines[2:] == ['# platform: linux-64',
+                         '@EXPLICIT',
+                         'https://conda.anaconda.org/conda-forge/linux-64/python-3.11.0-h1_0.tar.bz2#md5-python-3.11.0',
+                         'https://conda.anaconda.org/conda-forge/linux-64/numpy-1.26.0-py311_0.tar.bz2#md5-numpy-1.26.0',
+                         'https://conda.anaconda.org/conda-forge/noarch/pip-24.0-pyhd8ed1ab_0.tar.bz2#md5-pip-24.0']
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the EnvironmentSpec of tcy.build renders the same files as run()
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+
+@author: Johannes.Wiesner
+"""
+
+import io
+import os
+
+import pytest
+from tcy import build, run
+from tcy.validation import validate
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'mne\t\tconda\tbioconda\ttrue\tpython\twindows\n'
+       'requests\t\tpip\t\ttrue\tpython\t\n'
+       'nilearn\t\tpip\t\ttrue\tpython\tlinux\n'
+       'r-base\t\tconda\tconda-forge\ttrue\tr\t\n'
+       'lme4\t\tcran\t\ttrue\tr\t\n'
+       'brms\t\tcran\t\tfalse\tr\t\n')
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+@pytest.mark.parametrize('kwargs',[{'operating_system':'linux'},
+                                   {'operating_system':'windows','yml_name':'env','write_conda_channels':True},
+                                   {'operating_system':'linux','yml_name':'env','languages':['python'],
+                                    'pip_requirements_file':True},
+                                   {'operating_system':'windows','yml_name':'env','languages':'r',
+                                    'cran_installation_script':True},
+                                   {'operating_system':'linux','yml_name':'env','cran_installation_script':True,
+                                    'cran_parallel':True,'cran_ncpus':2,'cran_dependency_levels':True,
+                                    'cran_mirror':'https://cran.example.org'}])
+def test_same_files_as_run(tsv_path,tmp_path,kwargs):
+    yml_dir = str(tmp_path / 'out')
+    os.mkdir(yml_dir)
+    run(tsv_path=tsv_path,yml_dir=yml_dir,**kwargs)
+
+    spec = build(kwargs['operating_system'],kwargs.get('yml_name'),kwargs.get('languages','all'),tsv_path)
+    pip_requirements_file = kwargs.get('pip_requirements_file',False)
+
+    assert spec.to_yml(kwargs.get('write_conda_channels',False),pip_requirements_file) == \
+           read(os.path.join(yml_dir,'environment.yml'))
+
+    requirements_path = os.path.join(yml_dir,'requirements.txt')
+    assert os.path.isfile(requirements_path) == pip_requirements_file
+    if pip_requirements_file:
+        assert spec.to_requirements() == read(requirements_path)
+
+    cran_installation_script_path = os.path.join(yml_dir,'install_cran_packages.sh')
+    assert os.path.isfile(cran_installation_script_path) == kwargs.get('cran_installation_script',False)
+    if kwargs.get('cran_installation_script'):
+        assert spec.to_cran_script(kwargs.get('cran_mirror','https://cloud.r-project.org'),
+                                   kwargs.get('cran_parallel',False),kwargs.get('cran_ncpus'),
+                                   kwargs.get('cran_dependency_levels',False)) == read(cran_installation_script_path)
+
+def test_streams(tsv_path):
+    '''The write_* methods write the same content to text and binary streams'''
+
+    spec = build('linux','env',tsv_path=tsv_path)
+
+    text,binary = io.StringIO(),io.BytesIO()
+    spec.write_yml(text,write_conda_channels=True)
+    spec.write_cran_script(binary)
+    assert text.getvalue() == spec.to_yml(write_conda_channels=True)
+    assert binary.getvalue() == spec.to_cran_script().encode('utf-8')
+
+def test_build(tsv_path):
+    spec = build('linux',tsv_path=tsv_path)
+
+    # sorted by language and channel, otherwise in the order of the file
+    assert spec.channels == ['conda-forge','bioconda']
+    assert spec.conda_packages == [('mne',None,'bioconda'),('python',None,'conda-forge'),
+                                   ('numpy','>=1.21','conda-forge'),('r-base',None,'conda-forge')]
+    assert spec.pip_packages == ['requests'] and spec.cran_packages == ['lme4']
+
+    # a validated table (or catalog) can be passed instead of the path
+    assert build('linux',catalog=validate(tsv_path).table) == spec
+
+    with pytest.raises(TypeError):
+        spec.to_cran_script()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Test the external merge sort and the files of the streaming engine
+
+Notes:
+
+- The .tsv files are written to a temporary directory by the tests, so these
+  tests do not need the --tsv_path option.
+- A tiny sort buffer (buffer_rows=2) spills many run files, so more runs than
+  MAX_FANOUT have to be merged in several passes.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+
+import pytest
+from tcy.streaming import ExternalSorter, write_environment_files, MAX_FANOUT
+from tcy.tcy import write_environment_files as write_environment_files_csv
+from tcy.validation import validate
+
+HEADER = 'package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+
+# (package_manager, conda_channel, language, bug_flag) of the generated rows
+KINDS = [('conda','conda-forge','python',None),
+         ('conda','bioconda','python','windows'),
+         ('pip',None,'python',None),
+         ('conda','conda-forge','r',None),
+         ('cran',None,'r','linux'),
+         ('conda','r','r','cross-platform'),
+         ('conda','conda-forge','julia',None)]
+
+def get_tsv(n_rows):
+    '''Returns a valid .tsv file with n_rows rows'''
+
+    rows = []
+    for i in range(n_rows):
+        manager,channel,language,bug_flag = KINDS[i % len(KINDS)]
+        version = f">={i % 5}.{i % 3}" if manager == 'conda' and i % 2 else ''
+        rows.append('\t'.join([f"package-{i:04d}",version,manager,channel or '',
+                               'false' if i % 11 == 0 else 'true',language,bug_flag or '']))
+    return HEADER + '\n'.join(rows) + '\n'
+
+def test_external_sorter(tmp_path):
+    '''Records come out in the order of their keys and records with equal
+    keys in the order in which they were added'''
+
+    n_rows = 301
+    sorter = ExternalSorter(buffer_rows=2,tmp_dir=str(tmp_path))
+    for i in range(n_rows):
+        sorter.add((i % 7,),i)
+
+    assert len(sorter) == n_rows and len(sorter.runs) > MAX_FANOUT
+    assert list(sorter) == sorted(range(n_rows),key=lambda i: i % 7)
+    sorter.close()
+
+def test_empty_sorter():
+    sorter = ExternalSorter(buffer_rows=2)
+    assert list(sorter) == []
+
+def read_files(yml_dir):
+    files = {}
+    for name in sorted(os.listdir(yml_dir)):
+        with open(os.path.join(yml_dir,name)) as f:
+            files[name] = f.read()
+    return files
+
+@pytest.mark.parametrize('kwargs',[{'operating_system':'linux'},
+                                   {'operating_system':'windows','write_conda_channels':True,
+                                    'pip_requirements_file':True},
+                                   {'operating_system':'windows','yml_name':'env','languages':['r'],
+                                    'cran_installation_script':True}])
+def test_same_files_as_csv_engine(tmp_path,kwargs):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(get_tsv(400))
+    streaming_dir,csv_dir,tmp_dir = (tmp_path / 'streaming',tmp_path / 'csv',tmp_path / 'tmp')
+    for path in (streaming_dir,csv_dir,tmp_dir):
+        path.mkdir()
+
+    write_environment_files(str(tsv_path),yml_dir=str(streaming_dir),buffer_rows=2,tmp_dir=str(tmp_dir),**kwargs)
+    write_environment_files_csv(validate(str(tsv_path)).table,yml_dir=str(csv_dir),**kwargs)
+
+    files = read_files(str(streaming_dir))
+    assert files == read_files(str(csv_dir))
+    assert files['environment.yml'].count('\n') > 50
+    # all run files are removed again
+    assert os.listdir(tmp_dir) == []
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Test that every validation rule fires on a small invalid .tsv file
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+- Each invalid .tsv file breaks a single rule, the tests check the reported
+  cells and message.
+
+@author: Johannes.Wiesner
+"""
+
+import pytest
+from tcy.validation import validate, load_test_configs, TsvValidationError
+
+HEADER = 'package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+
+VALID = ('python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+         'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+         'requests\t\tpip\t\ttrue\tpython\t\n')
+
+def get_violations(tmp_path,rows,test_configs=None,file_name='packages.tsv'):
+    '''Returns the violations of a .tsv file with the given rows'''
+
+    tsv_path = tmp_path / file_name
+    tsv_path.write_text(HEADER + rows)
+    return validate(str(tsv_path),test_configs).violations
+
+def test_valid(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(HEADER + VALID)
+    report = validate(str(tsv_path))
+
+    assert report.ok and len(report.table) == 3
+    assert str(report) == f"{tsv_path}: no errors found"
+
+def test_file_rules(tmp_path):
+    violations = validate(str(tmp_path / 'missing.tsv')).violations
+    assert [v.rule for v in violations] == ['tsv_path']
+
+    violations = get_violations(tmp_path,VALID,file_name='packages.csv')
+    assert [v.rule for v in violations] == ['tsv']
+
+def test_valid_columns(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text('package_name\tversion\npython\t\n')
+    violations = validate(str(tsv_path)).violations
+
+    # all other rules are skipped
+    assert [v.rule for v in violations] == ['valid_columns']
+
+def test_whitespaces(tmp_path):
+    violations = get_violations(tmp_path,VALID + 'scipy \t\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert [(v.rule,v.cells) for v in violations] == [('whitespaces',['A5'])]
+    assert violations[0].message == 'These cells have either leading or trailing whitespaces: A5'
+
+def test_valid_options(tmp_path):
+    violations = get_violations(tmp_path,VALID + 'scipy\t\tconda\tconda-forge\tmaybe\tpython\t\n')
+
+    assert [(v.rule,v.cells) for v in violations] == [('valid_options',['E5'])]
+    assert violations[0].message == ("The column 'include' must only contain the following values: "
+                                     "['true', 'false'] but it contains these values ['true', 'maybe']. "
+                                     "Please check these cells: E5")
+
+def test_filled_out_columns(tmp_path):
+    violations = get_violations(tmp_path,VALID + 'scipy\t\tconda\tconda-forge\t\tpython\t\n')
+
+    # an empty cell is also not a valid option ('nan' is not allowed for include)
+    assert [(v.rule,v.cells) for v in violations] == [('filled_out_columns',['E5']),('valid_options',['E5'])]
+    assert violations[0].message == 'These cells must not contain NaNs, i.e. be filled out: E5'
+
+def test_multi_option_columns(tmp_path):
+    test_configs = {**load_test_configs(),'multi_option_columns':{'bug_flag':['linux','windows']}}
+    violations = get_violations(tmp_path,VALID + 'scipy\t\tconda\tconda-forge\ttrue\tpython\tlinux, windows\n'
+                                                 'pandas\t\tconda\tconda-forge\ttrue\tpython\tlinux,macos\n',
+                                test_configs={**test_configs,'valid_options':None})
+
+    assert [(v.rule,v.cells) for v in violations] == [('multi_option_columns',['G6'])]
+    assert violations[0].message == ('Cells in the bug_flag column must only contain these values: '
+                                     'linux, windows. Please check these cells: G6')
+
+def test_column_dependencies(tmp_path):
+    test_configs = {**load_test_configs(),'column_dependencies':{'version':['conda_channel']}}
+    violations = get_violations(tmp_path,VALID + 'scikit-learn\t>=1.3\tpip\t\ttrue\tpython\t\n',test_configs)
+
+    assert [(v.rule,v.cells) for v in violations] == [('column_dependencies',['D5'])]
+    assert violations[0].message == ('The following cells must be filled out because you '
+                                     'filled out a cell in version: D5')
+
+def test_conditional_column_dependencies(tmp_path):
+    test_configs = {**load_test_configs(),'conditional_column_dependencies':{'package_manager':{'conda':['conda_channel']}}}
+    violations = get_violations(tmp_path,VALID + 'scipy\t\tconda\t\ttrue\tpython\t\n',test_configs)
+
+    assert [(v.rule,v.cells) for v in violations] == [('conditional_column_dependencies',['D5'])]
+    assert violations[0].message == ('The following cells must be filled out because corresponding cells '
+                                     'in package_manager are set to conda: D5')
+
+def test_match_specs(tmp_path):
+    violations = get_violations(tmp_path,VALID + 'scipy\t>=1.11(\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert [(v.rule,v.cells) for v in violations] == [('match_spec_columns',['B5'])]
+    assert violations[0].message == ('Cells of conda packages in the version column must be valid conda '
+                                     'version specs (e.g. >=1.21, 1.21.* or =1.21=py311*). '
+                                     'Please check these cells: B5')
+
+def test_conflicting_duplicates(tmp_path):
+    violations = get_violations(tmp_path,VALID + 'numpy\t<1.20\tconda\tconda-forge\ttrue\tpython\tlinux\n')
+
+    assert [(v.rule,v.cells) for v in violations] == [('conflicting_duplicates',['B3','B5'])]
+    assert violations[0].message == ('numpy is listed more than once for windows with version specs that cannot '
+                                     'be satisfied together (>=1.21, <1.20). Please check these cells: B3, B5')
+
+def test_report(tmp_path):
+    '''All violations are collected in a single report'''
+
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(HEADER + VALID + 'scipy \t\tconda\tconda-forge\tmaybe\tpython\t\n')
+    report = validate(str(tsv_path))
+
+    assert not report.ok
+    assert [v['rule'] for v in report.to_dict()['violations']] == ['whitespaces','valid_options']
+    assert str(report).splitlines()[0] == f"{tsv_path}: found 2 error(s)"
+
+    with pytest.raises(ValueError) as e:
+        raise TsvValidationError(report)
+    assert e.value.report is report
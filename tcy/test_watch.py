@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Test updating the environment files of tcy watch after a save of the .tsv file
+
+Notes:
+
+- The .tsv files are small inline strings that are written to a temporary
+  directory, so these tests do not need the --tsv_path option.
+- Watcher.update() is called directly after every save, so neither inotify
+  nor polling is needed.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+
+import pytest
+from tcy import watch
+from tcy.tcy import run
+from tcy.watch import Watcher
+
+TSV = ('package_name\tversion\tpackage_manager\tconda_channel\tinclude\tlanguage\tbug_flag\n'
+       'python\t\tconda\tconda-forge\ttrue\tpython\t\n'
+       'numpy\t>=1.21\tconda\tconda-forge\ttrue\tpython\t\n'
+       'requests\t\tpip\t\ttrue\tpython\t\n'
+       'lme4\t\tcran\t\ttrue\tr\t\n')
+
+@pytest.fixture
+def tsv_path(tmp_path):
+    tsv_path = tmp_path / 'packages.tsv'
+    tsv_path.write_text(TSV)
+    return str(tsv_path)
+
+@pytest.fixture
+def messages():
+    '''All messages that the watcher logged'''
+
+    return []
+
+@pytest.fixture
+def watcher(tsv_path,tmp_path,messages):
+    yml_dir = tmp_path / 'out'
+    yml_dir.mkdir()
+    targets = [{'operating_system':'linux','yml_name':'ubuntu','yml_file_name':'ubuntu.yml','yml_dir':str(yml_dir),
+                'cran_installation_script':True},
+               {'operating_system':'windows','yml_file_name':'windows.yml','yml_dir':str(yml_dir),
+                'languages':['python']}]
+    return Watcher(tsv_path,targets,log=messages.append)
+
+def read_files(yml_dir):
+    files = {}
+    for name in sorted(os.listdir(yml_dir)):
+        if not name.startswith('.'):
+            with open(os.path.join(yml_dir,name)) as f:
+                files[name] = f.read()
+    return files
+
+def run_targets(watcher,tmp_path):
+    '''Returns the files that run() writes for the targets of the watcher'''
+
+    yml_dir = tmp_path / 'run'
+    yml_dir.mkdir(exist_ok=True)
+    for target in watcher.targets:
+        run(tsv_path=watcher.tsv_path,**{**target,'yml_dir':str(yml_dir)},force=True)
+    return read_files(str(yml_dir))
+
+def get_mtimes(yml_dir):
+    return {name:os.stat(os.path.join(yml_dir,name)).st_mtime_ns for name in os.listdir(yml_dir)}
+
+def test_first_update(watcher,tmp_path):
+    written_paths = watcher.update()
+
+    assert sorted(os.path.basename(path) for path in written_paths) == ['install_cran_packages.sh','ubuntu.yml',
+                                                                       'windows.yml']
+    assert read_files(str(tmp_path / 'out')) == run_targets(watcher,tmp_path)
+
+def test_valid_edit(watcher,tsv_path,tmp_path,messages):
+    '''Only files whose content changed are rewritten'''
+
+    watcher.update()
+    with open(tsv_path,'a') as f:
+        f.write('r-ggplot2\t\tconda\tconda-forge\ttrue\tr\t\n')
+
+    written_paths = watcher.update()
+
+    assert [os.path.basename(path) for path in written_paths] == ['ubuntu.yml']
+    assert read_files(str(tmp_path / 'out')) == run_targets(watcher,tmp_path)
+    assert len(watcher.table) == 5
+    assert 'wrote' in messages[-1]
+
+def test_invalid_edit(watcher,tsv_path,tmp_path,messages):
+    '''The files of the last valid save are kept and the violation is logged'''
+
+    watcher.update()
+    yml_dir = str(tmp_path / 'out')
+    files,mtimes = read_files(yml_dir),get_mtimes(yml_dir)
+
+    with open(tsv_path,'a') as f:
+        f.write('scipy \t\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert watcher.update() == []
+    assert read_files(yml_dir) == files and get_mtimes(yml_dir) == mtimes
+    assert 'These cells have either leading or trailing whitespaces: A6' in messages[-1]
+    assert len(watcher.table) == 4
+
+    # the files are updated as soon as the error is fixed
+    with open(tsv_path,'w') as f:
+        f.write(TSV + 'scipy\t\tconda\tconda-forge\ttrue\tpython\t\n')
+
+    assert sorted(os.path.basename(path) for path in watcher.update()) == ['ubuntu.yml','windows.yml']
+    assert read_files(yml_dir) == run_targets(watcher,tmp_path)
+
+def test_unchanged_save(watcher,tsv_path,tmp_path,messages,monkeypatch):
+    '''A save without changes does not write anything'''
+
+    watcher.update()
+    yml_dir = str(tmp_path / 'out')
+    mtimes = get_mtimes(yml_dir)
+
+    written = []
+    monkeypatch.setattr(watch,'write_atomic',lambda path,content: written.append(path))
+    with open(tsv_path,'w') as f:
+        f.write(TSV)
+
+    assert watcher.update() == []
+    assert written == [] and get_mtimes(yml_dir) == mtimes
+    assert messages[-1].startswith(f"{tsv_path}: 4 rows, no files changed")
+
+def test_edited_output(watcher,tmp_path):
+    '''An output file that was changed by hand is written again'''
+
+    watcher.update()
+    yml_path = tmp_path / 'out' / 'windows.yml'
+    content = yml_path.read_text()
+    yml_path.write_text(content + '- scipy\n')
+
+    assert watcher.update() == [str(yml_path)]
+    assert yml_path.read_text() == content
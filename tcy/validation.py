@@ -0,0 +1,726 @@
+# -*- coding: utf-8 -*-
+"""
+Validate the integrity of a packages.tsv file against the rules that are
+defined in test_configs.json
+
+Notes:
+
+- The .tsv file is parsed exactly once and every rule is applied as a column
+  operation on that single table (see tcy.table). pandas is not needed.
+- Every rule returns a list of RuleViolation objects. validate() collects them
+  in a ValidationReport that run() (and test_tsv_file.py) can act on.
+- With incremental=True, validate() only checks rows that were added or
+  changed since the last successful validation (see tcy.incremental).
+- The cells of conda packages in match_spec_columns (the version column) are
+  compiled as conda version specs (see tcy.matchspec). Every distinct spec is
+  only compiled once. Packages that are listed more than once and would end
+  up in the same environment must have specs that can be satisfied together,
+  otherwise the solve in CI would fail.
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import json
+import string
+from itertools import groupby
+from operator import itemgetter
+
+from .incremental import get_sidecar_path, get_fingerprint, hash_rows, load_row_hashes, write_row_hashes
+from .matchspec import compile_constraints, are_compatible, parse_constraint
+from .table import Table, read_tsv
+
+# test_configs.json is shipped with the package, so it can always be found
+# no matter from which directory tcy is called
+TEST_CONFIGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'test_configs.json')
+
+# operating systems for which environments are created (see the bug_flag column)
+OPERATING_SYSTEMS = ('linux','windows')
+
+# languages that can be selected ('all' selects every language)
+LANGUAGES = ('python','r','julia','all')
+
+class RuleViolation:
+    '''A single violation of a validation rule
+
+    Parameters
+    ----------
+    rule : str
+        Name of the rule that was violated (e.g. 'whitespaces').
+    message : str
+        Human readable description of the problem.
+    cells : list of str, optional
+        Affected cells in spreadsheet-program style (e.g. A1, Z3, etc.).
+
+    '''
+
+    __slots__ = ('rule','message','cells')
+
+    def __init__(self,rule,message,cells=None):
+        self.rule = rule
+        self.message = message
+        self.cells = cells or []
+
+    def to_dict(self):
+        return {'rule':self.rule,'message':self.message,'cells':self.cells}
+
+    def __repr__(self):
+        return f"RuleViolation(rule={self.rule!r}, message={self.message!r})"
+
+class ValidationReport:
+    '''Collection of all rule violations that were found in a .tsv file'''
+
+    def __init__(self,tsv_path,violations=None,table=None):
+        self.tsv_path = tsv_path
+        self.violations = violations or []
+        self.table = table
+        # digests of all rows (only set by incremental validation, see tcy.incremental)
+        self.row_hashes = None
+
+    @property
+    def ok(self):
+        return len(self.violations) == 0
+
+    def __bool__(self):
+        return self.ok
+
+    def to_dict(self):
+        return {'tsv_path':self.tsv_path,'ok':self.ok,
+                'violations':[v.to_dict() for v in self.violations]}
+
+    def __str__(self):
+        if self.ok:
+            return f"{self.tsv_path}: no errors found"
+        lines = [f"{self.tsv_path}: found {len(self.violations)} error(s)"]
+        lines += [f"[{v.rule}] {v.message}" for v in self.violations]
+        return '\n'.join(lines)
+
+class TsvValidationError(ValueError):
+    '''Raised by run() when the provided .tsv file does not pass validation'''
+
+    def __init__(self,report):
+        self.report = report
+        super().__init__(str(report))
+
+def load_test_configs(path=None):
+    '''Read in the validation rules. If path is None, the test_configs.json
+    file that is shipped with tcy is used'''
+
+    with open(path or TEST_CONFIGS_PATH) as f:
+        return json.load(f)
+
+def build_context(tsv_path,test_configs=None,table=None):
+    '''Returns everything that the rules need in order to run'''
+
+    if test_configs is None:
+        test_configs = load_test_configs()
+
+    if table is None:
+        table = read_tsv(tsv_path)
+
+    # map each column name to the alphabet (needed for get_affected_cells function)
+    excel_mapper = dict(zip(table.columns,string.ascii_uppercase))
+
+    return {**test_configs,'tsv_path':tsv_path,'table':table,'excel_mapper':excel_mapper}
+
+def get_affected_cells(mask,index,excel_mapper):
+    '''Helper function that takes in a dictionary that maps column names to
+    lists of booleans where true values indicate an error for that cell.
+    Returns the column and index name of the concerned cells in
+    spreadsheet-program style (e.g. A1, Z3, etc.) which makes it easier for
+    users to find and correct the affected cells in their spreadsheet program.
+    Cells are returned column by column.'''
+
+    cells = []
+
+    for column,values in mask.items():
+        letter = excel_mapper[column]
+        cells += [f"{letter}{row + 2}" for row,error in zip(index,values) if error]
+
+    return cells
+
+def has_whitespace(value):
+    '''True if a cell has a leading or trailing whitespace'''
+
+    return value is not None and (value.startswith(' ') or value.endswith(' '))
+
+def is_valid_multi_option(value,allowed):
+    '''True if a cell is empty or only contains allowed options separated by
+    comma (and optional whitespaces)'''
+
+    return value is None or allowed.issuperset(value.replace(' ','').split(','))
+
+def whitespace_violation(cells):
+    message = f"These cells have either leading or trailing whitespaces: {', '.join(cells)}"
+    return RuleViolation('whitespaces',message,cells)
+
+def filled_out_violation(cells):
+    message = f"These cells must not contain NaNs, i.e. be filled out: {', '.join(cells)}"
+    return RuleViolation('filled_out_columns',message,cells)
+
+def valid_options_violation(column,options,current_column_values,cells):
+    message = f"The column '{column}' must only contain the following values: "
+    message += f"{options} but it contains these values {current_column_values}. "
+    message += f"Please check these cells: {', '.join(cells)}"
+    return RuleViolation('valid_options',message,cells)
+
+def multi_option_violation(column,options,cells):
+    message = f"Cells in the {column} column must only contain these values: "
+    message += f"{', '.join(options)}. "
+    message += f"Please check these cells: {', '.join(cells)}"
+    return RuleViolation('multi_option_columns',message,cells)
+
+def column_dependency_violation(source_column,cells):
+    message = "The following cells must be filled out because you "
+    message += f"filled out a cell in {source_column}: {', '.join(cells)}"
+    return RuleViolation('column_dependencies',message,cells)
+
+def conditional_dependency_violation(column,condition,cells):
+    message = f"The following cells must be filled out because " \
+              f"corresponding cells in {column} are set to " \
+              f"{condition}: {', '.join(cells)}"
+    return RuleViolation('conditional_column_dependencies',message,cells)
+
+def match_spec_violation(column,cells):
+    message = f"Cells of conda packages in the {column} column must be valid conda "
+    message += "version specs (e.g. >=1.21, 1.21.* or =1.21=py311*). "
+    message += f"Please check these cells: {', '.join(cells)}"
+    return RuleViolation('match_spec_columns',message,cells)
+
+def conflicting_duplicates_violation(package_name,operating_systems,specs,cells):
+    message = f"{package_name} is listed more than once for {' and '.join(operating_systems)} "
+    message += f"with version specs that cannot be satisfied together ({', '.join(specs)}). "
+    message += f"Please check these cells: {', '.join(cells)}"
+    return RuleViolation('conflicting_duplicates',message,cells)
+
+def find_conflicting_duplicates(entries):
+    '''Returns (package_name,operating_systems,rows) of all packages that are
+    listed more than once for an operating system with specs that cannot be
+    satisfied together. entries is a list of (package_name,position,spec,bug_flag)
+    of all included conda packages with a valid spec, rows is a list of
+    (position,spec) of the conflicting entries'''
+
+    packages = {}
+    for entry in entries:
+        packages.setdefault(entry[0],[]).append(entry)
+
+    conflicts = []
+
+    for package_name,package_entries in packages.items():
+
+        if len(package_entries) < 2:
+            continue
+
+        operating_systems = []
+        rows = {}
+
+        for operating_system in OPERATING_SYSTEMS:
+            selected = [(position,spec) for _,position,spec,bug_flag in package_entries
+                        if bug_flag != 'cross-platform' and bug_flag != operating_system]
+            if len(selected) > 1 and not are_compatible(spec for _,spec in selected):
+                operating_systems.append(operating_system)
+                rows.update(selected)
+
+        if operating_systems:
+            conflicts.append((package_name,operating_systems,sorted(rows.items())))
+
+    return conflicts
+
+def check_tsv_path(context):
+    '''Check if the provided path to the .tsv file points to an existing file'''
+
+    if not os.path.isfile(context['tsv_path']):
+        return [RuleViolation('tsv_path','Path to spreadsheet file does not point to an existing file')]
+    return []
+
+def check_tsv(context):
+    '''Check that the provided spreadsheet file is a .tsv file (and not .csv, .xlsx, etc)'''
+
+    if not str(context['tsv_path']).endswith('.tsv'):
+        return [RuleViolation('tsv','Provided spreadsheet file must be a .tsv file')]
+    return []
+
+def check_whitespaces(context):
+    '''Ensure that cells in the .tsv file have neither leading or trailing
+    whitespaces'''
+
+    table = context['table']
+
+    whitespace_mask = {column:[has_whitespace(v) for v in table[column]] for column in table.columns}
+
+    if any(any(values) for values in whitespace_mask.values()):
+        return [whitespace_violation(get_affected_cells(whitespace_mask,table.index,context['excel_mapper']))]
+    return []
+
+def check_valid_columns(context):
+    '''Check that dataframe has all necessary columns'''
+
+    valid_columns = context['valid_columns']
+
+    if valid_columns and not set(valid_columns).issubset(context['table'].columns):
+        message = "The .tsv file must have at least these columns: "
+        message += f"{', '.join(valid_columns)}"
+        return [RuleViolation('valid_columns',message)]
+    return []
+
+def check_filled_out_columns(context):
+    '''Check that certain columns are completely filled out'''
+
+    filled_out_columns = context['filled_out_columns']
+    table = context['table']
+
+    if filled_out_columns:
+
+        nan_mask = {column:[v is None for v in table[column]] for column in filled_out_columns}
+
+        if any(any(values) for values in nan_mask.values()):
+            return [filled_out_violation(get_affected_cells(nan_mask,table.index,context['excel_mapper']))]
+    return []
+
+def check_valid_options(context):
+    '''Some columns in the .tsv file must only contain certain values'''
+
+    valid_options = context['valid_options']
+    table = context['table']
+    violations = []
+
+    if valid_options:
+
+        for column,options in valid_options.items():
+
+            # empty cells are represented as 'nan' so they can be allowed explicitly
+            values = ['nan' if v is None else v for v in table[column]]
+            allowed = set(options)
+            invalid_mask = [v not in allowed for v in values]
+
+            if any(invalid_mask):
+                affected_cells = get_affected_cells({column:invalid_mask},table.index,context['excel_mapper'])
+                violations.append(valid_options_violation(column,options,list(dict.fromkeys(values)),affected_cells))
+
+    return violations
+
+def check_multi_option_columns(context):
+    '''For each specified column check that rows must only contain valid strings
+    separated by comma and optional whitespaces'''
+
+    multi_option_columns = context['multi_option_columns']
+    table = context['table']
+    violations = []
+
+    if multi_option_columns:
+
+        for column,options in multi_option_columns.items():
+
+            # empty cells are skipped. For all other cells remove whitespaces,
+            # split by comma and check against the set of valid options
+            allowed = set(options)
+            mask = [not is_valid_multi_option(v,allowed) for v in table[column]]
+
+            affected_cells = get_affected_cells({column:mask},table.index,context['excel_mapper'])
+
+            if affected_cells:
+                violations.append(multi_option_violation(column,options,affected_cells))
+
+    return violations
+
+def check_column_dependencies(context):
+    '''For each specified column check that all other columns are filled out'''
+
+    column_dependencies = context['column_dependencies']
+    table = context['table']
+    violations = []
+
+    if column_dependencies:
+
+        for source_column,other_columns in column_dependencies.items():
+
+            # only rows where source column is filled out must be checked
+            subset = table.take(i for i,v in enumerate(table[source_column]) if v is not None)
+            nan_mask = {column:[v is None for v in subset[column]] for column in other_columns}
+            affected_cells = get_affected_cells(nan_mask,subset.index,context['excel_mapper'])
+
+            if affected_cells:
+                violations.append(column_dependency_violation(source_column,affected_cells))
+
+    return violations
+
+def check_conditional_column_dependencies(context):
+    '''For each specific column and its condition check that other columns are filled out'''
+
+    conditional_column_dependencies = context['conditional_column_dependencies']
+    table = context['table']
+    violations = []
+
+    if conditional_column_dependencies:
+
+        for column,condition_dict in conditional_column_dependencies.items():
+
+            for condition,other in condition_dict.items():
+
+                # reduce table to condition and check which cells in
+                # other columns are not filled out
+                subset = table.take(i for i,v in enumerate(table[column]) if v == condition)
+                nan_mask = {c:[v is None for v in subset[c]] for c in other}
+                affected_cells = get_affected_cells(nan_mask,subset.index,context['excel_mapper'])
+
+                if affected_cells:
+                    violations.append(conditional_dependency_violation(column,condition,affected_cells))
+
+    return violations
+
+def check_match_specs(context):
+    '''Check that the cells of conda packages in the match spec columns are
+    valid conda version specs'''
+
+    table = context['table']
+    violations = []
+
+    for column in context.get('match_spec_columns') or []:
+
+        # every distinct spec is only compiled once
+        conda_mask = [m == 'conda' for m in table['package_manager']]
+        _,errors = compile_constraints(v for v,is_conda in zip(table[column],conda_mask) if is_conda)
+
+        if errors:
+            mask = [is_conda and v in errors for v,is_conda in zip(table[column],conda_mask)]
+            violations.append(match_spec_violation(column,get_affected_cells({column:mask},table.index,
+                                                                              context['excel_mapper'])))
+
+    return violations
+
+def check_conflicting_duplicates(context):
+    '''Check that conda packages that are listed more than once for the same
+    operating system have version specs that can be satisfied together'''
+
+    # with incremental validation, new rows are compared with all rows
+    table = context.get('full_table',context['table'])
+    violations = []
+
+    for column in context.get('match_spec_columns') or []:
+
+        letter = context['excel_mapper'][column]
+        constraints,_ = compile_constraints(table[column])
+
+        entries = [(n,i,v,b) for n,i,v,m,inc,b in zip(table['package_name'],table.index,table[column],
+                                                         table['package_manager'],table['include'],table['bug_flag'])
+                   if m == 'conda' and v in constraints and inc is not None and inc.lower() == 'true']
+
+        for package_name,operating_systems,rows in find_conflicting_duplicates(entries):
+            cells = [f"{letter}{position + 2}" for position,_ in rows]
+            violations.append(conflicting_duplicates_violation(package_name,operating_systems,
+                                                               [spec for _,spec in rows],cells))
+
+    return violations
+
+# rules that only need the path to the .tsv file
+FILE_RULES = [check_tsv_path,check_tsv]
+
+# rules that need the parsed table. check_valid_columns runs first because
+# the other rules index the table by column name
+TABLE_RULES = [check_valid_columns,
+               check_whitespaces,
+               check_filled_out_columns,
+               check_valid_options,
+               check_multi_option_columns,
+               check_column_dependencies,
+               check_conditional_column_dependencies,
+               check_match_specs,
+               check_conflicting_duplicates]
+
+def validate(tsv_path,test_configs=None,table=None,incremental=False,known_hashes=None):
+    '''Check the .tsv file against all rules from test_configs.json
+
+    Parameters
+    ----------
+    tsv_path : str
+        Path to a packages.tsv file.
+    test_configs : dict, optional
+        Validation rules. If None, the rules are read from the test_configs.json
+        file that is shipped with tcy. The default is None.
+    table : tcy.table.Table, optional
+        An already parsed version of the .tsv file. If None, the file is
+        read from tsv_path. The default is None.
+    incremental : bool, optional
+        If True, rows that already passed the last successful validation (of
+        a file with the same header and the same rules) are not checked
+        again. The row hashes are stored next to the .tsv file. If any
+        violation is found, all rows are checked, so the report is the same
+        as without incremental validation. The default is False.
+    known_hashes : set of bytes, optional
+        Digests of rows that passed an earlier validation (see
+        tcy.incremental.hash_rows), e.g. kept in memory by tcy watch. If
+        given, the validation is incremental, but the sidecar file is neither
+        read nor written. The caller is responsible for dropping the digests
+        when the header or the rules change. The default is None.
+
+    Returns
+    -------
+    report : ValidationReport
+        All found rule violations. The table that was validated is
+        attached as report.table (None if the file could not be read).
+
+    '''
+
+    report = ValidationReport(tsv_path)
+
+    for rule in FILE_RULES:
+        report.violations += rule({'tsv_path':tsv_path})
+
+    if table is None and not os.path.isfile(tsv_path):
+        return report
+
+    if test_configs is None:
+        test_configs = load_test_configs()
+
+    context = build_context(tsv_path,test_configs,table)
+    table = report.table = context['table']
+
+    if not incremental and known_hashes is None:
+        report.violations += check_table(context)
+        return report
+
+    hashes = report.row_hashes = hash_rows(table)
+
+    if known_hashes is None:
+        sidecar_path = get_sidecar_path(tsv_path)
+        fingerprint = get_fingerprint(table.columns,test_configs)
+        known_hashes = load_row_hashes(sidecar_path,fingerprint)
+    else:
+        sidecar_path = None
+
+    # only check rows that did not pass the last validation. Table.take keeps
+    # the original row positions, so affected cells are still correct
+    if known_hashes:
+        context['table'] = table.take(i for i,h in enumerate(hashes) if h not in known_hashes)
+        context['full_table'] = table
+
+    violations = check_table(context)
+
+    # some messages describe whole columns, so errors are always reported for the full table
+    if violations and known_hashes:
+        context['table'] = table
+        violations = check_table(context)
+
+    report.violations += violations
+
+    # rows that were removed from the file do not have to be forgotten, because
+    # they would pass again. The sidecar is only rewritten when rows were checked
+    if report.ok and len(context['table']) and sidecar_path is not None:
+        write_row_hashes(sidecar_path,fingerprint,hashes)
+
+    return report
+
+def check_table(context):
+    '''Apply all TABLE_RULES to the table of the context'''
+
+    violations = []
+
+    for rule in TABLE_RULES:
+        rule_violations = rule(context)
+        violations += rule_violations
+
+        # all other rules depend on the expected columns being present
+        if rule is check_valid_columns and rule_violations:
+            break
+
+    return violations
+
+class StreamingValidator:
+    '''Check a .tsv file row by row against all rules from test_configs.json
+
+    The rows do not have to be kept in memory. Only the affected cells (and
+    the distinct values of columns with valid options) are stored. finish()
+    returns the same report as validate() would return for the whole file.
+
+    Parameters
+    ----------
+    tsv_path : str
+        Path to the .tsv file (only used for the file rules and the report).
+    columns : list of str
+        The header of the .tsv file.
+    test_configs : dict, optional
+        Validation rules. If None, the rules are read from the test_configs.json
+        file that is shipped with tcy. The default is None.
+    buffer_rows : int, optional
+        Maximal number of version specs that are kept in memory to find
+        conflicting duplicates (see tcy.streaming.ExternalSorter). The
+        default is None (tcy.streaming.DEFAULT_BUFFER_ROWS).
+    tmp_dir : str, optional
+        Directory for the temporary files of the version specs. The default
+        is None (the default directory of the tempfile module).
+
+    '''
+
+    def __init__(self,tsv_path,columns,test_configs=None,buffer_rows=None,tmp_dir=None):
+
+        if test_configs is None:
+            test_configs = load_test_configs()
+
+        self.report = ValidationReport(tsv_path)
+        for rule in FILE_RULES:
+            self.report.violations += rule({'tsv_path':tsv_path})
+
+        self.columns = list(columns)
+        self.excel_mapper = dict(zip(self.columns,string.ascii_uppercase))
+        self.configs = test_configs
+
+        # all other rules depend on the expected columns being present
+        header = Table(self.columns,{column:[] for column in self.columns})
+        column_violations = check_valid_columns({'valid_columns':test_configs['valid_columns'],'table':header})
+        self.report.violations += column_violations
+        self.active = not column_violations
+
+        self.positions = {column:i for i,column in enumerate(self.columns)}
+        self.valid_options = {column:set(options) for column,options in (test_configs['valid_options'] or {}).items()}
+        self.multi_options = {column:set(options) for column,options in (test_configs['multi_option_columns'] or {}).items()}
+
+        # affected cells for each rule (and column), and distinct values of columns with valid options
+        self.whitespace_cells = {column:[] for column in self.columns}
+        self.filled_out_cells = {column:[] for column in test_configs['filled_out_columns'] or []}
+        self.valid_options_cells = {column:[] for column in self.valid_options}
+        self.valid_options_values = {column:{} for column in self.valid_options}
+        self.multi_option_cells = {column:[] for column in self.multi_options}
+        self.dependency_cells = {source:{column:[] for column in other}
+                                 for source,other in (test_configs['column_dependencies'] or {}).items()}
+        self.conditional_cells = {(column,condition):{c:[] for c in other}
+                                  for column,condition_dict in (test_configs['conditional_column_dependencies'] or {}).items()
+                                  for condition,other in condition_dict.items()}
+
+        # invalid cells of every match spec column, and (package_name,position,spec,bug_flag)
+        # of all included conda packages with a valid spec (see find_conflicting_duplicates).
+        # The entries are sorted by package_name on disk, so they do not have to fit into memory
+        self.match_spec_cells = {column:[] for column in test_configs.get('match_spec_columns') or []}
+        self.match_spec_entries = {}
+        if self.match_spec_cells:
+            from .streaming import ExternalSorter, DEFAULT_BUFFER_ROWS
+            self.match_spec_entries = {column:ExternalSorter(buffer_rows or DEFAULT_BUFFER_ROWS,tmp_dir)
+                                       for column in self.match_spec_cells}
+        self.invalid_specs = set()
+
+    def add(self,position,row):
+        '''Check a single row. position is the position of the row in the
+        file (0 is the first row after the header)'''
+
+        if not self.active:
+            return
+
+        pos = self.positions
+        excel_row = position + 2
+
+        for column,value in zip(self.columns,row):
+            if has_whitespace(value):
+                self.whitespace_cells[column].append(f"{self.excel_mapper[column]}{excel_row}")
+
+        for column,cells in self.filled_out_cells.items():
+            if row[pos[column]] is None:
+                cells.append(f"{self.excel_mapper[column]}{excel_row}")
+
+        for column,allowed in self.valid_options.items():
+            value = row[pos[column]]
+            value = 'nan' if value is None else value
+            self.valid_options_values[column].setdefault(value)
+            if value not in allowed:
+                self.valid_options_cells[column].append(f"{self.excel_mapper[column]}{excel_row}")
+
+        for column,allowed in self.multi_options.items():
+            if not is_valid_multi_option(row[pos[column]],allowed):
+                self.multi_option_cells[column].append(f"{self.excel_mapper[column]}{excel_row}")
+
+        for source,other in self.dependency_cells.items():
+            if row[pos[source]] is not None:
+                for column,cells in other.items():
+                    if row[pos[column]] is None:
+                        cells.append(f"{self.excel_mapper[column]}{excel_row}")
+
+        for (column,condition),other in self.conditional_cells.items():
+            if row[pos[column]] == condition:
+                for c,cells in other.items():
+                    if row[pos[c]] is None:
+                        cells.append(f"{self.excel_mapper[c]}{excel_row}")
+
+        if self.match_spec_cells and row[pos['package_manager']] == 'conda':
+            for column,cells in self.match_spec_cells.items():
+                spec = row[pos[column]]
+                if spec is None:
+                    continue
+                if self._is_invalid_spec(spec):
+                    cells.append(f"{self.excel_mapper[column]}{excel_row}")
+                    continue
+                include = row[pos['include']]
+                if include is not None and include.lower() == 'true':
+                    self.match_spec_entries[column].add((row[pos['package_name']],position),
+                                                        (row[pos['package_name']],position,spec,row[pos['bug_flag']]))
+
+    def _is_invalid_spec(self,spec):
+        '''True if a spec cannot be compiled (valid specs are cached by tcy.matchspec)'''
+
+        if spec in self.invalid_specs:
+            return True
+        try:
+            parse_constraint(spec)
+        except ValueError:
+            self.invalid_specs.add(spec)
+            return True
+        return False
+
+    def finish(self):
+        '''Returns the ValidationReport for all rows that were added'''
+
+        if not self.active:
+            return self.report
+
+        violations = self.report.violations
+
+        # cells are reported column by column (like get_affected_cells does)
+        cells = [cell for column_cells in self.whitespace_cells.values() for cell in column_cells]
+        if cells:
+            violations.append(whitespace_violation(cells))
+
+        cells = [cell for column_cells in self.filled_out_cells.values() for cell in column_cells]
+        if cells:
+            violations.append(filled_out_violation(cells))
+
+        for column,options in (self.configs['valid_options'] or {}).items():
+            if self.valid_options_cells[column]:
+                violations.append(valid_options_violation(column,options,list(self.valid_options_values[column]),
+                                                          self.valid_options_cells[column]))
+
+        for column,options in (self.configs['multi_option_columns'] or {}).items():
+            if self.multi_option_cells[column]:
+                violations.append(multi_option_violation(column,options,self.multi_option_cells[column]))
+
+        for source,other in self.dependency_cells.items():
+            cells = [cell for column_cells in other.values() for cell in column_cells]
+            if cells:
+                violations.append(column_dependency_violation(source,cells))
+
+        for (column,condition),other in self.conditional_cells.items():
+            cells = [cell for column_cells in other.values() for cell in column_cells]
+            if cells:
+                violations.append(conditional_dependency_violation(column,condition,cells))
+
+        for column,cells in self.match_spec_cells.items():
+            if cells:
+                violations.append(match_spec_violation(column,cells))
+
+        for column,entries in self.match_spec_entries.items():
+            letter = self.excel_mapper[column]
+
+            # only packages that are listed more than once can conflict. Conflicts are
+            # reported in the order in which the packages first appear (like validate())
+            conflicts = []
+            try:
+                for _,package_entries in groupby(entries,key=itemgetter(0)):
+                    package_entries = list(package_entries)
+                    if len(package_entries) > 1:
+                        conflicts += [(package_entries[0][1],conflict)
+                                      for conflict in find_conflicting_duplicates(package_entries)]
+            finally:
+                entries.close()
+
+            conflicts.sort(key=itemgetter(0))
+            for _,(package_name,operating_systems,rows) in conflicts:
+                violations.append(conflicting_duplicates_violation(package_name,operating_systems,[spec for _,spec in rows],
+                                                                   [f"{letter}{position + 2}" for position,_ in rows]))
+
+        return self.report
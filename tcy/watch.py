@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+Watch packages.tsv and rewrite the environment files whenever it is saved
+
+Notes:
+
+- The parsed and validated table and its selection indexes (see
+  tcy.catalog) stay in memory between saves. Lines of the .tsv file are
+  cached by their content, so only lines that were added or changed are
+  parsed again (files with quoted cells are always parsed as a whole). Only
+  rows that did not pass the last validation are validated again (see
+  validate(..., known_hashes=...)).
+- The environment files of all targets are rendered in memory. A file is
+  only written when its content differs from the file on disk, so editors
+  and build tools do not see modification times change for nothing.
+- On Linux, changes are detected with inotify (through ctypes). On other
+  platforms, or if inotify is not available, the modification time and size
+  of the .tsv file are polled. The directory of the .tsv file is watched
+  (not the file itself), because many editors save by replacing the file.
+- Bursts of events (e.g. an editor that writes a backup and then the file)
+  are debounced: the files are only updated when no further change has
+  happened for the debounce interval.
+
+Usage:
+
+    tcy watch linux --tsv_path ./environments/packages.tsv --yml_dir ./environments
+    tcy watch targets.json --tsv_path ./environments/packages.tsv
+
+@author: Johannes.Wiesner
+"""
+
+import os
+import sys
+import time
+
+from .batch import load_targets, check_targets
+from .catalog import Catalog
+from .render import write_atomic
+from .table import Table, NA_VALUES, read_tsv
+from .tcy import write_environment_files
+from .validation import validate, load_test_configs
+
+# inotify event masks (see /usr/include/linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+class _Inotify:
+    '''Reports changes of a single file through inotify (Linux only)'''
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self,path):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',use_errno=True)
+        self.file_name = os.fsencode(os.path.basename(path))
+
+        # IN_NONBLOCK and IN_CLOEXEC have the same values as O_NONBLOCK and O_CLOEXEC
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(),'inotify_init1 failed')
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd,os.fsencode(directory),self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno,f"Cannot watch {directory}")
+
+    def wait(self,timeout=None):
+        '''Returns True if the file changed within timeout seconds (None waits forever)'''
+
+        import select
+        import struct
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(),0)
+            if not select.select([self.fd],[],[],remaining)[0]:
+                return False
+
+            changed = False
+            try:
+                while True:
+                    events = os.read(self.fd,65536)
+                    offset = 0
+                    while offset < len(events):
+                        _,_,_,length = struct.unpack_from('iIII',events,offset)
+                        name = events[offset + 16:offset + 16 + length].rstrip(b'\0')
+                        changed = changed or name == self.file_name
+                        offset += 16 + length
+            except BlockingIOError:
+                pass
+
+            if changed:
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+class _Poller:
+    '''Reports changes of a single file by polling its modification time and size'''
+
+    def __init__(self,path,interval=0.5):
+        self.path = path
+        self.interval = interval
+        self.signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns,stat.st_size,stat.st_ino
+
+    def wait(self,timeout=None):
+        '''Returns True if the file changed within timeout seconds (None waits forever)'''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            signature = self._stat()
+            if signature != self.signature:
+                self.signature = signature
+                return True
+
+            remaining = self.interval if deadline is None else min(self.interval,deadline - time.monotonic())
+            if remaining <= 0:
+                return False
+            time.sleep(remaining)
+
+    def close(self):
+        pass
+
+def open_file_events(path,polling=False,poll_interval=0.5):
+    '''Returns an object whose wait(timeout) method reports changes of path.
+    Uses inotify where possible and falls back to polling'''
+
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return _Inotify(path)
+        except (OSError,AttributeError):
+            pass
+
+    return _Poller(path,poll_interval)
+
+class Watcher:
+    '''Keeps a validated packages.tsv file in memory and rewrites the
+    environment files of all targets when it changes
+
+    Parameters
+    ----------
+    tsv_path : str
+        Path to the packages.tsv file.
+    targets : list of dict
+        Each target is a dictionary with the arguments of run() (without
+        tsv_path and engine), see tcy batch. 'operating_system' is required.
+    log : callable, optional
+        Called with a message after every update. The default is print.
+
+    '''
+
+    def __init__(self,tsv_path,targets,log=print):
+        check_targets(targets)
+
+        self.tsv_path = tsv_path
+        self.targets = targets
+        self.log = log
+        self.test_configs = load_test_configs()
+
+        # resident state of the last update
+        self.text = None
+        self.header = None
+        self.rows = {}
+        self.table = None
+        self.catalog = None
+        self.known_hashes = None
+        self.outputs = {}
+
+    def _parse(self,text):
+        '''Returns the table of the .tsv file. Lines that did not change since
+        the last update are taken from the cache'''
+
+        # the csv module is needed for quoted cells, which may even span lines
+        if '"' in text or '\r' in text.replace('\r\n','\n'):
+            return read_tsv(self.tsv_path)
+
+        lines = text.replace('\r\n','\n').split('\n')
+        header = lines[0].split('\t')
+
+        # cached rows were padded to the length of the old header
+        if header != self.header:
+            self.header = header
+            self.rows = {}
+
+        n_columns = len(header)
+        cache = self.rows
+        rows = {}
+
+        for line_number,line in enumerate(lines[1:],start=2):
+
+            # blank lines are skipped (like tcy.table.iter_tsv does)
+            if not line:
+                continue
+
+            row = cache.get(line)
+            if row is None:
+                row = line.split('\t')
+                if len(row) > n_columns:
+                    raise ValueError(f"Error tokenizing {self.tsv_path}: expected {n_columns} "
+                                     f"fields in line {line_number}, saw {len(row)}")
+                row += [''] * (n_columns - len(row))
+                row = [None if cell in NA_VALUES else cell for cell in row]
+
+            rows[line] = row
+
+        # lines that were removed from the file are forgotten
+        self.rows = rows
+        ordered = [rows[line] for line in lines[1:] if line]
+        columns = [list(values) for values in zip(*ordered)] or [[] for _ in header]
+
+        return Table(header,dict(zip(header,columns)))
+
+    def update(self):
+        '''Parse and validate the .tsv file (if it changed) and rewrite all
+        files whose content changed. Returns the paths of the written files'''
+
+        start = time.perf_counter()
+
+        with open(self.tsv_path,encoding='utf-8-sig',newline='') as f:
+            text = f.read()
+
+        if text != self.text:
+            table = self._parse(text) if text else read_tsv(self.tsv_path)
+
+            # rows that passed with another header have to be validated again
+            if self.table is None or table.columns != self.table.columns:
+                self.known_hashes = None
+
+            report = validate(self.tsv_path,self.test_configs,table,known_hashes=self.known_hashes or set())
+            if not report.ok:
+                self.log(str(report))
+                return []
+
+            self.text = text
+            self.table = report.table
+            self.catalog = Catalog(report.table)
+            self.known_hashes = set(report.row_hashes)
+
+        written_paths = []
+        removed_paths = []
+
+        for target in self.targets:
+            files = {}
+            removed = []
+            write_environment_files(self.catalog,**target,write=files.__setitem__,remove=removed.append)
+
+            for path,content in files.items():
+                if self._is_unchanged(path,content):
+                    continue
+                write_atomic(path,content)
+                self.outputs[os.path.abspath(path)] = (content,_get_signature(path))
+                written_paths.append(path)
+
+            # files of layers that became empty (see tcy.layers)
+            for path in removed:
+                self.outputs.pop(os.path.abspath(path),None)
+                if os.path.isfile(path):
+                    os.remove(path)
+                    removed_paths.append(path)
+
+        changes = []
+        if written_paths:
+            changes.append('wrote ' + ', '.join(written_paths))
+        if removed_paths:
+            changes.append('removed ' + ', '.join(removed_paths))
+
+        seconds = time.perf_counter() - start
+        self.log(f"{self.tsv_path}: {len(self.table)} rows, "
+                 f"{', '.join(changes) if changes else 'no files changed'} "
+                 f"({seconds * 1000:.1f} ms)")
+
+        return written_paths
+
+    def _is_unchanged(self,path,content):
+        '''True if the file on disk already has this content'''
+
+        key = os.path.abspath(path)
+        cached = self.outputs.get(key)
+        signature = _get_signature(path)
+
+        # the file was written by the last update and has not been touched since
+        if cached is not None and signature is not None and cached == (content,signature):
+            return True
+
+        try:
+            with open(path,newline='') as f:
+                unchanged = f.read() == content
+        except OSError:
+            return False
+
+        if unchanged:
+            self.outputs[key] = (content,signature)
+
+        return unchanged
+
+    def watch(self,debounce=0.1,polling=False,poll_interval=0.5):
+        '''Update all files now and then whenever the .tsv file changes (until interrupted)
+
+        Parameters
+        ----------
+        debounce : float, optional
+            Seconds without further changes after which the files are
+            updated. The default is 0.1.
+        polling : bool, optional
+            If True, poll the .tsv file even if inotify is available. The
+            default is False.
+        poll_interval : float, optional
+            Seconds between two polls. The default is 0.5.
+
+        '''
+
+        events = open_file_events(self.tsv_path,polling,poll_interval)
+
+        try:
+            self._safe_update()
+            while True:
+                if not events.wait():
+                    continue
+                while events.wait(debounce):
+                    pass
+                self._safe_update()
+        finally:
+            events.close()
+
+    def _safe_update(self):
+        '''Report errors instead of ending the watch (e.g. when the file is
+        saved while it is half-written or deleted)'''
+
+        try:
+            self.update()
+        except (OSError,ValueError,TypeError) as e:
+            self.log(f"{self.tsv_path}: {e}")
+
+def _get_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns,stat.st_size
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tcy watch',
+                                     description='Rewrite the environment files whenever packages.tsv changes')
+    parser.add_argument('targets',type=str,
+                        help="Either an operating system ('linux' or 'windows') or the path \
+                        to a .json file with a list of targets (see 'tcy batch --help').")
+    parser.add_argument('--tsv_path',type=str,required=False,default='./packages.tsv',
+                        help='Optional Path to the input packages.tsv file. \
+                        If not otherwise specified, the function will expect packages.tsv \
+                        to be in the current working directory.')
+    parser.add_argument('--yml_name',type=str,required=False,
+                        help="Sets the \"name:\" attribute of the .yml file (only used if \
+                        targets is an operating system).")
+    parser.add_argument('--yml_file_name',type=str,required=False,default='environment.yml',
+                        help='Sets the name of the .yml file (only used if targets is an \
+                        operating system). The default is environment.yml')
+    parser.add_argument('--yml_dir',type=str,required=False,
+                        help='Directory of the .yml file (only used if targets is an operating system).')
+    parser.add_argument('--languages',type=str,required=False,default='all',nargs='+',
+                        help="Filter for certain programming languages (only used if targets \
+                        is an operating system).")
+    parser.add_argument('--debounce',type=float,required=False,default=0.1,
+                        help='Seconds without further changes after which the files are \
+                        updated. The default is 0.1')
+    parser.add_argument('--polling',action='store_true',
+                        help='Poll the .tsv file instead of using inotify.')
+    parser.add_argument('--poll_interval',type=float,required=False,default=0.5,
+                        help='Seconds between two polls. The default is 0.5')
+
+    args = parser.parse_args(argv)
+
+    if args.targets in ('linux','windows'):
+        targets = [{'operating_system':args.targets,
+                    'yml_name':args.yml_name,
+                    'yml_file_name':args.yml_file_name,
+                    'yml_dir':args.yml_dir,
+                    'languages':args.languages}]
+    else:
+        try:
+            targets = load_targets(args.targets)
+        except (OSError,ValueError) as e:
+            sys.exit(str(e))
+
+    try:
+        watcher = Watcher(args.tsv_path,targets)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    try:
+        watcher.watch(args.debounce,args.polling,args.poll_interval)
+    except KeyboardInterrupt:
+        pass